@@ -11,6 +11,10 @@ import fnmatch
 import pandas as pd
 from math import isnan
 
+from eventio import read_events
+from eventio import event_columns
+from catalog import job_catalog, catalog_file
+
 
 # This python code is made to have a single place for all the
 # essential functions needed for the accelerated MC analysis.
@@ -23,47 +27,42 @@ class energy:
             energy = energy of the gamma-ray in keV
             edep_max = maximum energy deposit in the xenon (keV)
             T = type of simulation normal simulation: 'sim' reference simulation: 'ref'
+            catalog = job catalog database [Default = ~/FastMC/runit/jobs_master.sqlite]. The jobs of
+                      ~/FastMC/runit/jobs_master.xlsx are imported when the spreadsheet is new or changed
         """
         #
         self.energy = kwargs.pop('energy', 1000)
         self.edep_max = kwargs.pop('edep_max', 2700)
         self.T = kwargs.pop('Type', 'sim')
+        fn = kwargs.pop('catalog', catalog_file)
+
+        self.catalog = job_catalog(fn)
+        # the catalog may already exist (e.g. made by generate_jobs.py) without the master list
+        xlsx = os.path.expanduser('~/FastMC/runit/jobs_master.xlsx')
+        if os.path.exists(xlsx):
+            self.catalog.import_xlsx(xlsx, if_changed=True)
 
         return
 
     def select_file(self, nevents, family_number, vrt='fiducial_scatter', size_fiducial='Normal '):
         """
-        Read the excel file and find the relevant file
+        Query the job catalog and find the relevant file
         :param:
             nevents = size of the simulation
             family_number = which file of the 10 identical files
         :return:
             the filename of the relevant file (string)
         """
-        df = pd.read_excel('~/FastMC/runit/jobs_master.xlsx')
-        df = df.loc[df['energy'] == self.energy]
-        if len(df) == 0:
-            raise (Exception('No such energy'))
-
-        df = df.loc[df['vrt'] == vrt]
-        if len(df) == 0:
-            raise (Exception('No such file'))
-
         if vrt == 'fiducial_scatter':
-            df = df.loc[df['edep_max'] == self.edep_max]
-            df = df.loc[df['size_fiducial'] == size_fiducial]
-        if len(df) == 0:
-            raise (Exception('No such edep_max'))
-
-        df = df.loc[df['nevents'] == nevents]
-        if len(df) == 0:
-            raise (Exception('No such nevents'))
-        df = df.loc[df['type'] == self.T]
-        if len(df) == 0:
-            raise (Exception('No such ref/sim file'))
-        df = df.loc[df['family_number'] == family_number]
+            df = self.catalog.select(['output'], energy=self.energy, vrt=vrt, edep_max=self.edep_max,
+                                     size_fiducial=size_fiducial, nevents=nevents, type=self.T,
+                                     family_number=family_number)
+        else:
+            df = self.catalog.select(['output'], energy=self.energy, vrt=vrt, nevents=nevents, type=self.T,
+                                     family_number=family_number)
         if len(df) == 0:
-            raise (Exception('No such family number'))
+            raise (Exception('No such file: energy=%s vrt=%s edep_max=%s nevents=%s type=%s family_number=%s' %
+                             (self.energy, vrt, self.edep_max, nevents, self.T, family_number)))
 
         # print(df['output'].values[0])
 
@@ -77,18 +76,11 @@ class energy:
         :return:
             family size (int)
         """
-        df = pd.read_excel('~/FastMC/runit/jobs_master.xlsx')
-        df = df.loc[df['energy'] == self.energy]
-        df = df.loc[df['vrt'] == vrt]
-        df = df.loc[df['type'] == self.T]
-
         if vrt == 'fiducial_scatter':
-            df = df.loc[df['edep_max'] == self.edep_max]
-            df = df.loc[df['size_fiducial'] == size_fiducial]
-
-        df = df.loc[df['nevents'] == nevents]
+            return self.catalog.count(energy=self.energy, vrt=vrt, type=self.T, edep_max=self.edep_max,
+                                      size_fiducial=size_fiducial, nevents=nevents)
 
-        return len(df)
+        return self.catalog.count(energy=self.energy, vrt=vrt, type=self.T, nevents=nevents)
 
     def find_ns(self):
         """
@@ -97,10 +89,7 @@ class energy:
         :return:
             size of all simulations (NumPy array)
         """
-        df = pd.read_excel('~/FastMC/runit/jobs_master.xlsx')
-        df = df.loc[df['energy'] == self.energy]
-        df = df.loc[df['edep_max'] == self.edep_max]
-        return df['nevents'].unique()
+        return np.array(self.catalog.distinct('nevents', energy=self.energy, edep_max=self.edep_max))
 
     def total_weight(self, nevents, vrt='fiducial_scatter', size_fiducial='Normal ', famsize=10):
         """
@@ -119,13 +108,21 @@ class energy:
             # find file
             file = self.select_file(nevents=nevents, family_number=i, vrt=vrt, size_fiducial=size_fiducial)
             print(i)
-            # read file into pandas data-frame with standard headings
-            df = pd.read_csv(file + '.csv',
-                             names=['#', 'nscatters', 'w', 'de', 'x0', 'y0', 'z0', 'x1', 'y1', 'z1', 'de1', 't1', 'x2',
-                                    'y2', 'z2', 'de2', 't2', 'x3', 'y3', 'z3', 'de3', 't3', 'x4', 'y4', 'z4', 'de4',
-                                    't4'], error_bad_lines=False)
+            # read only the needed columns from the columnar event file, fall back to csv
+            if os.path.exists(file + '.npz'):
+                df = read_events(file + '.npz', columns=['nscatters', 'w', 'de', 'x1', 'y1', 'z1'])
+                # weights are stored as float32, sum them in double precision
+                df['w'] = df['w'].astype(np.float64)
+            else:
+                # read file into pandas data-frame with the headings of the event_generator layout. The
+                # columns are selected by position, so files with the extra e0 column of a line source work too
+                names = event_columns()
+                usecols = ['nscatters', 'w', 'de', 'x1', 'y1', 'z1']
+                df = pd.read_csv(file + '.csv', header=None, usecols=[names.index(c) for c in usecols],
+                                 on_bad_lines='skip')
+                df.columns = [names[i] for i in df.columns]
             # insert r^2 component
-            df.insert(10, 'r2_1', df['x1'] ** 2 + df['y1'] ** 2)
+            df['r2_1'] = df['x1'] ** 2 + df['y1'] ** 2
 
             # Loop to make appropriate cuts for different fiducial volumes.
             # They are not used in the current analysis.
@@ -0,0 +1,456 @@
+import os
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from scipy.stats import chisquare
+
+from eventio import read_events, iter_events, read_meta
+
+# columns needed for the cuts and the energy histograms (read_file(columns=analysis_columns) reads only these)
+analysis_columns = ['nscatters', 'w', 'de', 'x1', 'y1', 'z1', 'de1', 'x2', 'y2', 'z2', 'de2',
+                    'x3', 'y3', 'z3', 'de3', 'x4', 'y4', 'z4', 'de4']
+# column names of the reference and simulation csv files
+ref_names = ['#', 'nscatters', 'w', 'de', 'x0', 'y0', 'z0', 'x1', 'y1', 'z1', 'de1',
+             'x2', 'y2', 'z2', 'de2', 'x3', 'y3', 'z3', 'de3', 'x4', 'y4', 'z4', 'de4']
+sim_names = ref_names + ['a']
+# fiducial volume of the cuts: r^2 < 57^2 cm2, |z| < 67 cm
+r2_fiducial = 3249
+z_fiducial = 67
+
+
+class analysis:
+    def __init__(self, **kwargs):
+        """
+
+        Initialize a analysis
+        :param kwargs:
+            nevents_ref: Select which file you want to use as a reference file.
+            nevents_sim: size of simulation that is used
+            vrt: if want to use a variance reduction simulation(anything) or a normal MC(None)
+            nscatter: if the file is a vrt-sim specify the number of scatters of the gamma-rays (integers 1,2,3)
+            rseed: if you want to use the file with a random seed(anything) or not(None)
+            chunk_size: number of rows per chunk for the out-of-core scans (scan_file) [Default = 1000000]
+            nbins: number of bins of the energy histograms [Default = 100]
+            erange: (emin, emax) of the energy histograms in keV [Default = None -> range of the reference file]
+
+
+        """
+
+        self.nevents_ref = kwargs.pop('nevents_ref', 10000001)
+        self.nevents_sim = kwargs.pop('nevents_sim', 100000)
+        self.vrt = kwargs.pop('vrt', None)
+        self.nscatter = kwargs.pop('nscatter', 1)
+        self.rseed = kwargs.pop('rseed', None)
+        self.ecut = kwargs.pop('ecut',None)
+        self.chunk_size = int(kwargs.pop('chunk_size', 1000000))
+        self.nbins = kwargs.pop('nbins', 100)
+        self.erange = kwargs.pop('erange', None)
+
+    def load_ref_file(self, columns=None):
+        """
+        Load in the data that is used as a reference.
+        In general this is a large nevent non-vrt simulation is used
+
+        :param nevents: Select which file you want to use as a reference file.
+         all reference files are non-vrt and therefore only the size matters for selection.
+        :param columns: columns to read, e.g. analysis_columns [Default = None -> all columns]
+
+        :return df: returns pandas dataframe with all the events
+
+        """
+
+        self.ref_df = self.read_file(self.ref_file_name(), names=ref_names, columns=columns)
+
+        return (self.ref_df)
+
+    def ref_file_name(self):
+        """
+        :return: name of the reference file
+        """
+        return '../mcdata/Reference files/Reference%i.csv' % self.nevents_ref
+
+    def sim_file_name(self):
+        """
+        :return: name of the simulation file for the nevents_sim, vrt, nscatter and ecut settings
+        """
+        if self.vrt == None:
+            file = '../mcdata/wo_rseed/testdata' + str(self.nevents_sim) + '.csv'  # wo_rseed
+        else:
+            if self.ecut == 250:
+                file = '../mcdata/wo_rseed/VRT_edep_max250/testdata' + str(self.nevents_sim) + '_' + str(
+                    self.nscatter) + '.csv'  # wo_rseed_vrt
+            else:
+                file = '../mcdata/wo_rseed/VRT/testdata' + str(self.nevents_sim) + '_' + str(
+                    self.nscatter) + '.csv'  # wo_rseed_vrt_with Edep max cut
+
+        return file
+
+    def load_file(self, columns=None):
+        """
+        load a data file that is used for further analysis
+
+        :param nevents: size of simulation that is used
+        :param vrt: if want to use a variance reduction simulation(anything) or a normal MC(None)
+        :param nscatter: if the file is a vrt-sim specify the number of scatters of the gamma-rays (integers)
+        :param rseed: if you want to use the file with a random seed(anything) or not(None)
+        :param columns: columns to read, e.g. analysis_columns [Default = None -> all columns]
+
+
+
+        :return df: returns pandas dataframe with all the events
+
+        """
+
+        file = self.sim_file_name()
+        print(file)
+        self.sim_df = self.read_file(file, names=sim_names, columns=columns)
+
+        return (self.sim_df)
+
+    def read_file(self, file, names, columns=None):
+        """
+        Read an event file. A columnar .npz file next to the csv file is preferred. The r squared
+        coordinates of the first 4 scatters are added
+
+        :param file: csv file name
+        :param names: column names of the csv file
+        :param columns: columns to read, e.g. analysis_columns (needs x1..y3) [Default = None -> all columns]
+
+        :return df: returns pandas dataframe with all the events
+
+        """
+        npz = os.path.splitext(file)[0] + '.npz'
+        if os.path.exists(npz):
+            df = read_events(npz, columns=columns)
+            # weights are stored as float32, sum them in double precision
+            df['w'] = df['w'].astype(np.float64)
+        else:
+            df = pd.read_csv(file, names=names, usecols=columns, on_bad_lines='skip')
+
+        r2 = [('r2_1', df['x1'] ** 2 + df['y1'] ** 2), ('r2_2', df['x2'] ** 2 + df['y2'] ** 2),
+              ('r2_3', df['x3'] ** 2 + df['y3'] ** 2), ('r2_4', df['x3'] ** 2 + df['y3'] ** 2)]
+        if columns is None:
+            # the layout of the full files: r2_k before de_k
+            for name, value in r2:
+                df.insert(df.columns.get_loc('de' + name[-1]), name, value)
+        else:
+            for name, value in r2:
+                df[name] = value
+
+        return df
+
+    def cut_mask(self, df):
+        """
+        Fiducial and nscatter selection of cuts() as a boolean mask
+
+        :param df: pandas dataframe with (at least) nscatters and the x, y, z of the first nscatter interactions
+
+        :return mask: boolean array, True for the selected events
+        """
+        if self.nscatter not in (1, 2, 3):
+            print('nscatter is out of range possible values are 1,2,3')
+            return np.zeros(len(df), dtype=bool)
+
+        mask = (df['nscatters'] == self.nscatter).to_numpy()
+        for k in range(1, self.nscatter + 1):
+            x, y, z = df['x%i' % k].to_numpy(), df['y%i' % k].to_numpy(), df['z%i' % k].to_numpy()
+            mask &= (x ** 2 + y ** 2 < r2_fiducial) & (abs(z) < z_fiducial)
+
+        return mask
+
+    def iter_file(self, file, names, columns):
+        """
+        Scan an event file in chunks of chunk_size rows. Only the requested columns are read and only the
+        events with the selected number of scatters are returned. A columnar .npz file next to the csv file
+        is preferred: the nscatters column is read first and the other columns only for chunks with
+        selected events
+
+        :param file: csv file name
+        :param names: column names of the csv file
+        :param columns: columns to read (nscatters is always read)
+
+        :return: number of events in the file, generator of dataframes with the events with nscatter scatters
+        """
+        columns = list(dict.fromkeys(['nscatters'] + list(columns)))
+        select = lambda df: df['nscatters'] == self.nscatter
+
+        npz = os.path.splitext(file)[0] + '.npz'
+        if os.path.exists(npz):
+            # skipped chunks are not read, the number of events comes from the metadata
+            return read_meta(npz)['nevent'], iter_events(npz, columns=columns, where=select,
+                                                         where_columns=['nscatters'])
+
+        chunks = (df[select(df)] for df in pd.read_csv(file, names=names, usecols=columns,
+                                                       chunksize=self.chunk_size, on_bad_lines='skip'))
+        return self.count_lines(file), chunks
+
+    @staticmethod
+    def count_lines(file):
+        """
+        Number of lines of a text file, without parsing it
+
+        :param file: file name
+        :return: int
+        """
+        n = 0
+        last = b'\n'
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 24), b''):
+                n += block.count(b'\n')
+                last = block[-1:]
+
+        # last line without a newline
+        return n + (last != b'\n')
+
+    def scan_file(self, file, names):
+        """
+        Out-of-core version of read_file + cuts + the energy histogram of plot: the file is scanned in chunks
+        and only the weight sums and the histogram of the selected events are kept, so memory does not grow
+        with the file size
+
+        :param file: csv file name
+        :param names: column names of the csv file
+
+        :return scan: dictionary with
+            nevent = number of events in the file
+            npass = number of events passing the cuts
+            sum_w, sum_w2 = sum of weights and squared weights of the selected events
+            edges, hist, hist_w2 = weighted histogram (and sum of squared weights per bin) of de1..de4
+        """
+        de_x = ['de%i' % k for k in range(1, self.nscatter + 1)]
+        xyz = ['%s%i' % (c, k) for k in range(1, self.nscatter + 1) for c in 'xyz']
+
+        if self.erange is None:
+            #
+            # histogram range from the selected events (extra pass over the energy columns only)
+            #
+            emin, emax = np.inf, -np.inf
+            for df in self.iter_file(file, names, ['w'] + xyz + de_x)[1]:
+                de = df[de_x][self.cut_mask(df)].to_numpy()
+                if np.isfinite(de).any():
+                    emin, emax = min(emin, np.nanmin(de)), max(emax, np.nanmax(de))
+            self.erange = (emin, emax) if emin < emax else (0.0, 1.0)
+
+        edges = np.linspace(self.erange[0], self.erange[1], self.nbins + 1)
+        nevent, chunks = self.iter_file(file, names, ['w'] + xyz + de_x)
+        scan = {'nevent': nevent, 'npass': 0, 'sum_w': 0.0, 'sum_w2': 0.0, 'edges': edges,
+                'hist': np.zeros(self.nbins), 'hist_w2': np.zeros(self.nbins)}
+
+        for df in chunks:
+            df = df[self.cut_mask(df)]
+            w = df['w'].to_numpy(dtype=np.float64)
+            scan['npass'] += len(df)
+            scan['sum_w'] += w.sum()
+            scan['sum_w2'] += (w ** 2).sum()
+            for j in de_x:
+                de = df[j].to_numpy(dtype=np.float64)
+                scan['hist'] += np.histogram(de, bins=edges, weights=w)[0]
+                scan['hist_w2'] += np.histogram(de, bins=edges, weights=w ** 2)[0]
+
+        return scan
+
+    def scan_ref_file(self):
+        """
+        Out-of-core scan of the reference file, see scan_file
+
+        :return scan: dictionary with the counters and histogram of the selected events
+        """
+        self.ref_scan = self.scan_file(self.ref_file_name(), names=ref_names)
+
+        return self.ref_scan
+
+    def scan_sim_file(self):
+        """
+        Out-of-core scan of the simulation file, see scan_file
+
+        :return scan: dictionary with the counters and histogram of the selected events
+        """
+        self.sim_scan = self.scan_file(self.sim_file_name(), names=sim_names)
+
+        return self.sim_scan
+
+    def plot_scan(self, ref_scan, sim_scan):
+        """
+        Same as plot, from the histograms of scan_file
+
+        :param ref_scan: output of scan_file for the reference file
+        :param sim_scan: output of scan_file for the simulation file
+
+        :return:
+        """
+        # n_sim / n_ref with n = number of selected events / efficiency = number of events in the file
+        self.scalling = sim_scan['nevent'] / max(ref_scan['nevent'], 1)
+        print(self.scalling)
+
+        edges = ref_scan['edges']
+        centers = edges[:-1]
+        self.plotarray_ref = np.array([ref_scan['hist'] * self.scalling, edges], dtype=object)
+        plt.plot(centers, self.plotarray_ref[0], marker='o', markersize=3, linestyle='None')
+
+        plt.hist(sim_scan['edges'][:-1], bins=sim_scan['edges'], weights=sim_scan['hist'], histtype='step')
+        self.plotarray_sim = np.array([sim_scan['hist'], sim_scan['edges']], dtype=object)
+
+        plt.xlabel('$E_{dep}$ in fiducial (keV)')
+        plt.yscale('log')
+        plt.title('total energy distribution')
+
+        return
+
+    def cuts(self, df):
+        """
+        When using a non-vrt simulation cuts need to be made in order to compare it with a vrt sim
+
+        :param df: input the pandas dataframe with the events
+
+
+
+
+        :return df: returns pandas dataframe with all the events after the cuts
+        :return efficiency_factor: the factor about the fraction of events left after the cut
+                compared to the total before the cuts
+
+        """
+
+        dfcut = df[self.cut_mask(df)]
+
+        rows_bc = len(df)
+        # get the number of events from the dataframe before the cuts
+        rows_ac = len(dfcut)  # and number after the cuts
+        # print(rows_ac)
+
+        efficiency_factor = rows_ac / rows_bc
+
+        return (dfcut, efficiency_factor)
+
+    def plot(self, df_ref, df_sim):
+        """
+        Make energy distribution of the selected data
+
+        :param df: input the pandas dataframe with the events
+        :param scalling: Default value of 1, but if its the reference file
+        use scaling to scale distribution to the desired size
+
+        :return plotarray: numpy array of the energy distribution +(plot)
+        """
+        self.df_ref = self.cuts(df_ref)
+        self.df_sim = self.cuts(df_sim)
+
+        self.scalling = self.scaling(self.df_ref, self.df_sim)
+
+        print(self.scaling)
+
+        de_x = ['de1', 'de2', 'de3', 'de4']
+        nb = 100
+
+        self.tde_sim = list(self.df_sim[0]['de1'])
+        self.tw_sim = list(self.df_sim[0]['w'])
+        self.tde_ref = list(self.df_ref[0]['de1'])
+        self.tw_ref = list(self.df_ref[0]['w'])
+
+        for j in de_x[1:4]:
+            self.tde_sim.extend(self.df_sim[0][j])
+            self.tw_sim.extend(self.df_sim[0]['w'])
+            self.tde_ref.extend(self.df_ref[0][j])
+            self.tw_ref.extend(self.df_ref[0]['w'])
+
+        self.plotarray_ref = np.array(plt.hist(self.tde_ref, weights=self.tw_ref, bins=nb, histtype='step'))
+        plt.clf()  # clear plot so the unscaled histogram will not show up
+
+        if self.scaling != 1:
+            plt.clf()
+            ref = self.plotarray_ref[0] * self.scalling
+            plt.plot(self.plotarray_ref[1][:-1], ref, marker='o', markersize=3, linestyle='None')
+            self.plotarray_ref[0] = ref
+
+        self.plot_sim = plt.hist(self.tde_sim, weights=self.tw_sim, bins=nb, histtype='step')
+        self.plotarray_sim = np.array(self.plot_sim)
+
+        plt.xlabel('$E_{dep}$ in fiducial (keV)')
+        plt.yscale('log')
+        plt.title('total energy distribution')
+
+        return
+
+    def scaling(self, ref, sim):
+        """
+    Calculate the scaling factor. This can be used to compare
+    the reference file with a simulation file
+
+
+        :param ref:use the output of the cut function on reference data (So data frame AND efficiency factor)
+        :param sim:use the output of the cut function on simulated data (So data frame AND efficiency factor)
+
+        :return scaling:
+        """
+
+        if len(ref) == 2:
+            # normal case where output of cut is used
+            # this should be the case when the ref file is a non vrt
+            size_ref = len(ref[0])
+            factor_ref = ref[1]
+
+        elif len(ref) > 100:
+            # In the case that the reference file is a vrt file
+            # and no cuts are made the factor is 1 (nothing is cut off).
+            # Print is to check if it's on purpose to use a non-cut data frame.
+
+            size_ref = len(ref)
+            factor_ref = 1
+            print('non cut data frame is used as reference file')
+
+        else:
+            # If something else is givens as a parameter
+            # for the reference file an error is printed
+
+            print('error: input should be cut output or data frame')
+
+        if len(sim) == 2:
+            # normal case where output of cut is used
+            # this should allays be the case when the ref file is a non vrt
+            size_sim = len(sim[0])
+            factor_sim = sim[1]
+
+        elif len(sim) > 100:
+            # In the case that the simulated file is a vrt file
+            # and no cuts are made the factor is 1 (nothing is cut off).
+
+            size_sim = len(sim)
+            factor_sim = 1
+
+        else:
+            print('error: input should be cut output or data frame')
+
+        n_ref = size_ref / factor_ref
+        n_sim = size_sim / factor_sim
+
+        scaling = n_sim / n_ref
+
+        return scaling
+
+    def chi2(self, df_ref, df_sim):
+        """
+        :param df: input the pandas dataframe with the events, or the outputs of scan_file
+        :param scalling: Default value of 1, but if its the reference file
+
+        :return:
+        """
+
+        if isinstance(df_ref, dict):
+            analysis.plot_scan(self, df_ref, df_sim)
+        else:
+            analysis.plot(self, df_ref, df_sim)
+        print(self.plotarray_sim[0])
+        print(self.plotarray_ref[0])
+
+        # chi2 of P.E. peak
+        chi2_PE = chisquare(max(self.plotarray_sim[0]),f_exp=max(self.plotarray_ref[0]))[0]
+        print(chi2_PE)
+
+        # chi2 of Compton
+        self.masked_ref = np.ma.masked_where(self.plotarray_ref[0] == 0, self.plotarray_ref[0])
+        self.masked_ref = np.ma.masked_where(self.plotarray_ref[0] == max(self.plotarray_sim[0]), self.masked_ref)
+
+        chi2_compton = chisquare(self.plotarray_sim[0], f_exp=self.masked_ref)[0] / self.masked_ref.count()
+
+        return (chi2_compton,chi2_PE)
+
@@ -0,0 +1,169 @@
+import numpy as np
+
+from physics import rotate_direction
+from cylinder import SURFACE_CYL
+
+#
+# Source direction biasing toward the fiducial volume.
+#
+# With the fiducial_scatter VRT a primary that misses the fiducial volume is killed, so only the directions
+# in the solid angle of the fiducial cylinder, seen from the starting point on the cryostat, contribute.
+# The source samples the directions uniformly in a cone that contains this solid angle, and gives the
+# photon the weight
+#
+#   w = (1 - cos(alpha)) / 2 = cone solid angle / 4 pi
+#
+# which is the ratio of the isotropic and the cone densities. The estimate is exact as long as the cone
+# contains every direction that hits the fiducial volume.
+#
+# The cone axis and half-angle alpha are tabulated as a function of z on the side of the cryostat and of
+# the radius on the top and bottom (both cylinders are centered at the origin, so the cone only turns with
+# the azimuth). Every cell between two nodes uses the axis of its lower node, chosen in the plane of the
+# node and the z-axis to minimize the largest angle to the two rim circles of the fiducial cylinder (its
+# extreme points). alpha is an upper bound: that largest angle plus the largest change of the angle
+# between the sampled rim points and over the cell. Cells where the bound reaches 90 degrees get the full
+# sphere.
+#
+
+# cache of the tables per (cryostat, fiducial) size
+cone_cache = {}
+
+
+def get_cone(geometry, fiducial):
+    """
+    :param geometry: cryostat cylinder
+    :param fiducial: fiducial volume cylinder
+    :return: fiducial_cone of the two cylinders (built once per size)
+    """
+    key = (geometry.radius, geometry.height, fiducial.radius, fiducial.height)
+    if key not in cone_cache:
+        cone_cache[key] = fiducial_cone(geometry=geometry, fiducial=fiducial)
+
+    return cone_cache[key]
+
+
+class fiducial_cone:
+    """
+    Cone bound of the fiducial volume seen from the cryostat surface
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Tabulate the cone axis and half-angle
+
+        :param kwargs:
+            geometry = cryostat cylinder
+            fiducial = fiducial volume cylinder
+            step = node distance of the table in cm [Default = 0.25]
+            nphi = number of points on the rim circles of the fiducial volume [Default = 2048]
+            npsi = number of cone axes tried per node [Default = 360]
+        """
+        cryostat = kwargs.pop('geometry')
+        fiducial = kwargs.pop('fiducial')
+        self.step = kwargs.pop('step', 0.25)
+        nphi = kwargs.pop('nphi', 2048)
+        npsi = kwargs.pop('npsi', 360)
+
+        self.radius = cryostat.radius
+        self.height = cryostat.height
+        R, h = fiducial.radius, fiducial.height
+
+        # smallest distance from the cryostat surface to the fiducial volume
+        gap = min(self.radius - R, (self.height - h) / 2)
+
+        # nodes: |z| on the side, radius on the top and bottom
+        z = np.arange(0., self.height / 2 + self.step, self.step)
+        r = np.arange(0., self.radius + self.step, self.step)
+        side = np.column_stack((np.full(len(z), self.radius), np.zeros(len(z)), z))
+        cap = np.column_stack((r, np.zeros(len(r)), np.full(len(r), self.height / 2)))
+        if gap <= 0:
+            print('fiducial_cone::__init__ ERROR the fiducial volume is not inside the cryostat. No biasing')
+            self.axis_side, self.cos_side = -side / np.linalg.norm(side, axis=1)[:, None], np.full(len(z), -1.0)
+            self.axis_cap, self.cos_cap = -cap / np.linalg.norm(cap, axis=1)[:, None], np.full(len(r), -1.0)
+            return
+
+        #
+        # the rim points are sampled in phi (by symmetry half of the circle suffices). The angle changes by
+        # at most R / gap per unit of phi, and by at most step / gap over a cell
+        #
+        phi = np.linspace(0., np.pi, nphi)
+        rim = np.concatenate([np.column_stack((R * np.cos(phi), R * np.sin(phi), np.full(nphi, zr)))
+                              for zr in (h / 2, -h / 2)])
+        margin = 0.5 * np.pi / (nphi - 1) * R / gap + self.step / gap
+
+        self.axis_side, self.cos_side = self.node_cone(side, rim, margin, npsi)
+        self.axis_cap, self.cos_cap = self.node_cone(cap, rim, margin, npsi)
+
+        return
+
+    @staticmethod
+    def node_cone(nodes, rim, margin, npsi):
+        """
+        :param nodes: points on the cryostat surface in the plane y = 0, array (n,3)
+        :param rim: points on the rim circles of the fiducial volume, array (m,3)
+        :param margin: change of the angle between the rim points and over a cell
+        :param npsi: number of axis directions that are tried
+        :return: cone axis (n,3) and cosine of the half-angle (n) per node (-1 = full sphere)
+        """
+        psi = np.linspace(0., 2 * np.pi, npsi, endpoint=False)
+        trial = np.column_stack((np.cos(psi), np.zeros(npsi), np.sin(psi)))
+        # coarse rim for the axis search
+        coarse = rim[::max(len(rim) // 512, 1)]
+
+        axis = np.empty((len(nodes), 3))
+        cosa = np.empty(len(nodes))
+        for i, p in enumerate(nodes):
+            d = coarse - p
+            d /= np.linalg.norm(d, axis=1)[:, None]
+            best = trial[np.argmax((trial @ d.T).min(axis=1))]
+
+            d = rim - p
+            cmin = (d @ best / np.linalg.norm(d, axis=1)).min()
+            alpha = np.arccos(np.clip(cmin, -1.0, 1.0)) + margin
+            axis[i] = best
+            # beyond 90 degrees the cone is not convex and no longer contains the hull of the rim circles
+            cosa[i] = np.cos(alpha) if alpha < 0.5 * np.pi else -1.0
+
+        return axis, cosa
+
+    def cone(self, x, surface):
+        """
+        :param x: points on the cryostat surface, array (n,3)
+        :param surface: surface ids of the points (SURFACE_CYL/TOP/BOT)
+        :return: cone axis (n,3) and cosine of the half-angle (n) at the points
+        """
+        side = surface == SURFACE_CYL
+        rho = np.hypot(x[:, 0], x[:, 1])
+        i = np.where(side, np.minimum((np.abs(x[:, 2]) / self.step).astype(np.int64), len(self.cos_side) - 1),
+                     np.minimum((rho / self.step).astype(np.int64), len(self.cos_cap) - 1))
+
+        # node axis (ax, 0, az) turned to the azimuth of the point, and mirrored for z < 0
+        ax = np.where(side, self.axis_side[np.where(side, i, 0), 0], self.axis_cap[np.where(side, 0, i), 0])
+        az = np.where(side, self.axis_side[np.where(side, i, 0), 2], self.axis_cap[np.where(side, 0, i), 2])
+        az = np.where(x[:, 2] < 0, -az, az)
+        safe = np.where(rho > 0, rho, 1.0)
+        cphi = np.where(rho > 0, x[:, 0] / safe, 1.0)
+        sphi = np.where(rho > 0, x[:, 1] / safe, 0.0)
+        axis = np.column_stack((ax * cphi, ax * sphi, az))
+        cosa = np.where(side, self.cos_side[np.where(side, i, 0)], self.cos_cap[np.where(side, 0, i)])
+
+        return axis, cosa
+
+    def generate_directions(self, points, rng=None):
+        """
+        Generate directions uniformly in the cone of every point
+
+        :param points: output of cylinder.generate_points
+        :param rng: numpy.random.Generator [Default = None -> np.random]
+        :return: array (n,3) of unit vectors, weights
+        """
+        if rng is None:
+            rng = np.random
+
+        n = len(points['x'])
+        axis, cosa = self.cone(points['x'], points['surface'])
+
+        cost = 1.0 - rng.uniform(0, 1, n) * (1.0 - cosa)
+        phi = 2 * np.pi * rng.uniform(0, 1, n)
+
+        return rotate_direction(axis, cost, phi), 0.5 * (1.0 - cosa)
@@ -0,0 +1,272 @@
+import argparse
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+#
+# Job and result catalog.
+#
+# The job settings that used to live in jobs_master.xlsx are stored in a SQLite database. generate_jobs.py
+# adds a row per job, MC_run.py fills in the result columns when the job finishes, and the analysis
+# (Sigma_study) selects files with indexed queries instead of re-reading the spreadsheet.
+#
+
+# default location of the catalog
+catalog_file = os.path.join(os.path.expanduser('~'), 'FastMC', 'runit', 'jobs_master.sqlite')
+
+# job settings: the columns of the jobs spreadsheets
+job_columns = [('job_id', 'INTEGER PRIMARY KEY'), ('energy', 'REAL'), ('type', 'TEXT'), ('vrt', 'TEXT'),
+               ('edep_max', 'REAL'), ('size_fiducial', 'TEXT'), ('nevents', 'INTEGER'), ('nscatter', 'INTEGER'),
+               ('family_number', 'INTEGER'), ('ran_seed', 'INTEGER'), ('r_cryostat', 'REAL'),
+               ('z_cryostat', 'REAL'), ('r_fiducial', 'REAL'), ('z_fiducial', 'REAL'), ('output', 'TEXT')]
+# results, filled by the worker at the end of the job
+result_columns = [('status', "TEXT DEFAULT 'created'"), ('nevents_done', 'INTEGER'), ('wall_time', 'REAL'),
+                  ('total_weight', 'REAL'), ('finished', 'TEXT'), ('exit_code', 'INTEGER')]
+# the lookup index of the analysis
+index_columns = ['energy', 'vrt', 'edep_max', 'size_fiducial', 'nevents', 'type', 'family_number']
+
+
+class job_catalog:
+    """
+    SQLite catalog of the generated jobs and their results
+    """
+
+    def __init__(self, fn=catalog_file, **kwargs):
+        """
+        Open (or create) a catalog
+
+        :param fn: database file [Default = ~/FastMC/runit/jobs_master.sqlite]
+        :param kwargs:
+            timeout = seconds to wait for a lock held by another process [Default = 60]
+        """
+        timeout = kwargs.pop('timeout', 60.0)
+
+        self.fn = fn
+        directory = os.path.dirname(os.path.abspath(fn))
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(fn, timeout=timeout)
+
+        columns = ', '.join('%s %s' % c for c in job_columns + result_columns)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS jobs (%s)' % columns)
+            # catalogs written by an older version miss the newer result columns
+            existing = [r[1] for r in self.db.execute('PRAGMA table_info(jobs)')]
+            for name, kind in result_columns:
+                if name not in existing:
+                    self.db.execute('ALTER TABLE jobs ADD COLUMN %s %s' % (name, kind))
+            self.db.execute('CREATE INDEX IF NOT EXISTS jobs_lookup ON jobs (%s)' % ', '.join(index_columns))
+            # spreadsheets that were imported, with their modification time
+            self.db.execute('CREATE TABLE IF NOT EXISTS imports (file TEXT PRIMARY KEY, mtime REAL)')
+
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Close the database connection
+
+        :return:
+        """
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+        return
+
+    def add_jobs(self, jobs):
+        """
+        Add jobs, or update the settings of jobs that are already in the catalog. The result columns of
+        known jobs are kept, so a job list can be registered again
+
+        :param jobs: pandas DataFrame (or iterable of dictionaries) with the job settings, see job_columns
+        :return: number of jobs written
+        """
+        rows = jobs.to_dict('records') if isinstance(jobs, pd.DataFrame) else list(jobs)
+        names = [c for c, _ in job_columns]
+
+        values = []
+        for row in rows:
+            values.append(tuple(self.to_sql(row.get(name)) for name in names))
+
+        update = ', '.join('%s = excluded.%s' % (name, name) for name in names if name != 'job_id')
+        with self.db:
+            self.db.executemany('INSERT INTO jobs (%s) VALUES (%s) ON CONFLICT(job_id) DO UPDATE SET %s' %
+                                (', '.join(names), ', '.join('?' * len(names)), update), values)
+
+        return len(values)
+
+    def import_xlsx(self, fn, **kwargs):
+        """
+        Import a jobs spreadsheet (jobs.xlsx, jobs_master.xlsx)
+
+        :param fn: file name
+        :param kwargs:
+            if_changed = only import the file if it was not imported before, or changed since then
+                         [Default = False]
+        :return: number of jobs imported
+        """
+        if_changed = kwargs.pop('if_changed', False)
+
+        key = os.path.abspath(fn)
+        mtime = os.path.getmtime(fn)
+        if if_changed:
+            row = self.db.execute('SELECT mtime FROM imports WHERE file = ?', (key,)).fetchone()
+            if (row is not None) and (row[0] >= mtime):
+                return 0
+
+        n = self.add_jobs(pd.read_excel(fn))
+        with self.db:
+            self.db.execute('INSERT INTO imports (file, mtime) VALUES (?, ?) '
+                            'ON CONFLICT(file) DO UPDATE SET mtime = excluded.mtime', (key, mtime))
+
+        return n
+
+    def update_result(self, job_id, **kwargs):
+        """
+        Store the result of a finished job
+
+        :param job_id: job identifier
+        :param kwargs:
+            output = output file name (without extension) [Default = None -> unchanged]
+            nevents = number of generated events
+            wall_time = wall time of the job in seconds
+            total_weight = sum of the event weights
+            status = job status [Default = 'done']
+        :return:
+        """
+        output = kwargs.pop('output', None)
+        values = {'nevents_done': kwargs.pop('nevents', None),
+                  'wall_time': kwargs.pop('wall_time', None),
+                  'total_weight': kwargs.pop('total_weight', None),
+                  'status': kwargs.pop('status', 'done'),
+                  'finished': time.strftime('%Y-%m-%d %H:%M:%S')}
+        if output is not None:
+            values['output'] = output
+
+        with self.db:
+            cur = self.db.execute('UPDATE jobs SET %s WHERE job_id = ?' % ', '.join('%s = ?' % k for k in values),
+                                  [self.to_sql(v) for v in values.values()] + [int(job_id)])
+            if cur.rowcount == 0:
+                # job started without generate_jobs: register it with the known settings
+                values['job_id'] = int(job_id)
+                self.db.execute('INSERT INTO jobs (%s) VALUES (%s)' % (', '.join(values), ', '.join('?' * len(values))),
+                                [self.to_sql(v) for v in values.values()])
+
+        return
+
+    def set_status(self, job_id, status, exit_code=None):
+        """
+        Set the status of a job, e.g. by the scheduler of generate_jobs.py
+
+        :param job_id: job identifier
+        :param status: 'created', 'submitted', 'running', 'done', 'failed' or 'skipped'
+        :param exit_code: exit code of the job process [Default = None -> unchanged]
+        :return:
+        """
+        with self.db:
+            if exit_code is None:
+                self.db.execute('UPDATE jobs SET status = ? WHERE job_id = ?', (status, int(job_id)))
+            else:
+                self.db.execute('UPDATE jobs SET status = ?, exit_code = ? WHERE job_id = ?',
+                                (status, int(exit_code), int(job_id)))
+
+        return
+
+    def select(self, columns='*', **kwargs):
+        """
+        Select jobs with equality conditions on the job settings
+
+        :param columns: columns to return [Default = all]
+        :param kwargs: column = value conditions, e.g. energy=1000, vrt='fiducial_scatter'
+        :return: pandas DataFrame
+        """
+        if not isinstance(columns, str):
+            columns = ', '.join(columns)
+        query, values = self.where(kwargs)
+
+        return pd.read_sql_query('SELECT %s FROM jobs%s ORDER BY job_id' % (columns, query), self.db, params=values)
+
+    def count(self, **kwargs):
+        """
+        Number of jobs that satisfy the conditions
+
+        :param kwargs: column = value conditions
+        :return: int
+        """
+        query, values = self.where(kwargs)
+
+        return self.db.execute('SELECT COUNT(*) FROM jobs%s' % query, values).fetchone()[0]
+
+    def distinct(self, column, **kwargs):
+        """
+        Distinct values of a column for the jobs that satisfy the conditions
+
+        :param column: column name
+        :param kwargs: column = value conditions
+        :return: list of values, sorted
+        """
+        query, values = self.where(kwargs)
+        rows = self.db.execute('SELECT DISTINCT %s FROM jobs%s ORDER BY %s' % (column, query, column), values)
+
+        return [r[0] for r in rows]
+
+    def where(self, conditions):
+        """
+        Build the WHERE clause of a query
+
+        :param conditions: dictionary column -> value
+        :return: query string, list of values
+        """
+        names = [c for c, _ in job_columns + result_columns]
+        for k in conditions:
+            if k not in names:
+                print('job_catalog::where ERROR unknown column ', k)
+                raise KeyError(k)
+
+        if len(conditions) == 0:
+            return '', []
+
+        query = ' WHERE ' + ' AND '.join('%s = ?' % k for k in conditions)
+        return query, [self.to_sql(v) for v in conditions.values()]
+
+    @staticmethod
+    def to_sql(value):
+        """
+        Convert numpy scalars to python types for sqlite
+
+        :param value: value
+        :return: int, float, str or None
+        """
+        if value is None:
+            return None
+        if hasattr(value, 'item'):
+            value = value.item()
+        if isinstance(value, float) and value != value:
+            return None
+
+        return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FastMC job catalog')
+    parser.add_argument('--db', type=str, default=catalog_file, help='catalog database')
+    parser.add_argument('--i', dest='xlsx', type=str, nargs='+', default=[], help='jobs spreadsheets to import')
+    args = parser.parse_args()
+
+    with job_catalog(args.db) as cat:
+        for fn in args.xlsx:
+            print('catalog:: import ', cat.import_xlsx(fn), ' jobs from ', fn)
+        print('catalog:: ', cat.count(), ' jobs in ', args.db)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import io
+import json
+import os
+
+import numpy as np
+
+from tally import load_tally
+
+#
+# Checkpoints of long runs.
+#
+# A checkpoint is a single .npz file next to the output with the run state (settings, master seed, number
+# of pieces and events done, sum of the weights, wall time), the partial tally and the position of the
+# output file. driver.make_shards gives every piece of a run its own seed, so a resumed run skips the
+# pieces that are done and generates exactly the events of the uninterrupted run.
+#
+# The file is written to a temporary name and renamed, so a run killed while writing a checkpoint
+# keeps the previous one.
+#
+
+
+def checkpoint_file(output):
+    """
+    :param output: output file name (without extension)
+    :return: name of the checkpoint file of a run
+    """
+    return output + '_checkpoint.npz'
+
+
+def save_checkpoint(fn, state, **kwargs):
+    """
+    Write a checkpoint
+
+    :param fn: file name
+    :param state: json serializable dictionary with the run state
+    :param kwargs:
+        tally = partial tally [Default = None]
+        writer = state of the event file, see eventio.event_writer.checkpoint [Default = None]
+    :return:
+    """
+    t = kwargs.pop('tally', None)
+    writer = kwargs.pop('writer', None)
+
+    arrays = {'state': json.dumps(state)}
+    if t is not None:
+        buf = io.BytesIO()
+        t.save(buf)
+        arrays['tally'] = np.frombuffer(buf.getvalue(), dtype=np.uint8)
+    if writer is not None:
+        writer = dict(writer)
+        arrays['directory'] = np.frombuffer(writer.pop('directory'), dtype=np.uint8)
+        arrays['writer'] = json.dumps(writer)
+
+    tmp = fn + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, fn)
+
+    return
+
+
+def load_checkpoint(fn):
+    """
+    Read a checkpoint
+
+    :param fn: file name
+    :return: state, tally (or None), writer state (or None)
+    """
+    with np.load(fn) as d:
+        state = json.loads(str(d['state']))
+        t = None
+        if 'tally' in d:
+            t = load_tally(io.BytesIO(d['tally'].tobytes()))
+        writer = None
+        if 'writer' in d:
+            writer = json.loads(str(d['writer']))
+            writer['directory'] = d['directory'].tobytes()
+
+    return state, t, writer
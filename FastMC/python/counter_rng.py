@@ -0,0 +1,125 @@
+import numpy as np
+
+#
+# Counter-based random numbers: Philox4x32-10 (Salmon et al., "Parallel random numbers: as easy as 1, 2, 3",
+# SC11), in plain numpy.
+#
+# A uniform number is a pure function of a key and a counter. The key is derived from the run seed and the
+# counter is (draw number, track, event number): every photon counts its own draws, and the copies of a
+# photon split by a weight window get their own track number. The history of event i therefore only depends
+# on the run seed and i, not on the batch, shard or worker it is generated in: runs can be sharded in any
+# way with identical results, and a single event can be regenerated on its own (see runit/replay_event.py).
+#
+
+MASK32 = np.uint64(0xFFFFFFFF)
+PHILOX_M0 = np.uint64(0xD2511F53)
+PHILOX_M1 = np.uint64(0xCD9E8D57)
+PHILOX_W0 = np.uint64(0x9E3779B9)
+PHILOX_W1 = np.uint64(0xBB67AE85)
+SHIFT32 = np.uint64(32)
+
+
+def philox_key(seed):
+    """
+    :param seed: run seed (anything numpy.random.SeedSequence accepts)
+    :return: Philox key, two 32 bit words
+    """
+    k = np.random.SeedSequence(seed).generate_state(2, np.uint32)
+
+    return int(k[0]), int(k[1])
+
+
+def philox(key, c0, c1, c2, c3, rounds=10):
+    """
+    Philox4x32 bijection of arrays of counters
+
+    :param key: two 32 bit words
+    :param c0, c1, c2, c3: counter words (arrays of values below 2^32)
+    :param rounds: number of rounds [Default = 10]
+    :return: four arrays of 32 bit output words (as uint64)
+    """
+    k0 = np.uint64(key[0])
+    k1 = np.uint64(key[1])
+    c0, c1, c2, c3 = [np.asarray(c, dtype=np.uint64) & MASK32 for c in (c0, c1, c2, c3)]
+
+    for i in range(rounds):
+        p0 = c0 * PHILOX_M0
+        p1 = c2 * PHILOX_M1
+        c0, c1, c2, c3 = (p1 >> SHIFT32) ^ c1 ^ k0, p1 & MASK32, (p0 >> SHIFT32) ^ c3 ^ k1, p0 & MASK32
+        k0 = (k0 + PHILOX_W0) & MASK32
+        k1 = (k1 + PHILOX_W1) & MASK32
+
+    return c0, c1, c2, c3
+
+
+def philox_uniform(key, draw, track, event):
+    """
+    :param key: Philox key
+    :param draw, track, event: counter of every number (arrays)
+    :return: uniform numbers in [0, 1) with 53 random bits
+    """
+    event = np.asarray(event, dtype=np.uint64)
+    x0, x1, x2, x3 = philox(key, draw, track, event & MASK32, event >> SHIFT32)
+
+    return ((x0 >> np.uint64(5)) * 67108864.0 + (x1 >> np.uint64(6))) / 9007199254740992.0
+
+
+class philox_stream:
+    """
+    Random generator look-alike that draws the numbers of every photon from its own Philox counter. It can be
+    passed as rng to the functions that draw with rng.uniform(low, high, size)
+    """
+
+    def __init__(self, seed):
+        """
+        :param seed: run seed
+        """
+        self.key = philox_key(seed)
+        self.event = None
+        self.track = None
+        self.ndraw = None
+        self.rows = None
+
+        return
+
+    def select(self, event, track, ndraw, rows=None):
+        """
+        Select the photons of the next draws
+
+        :param event: event number per photon
+        :param track: track number per photon
+        :param ndraw: number of draws per photon, incremented by every draw
+        :param rows: indices of the photons that draw (None = the first photon, draws return a float)
+        :return: self
+        """
+        self.event = event
+        self.track = track
+        self.ndraw = ndraw
+        self.rows = rows
+
+        return self
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        """
+        :return: one uniform number between low and high per selected photon. size is ignored: the number of
+                 values is the number of selected photons
+        """
+        r = 0 if self.rows is None else self.rows
+        u = philox_uniform(self.key, self.ndraw[r], self.track[r], self.event[r])
+        self.ndraw[r] += 1
+        if self.rows is None:
+            u = float(u)
+
+        return low + (high - low) * u
+
+    def random(self, size=None):
+        """
+        :return: uniform numbers in [0, 1), see uniform
+        """
+        return self.uniform(0.0, 1.0)
+
+    def integers(self, high, size=None):
+        """
+        :return: uniform integers in [0, high), see uniform
+        """
+        return np.minimum((self.uniform(0.0, 1.0) * high).astype(np.int64), high - 1)
@@ -1,5 +1,11 @@
 import numpy as np
 
+# surface ids returned by cylinder.generate_points
+SURFACE_CYL = 0
+SURFACE_TOP = 1
+SURFACE_BOT = 2
+surface_names = ['cyl', 'top', 'bot']
+
 class cylinder:
 
     def __init__(self, **kwargs):
@@ -41,13 +47,15 @@ class cylinder:
         """
         Generate a point at a random location on the cylinder
 
-        :param kwargs:
+        :param kwargs: rng = random generator with a uniform(low, high) method, e.g. a sampler.uniform_stream
+                             [Default = np.random]
 
         :return:
         """
+        rng = kwargs.pop('rng', np.random)
         xyz = np.zeros(3)
         # decide on which cylinder surface to generate a hit
-        r = np.random.uniform(0.0,1.0)
+        r = rng.uniform(0.0,1.0)
         surface = ""
         if r<=self.f_cyl:
             surface = "cyl"
@@ -57,14 +65,14 @@ class cylinder:
             surface = "bot"
 
         # generate a hit
-        phi = np.random.uniform(0,2*np.pi)
+        phi = rng.uniform(0,2*np.pi)
         if surface == "cyl":
             # cylinder
             xyz[0] = self.radius*np.cos(phi)
             xyz[1] = self.radius*np.sin(phi)
-            xyz[2] = np.random.uniform(-self.height/2,+self.height/2)
+            xyz[2] = rng.uniform(-self.height/2,+self.height/2)
         else:
-            r = self.radius * np.sqrt(np.random.uniform(0,1.))
+            r = self.radius * np.sqrt(rng.uniform(0,1.))
             xyz[0] = r * np.cos(phi)
             xyz[1] = r * np.sin(phi)
             if surface == "top":
@@ -75,3 +83,154 @@ class cylinder:
                 xyz[2] = - self.height/2.
 
         return {'x': xyz, 'surface': surface}
+
+    def generate_points(self, n, rng=None):
+        """
+        Generate n points uniformly distributed over the cylinder surface
+
+        :param n: number of points
+        :param rng: numpy.random.Generator [Default = None -> np.random]
+        :return: {'x': array (n,3), 'surface': array (n) of surface ids SURFACE_CYL/TOP/BOT}
+        """
+        if rng is None:
+            rng = np.random
+
+        r = rng.uniform(0.0, 1.0, n)
+        surface = np.full(n, SURFACE_BOT, dtype=np.int8)
+        surface[r < self.f_cyl + self.f_top] = SURFACE_TOP
+        surface[r <= self.f_cyl] = SURFACE_CYL
+        side = surface == SURFACE_CYL
+
+        #
+        # on the side: radius R, uniform z. On top/bottom: uniform over the disk
+        #
+        phi = rng.uniform(0, 2 * np.pi, n)
+        u = rng.uniform(0, 1., n)
+        rho = np.where(side, self.radius, self.radius * np.sqrt(u))
+
+        xyz = np.empty((n, 3))
+        xyz[:, 0] = rho * np.cos(phi)
+        xyz[:, 1] = rho * np.sin(phi)
+        xyz[:, 2] = np.where(side, self.height * (u - 0.5),
+                             np.where(surface == SURFACE_TOP, self.height / 2, -self.height / 2))
+
+        return {'x': xyz, 'surface': surface}
+
+    def inward_normal(self, points):
+        """
+        Unit normal pointing into the cylinder at points on its surface
+
+        :param points: output of generate_points
+        :return: array (n,3)
+        """
+        xyz = points['x']
+        surface = points['surface']
+
+        side = surface == SURFACE_CYL
+        rho = np.sqrt(xyz[:, 0] ** 2 + xyz[:, 1] ** 2)
+        rho[~side] = 1.0
+
+        normal = np.empty_like(xyz)
+        normal[:, 0] = np.where(side, -xyz[:, 0] / rho, 0.0)
+        normal[:, 1] = np.where(side, -xyz[:, 1] / rho, 0.0)
+        normal[:, 2] = np.where(side, 0.0, np.where(surface == SURFACE_TOP, -1.0, 1.0))
+
+        return normal
+
+    def generate_directions(self, points, mode='isotropic', rng=None):
+        """
+        Generate a direction for every point on the cylinder surface
+
+        :param points: output of generate_points
+        :param mode: 'isotropic' = uniform over the full sphere (as particle.generate)
+                     'cosine' = cosine-weighted into the cylinder, i.e. the directions with which an
+                                isotropic external flux crosses the surface
+        :param rng: numpy.random.Generator [Default = None -> np.random]
+        :return: array (n,3) of unit vectors
+        """
+        if rng is None:
+            rng = np.random
+
+        n = len(points['surface'])
+        if mode == 'isotropic':
+            cost = rng.uniform(-1, 1, n)
+            sint = np.sqrt(1 - cost ** 2)
+            phi = 2 * np.pi * rng.uniform(0, 1, n)
+            return np.column_stack((np.cos(phi) * sint, np.sin(phi) * sint, cost))
+        elif mode != 'cosine':
+            print('cylinder::generate_directions ERROR unknown mode =', mode)
+            raise ValueError('unknown direction mode %s, use isotropic or cosine' % mode)
+
+        #
+        # cos(theta) w.r.t. the inward normal distributed as 2*cos(theta)
+        #
+        cost = np.sqrt(rng.uniform(0, 1, n))
+        sint = np.sqrt(1 - cost ** 2)
+        phi = 2 * np.pi * rng.uniform(0, 1, n)
+
+        #
+        # local frame (e1, e2, normal). On the side e2 is the z-axis, on top/bottom e1, e2 = x, y
+        #
+        normal = self.inward_normal(points)
+        side = points['surface'] == SURFACE_CYL
+        e1 = np.column_stack((np.where(side, -normal[:, 1], 1.0), np.where(side, normal[:, 0], 0.0), np.zeros(n)))
+        e2 = np.column_stack((np.zeros(n), np.where(side, 0.0, 1.0), np.where(side, 1.0, 0.0)))
+
+        return (cost[:, None] * normal
+                + (sint * np.cos(phi))[:, None] * e1
+                + (sint * np.sin(phi))[:, None] * e2)
+
+    def intersect(self, x0, t, eps=1e-5):
+        """
+        Intersect an array of straight tracks with the cylinder
+
+        The part of the track x0 + s*t (s > eps) inside the cylinder is [s_in, s_out]. Tracks that start
+        inside the cylinder, or on its surface within eps, have s_in = 0. Tracks that miss the cylinder,
+        only touch it, or leave it within eps have s_in = s_out = inf. Tracks parallel to the planes
+        (tz = 0) or to the axis (tx = ty = 0) are handled without special output.
+
+        :param x0: starting points, array (n,3)
+        :param t: unit directions, array (n,3)
+        :param eps: path length tolerance in cm [Default = 1e-5]
+        :return: s_in, s_out (arrays of length n)
+        """
+        x0 = np.atleast_2d(x0)
+        t = np.atleast_2d(t)
+        n = len(x0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            #
+            # slab between the bottom and top planes
+            #
+            tz = t[:, 2]
+            parallel = tz == 0.0
+            s1 = (-self.height / 2 - x0[:, 2]) / tz
+            s2 = (+self.height / 2 - x0[:, 2]) / tz
+            inside_z = np.abs(x0[:, 2]) < self.height / 2
+            lo = np.where(parallel, np.where(inside_z, -np.inf, np.inf), np.minimum(s1, s2))
+            hi = np.where(parallel, np.where(inside_z, np.inf, -np.inf), np.maximum(s1, s2))
+
+            #
+            # infinite cylindrical shell: A s^2 + B s + C = 0, with the numerically stable roots
+            #
+            A = t[:, 0] ** 2 + t[:, 1] ** 2
+            B = 2 * (x0[:, 0] * t[:, 0] + x0[:, 1] * t[:, 1])
+            C = x0[:, 0] ** 2 + x0[:, 1] ** 2 - self.radius ** 2
+            discriminant = B ** 2 - 4 * A * C
+            axial = A == 0.0
+            q = -0.5 * (B + np.copysign(np.sqrt(np.maximum(discriminant, 0.0)), B))
+            r1 = q / A
+            r2 = np.where(q != 0.0, C / q, r1)
+            radial = ~axial & (discriminant > 0)
+            lo_r = np.where(radial, np.minimum(r1, r2), np.where(axial & (C < 0), -np.inf, np.inf))
+            hi_r = np.where(radial, np.maximum(r1, r2), np.where(axial & (C < 0), np.inf, -np.inf))
+
+        s_in = np.maximum(np.maximum(lo, lo_r), 0.0)
+        s_out = np.minimum(hi, hi_r)
+
+        s_in[s_in <= eps] = 0.0
+        miss = ~(s_out > np.maximum(s_in, eps))
+        s_in[miss] = np.inf
+        s_out[miss] = np.inf
+
+        return s_in, s_out
@@ -0,0 +1,208 @@
+import numpy as np
+import multiprocessing as mp
+
+from transport import photon_bank
+from tally import convergence
+
+#
+# Multi-core event generation. An N-event run is split into contiguous shards, one per worker.
+# Every shard gets its own random generator spawned from numpy.random.SeedSequence(seed), so the
+# merged result only depends on the master seed and the number of workers. With counter_seed (see
+# counter_rng.py) every event draws from its own counter, and the result does not depend on the split at all.
+#
+
+# configuration of the worker processes, set by init_worker
+worker_config = {}
+
+
+def split_events(nevent, nworkers):
+    """
+    Split nevent events in nworkers contiguous shards
+
+    :param nevent: number of events
+    :param nworkers: number of shards
+    :return: list of (first_event, nevent) per shard
+    """
+    sizes = np.full(nworkers, nevent // nworkers)
+    sizes[:nevent % nworkers] += 1
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+    return [(int(s), int(n)) for s, n in zip(starts, sizes)]
+
+
+def init_worker(config):
+    """
+    Store the run configuration in the worker process
+
+    :param config: dictionary with the particle settings (energy, physics, geometry, ...) and engine
+    :return:
+    """
+    global worker_config
+    worker_config = config
+
+
+def run_shard(shard):
+    """
+    Generate the events of a single shard
+
+    :param shard: (first_event, nevent, seed_sequence)
+    :return: array with one record per event, or the filled tally if the configuration has a tally
+    """
+    first_event, nevent, seed_sequence = shard
+    config = dict(worker_config)
+    engine = config.pop('engine', 'numpy')
+    t = config.pop('tally', None)
+
+    rng = np.random.default_rng(seed_sequence)
+    if engine == 'numba':
+        import kernel
+        records = kernel.generate_events(nevent, seed=int(rng.integers(2 ** 32)), first_event=first_event, **config)
+    else:
+        bank = photon_bank(rng=rng, **config)
+        records = bank.run(nevent, first_event=first_event)
+
+    if t is not None:
+        t = t.empty_copy()
+        t.fill(records)
+        return t
+
+    return records
+
+
+def make_shards(nevent, nworkers, seed=None, chunk_size=None):
+    """
+    Split a run in shards with their own seed sequence. Every worker shard is further divided in
+    pieces of at most chunk_size events, each with a seed spawned from the shard seed
+
+    :param nevent: number of events
+    :param nworkers: number of worker shards
+    :param seed: master random seed
+    :param chunk_size: maximum number of events per piece [Default = None -> one piece per shard]
+    :return: list of (first_event, nevent, seed_sequence), ordered by event number
+    """
+    shards = []
+    seeds = np.random.SeedSequence(seed).spawn(nworkers)
+    for (first, n), s in zip(split_events(nevent, nworkers), seeds):
+        if (chunk_size is None) or (n <= chunk_size):
+            shards.append((first, n, s))
+            continue
+        npiece = -(-n // chunk_size)
+        for (start, m), ps in zip(split_events(n, npiece), s.spawn(npiece)):
+            shards.append((first + start, m, ps))
+
+    return shards
+
+
+def generate_chunks(nevent, **kwargs):
+    """
+    Generate nevent events on a pool of worker processes and return them piece by piece
+
+    :param nevent: number of events
+    :param kwargs:
+        nworkers = number of worker processes [Default = number of cores]
+        seed = master random seed [Default = None -> fresh entropy]
+        chunk_size = maximum number of events per piece [Default = None -> one piece per worker]
+        first_shard = index of the first piece to generate, used to resume a run from a checkpoint. The
+                      pieces only depend on (nevent, nworkers, seed, chunk_size), so skipping the pieces
+                      that are done gives the same events as the uninterrupted run [Default = 0]
+        engine = 'numpy' (photon_bank) or 'numba' (kernel) [Default = 'numpy']
+        tally = instant of the tally class. If given, every piece is tallied in the worker and the
+                filled tallies are returned instead of the records [Default = None]
+        energy, physics, geometry, fiducial, vrt, nscatter_max, edep_max, writeout = as for photon_bank
+    :return: generator of record arrays (or tallies), in event order
+    """
+    nworkers = kwargs.pop('nworkers', None)
+    seed = kwargs.pop('seed', None)
+    chunk_size = kwargs.pop('chunk_size', None)
+    first_shard = kwargs.pop('first_shard', 0)
+    if nworkers is None:
+        nworkers = mp.cpu_count()
+
+    shards = make_shards(nevent, nworkers, seed=seed, chunk_size=chunk_size)[first_shard:]
+
+    if nworkers == 1:
+        init_worker(kwargs)
+        for shard in shards:
+            yield run_shard(shard)
+    else:
+        with mp.Pool(nworkers, initializer=init_worker, initargs=(kwargs,)) as pool:
+            for records in pool.imap(run_shard, shards, chunksize=1):
+                yield records
+
+
+def generate_replicates(nevent, nreplicates=16, **kwargs):
+    """
+    Generate independent replicates of a run and only keep their tallies. With sampler = 'sobol' every
+    replicate is a scrambled Sobol sequence with its own scrambling, and the spread of the replicates gives
+    the error of the randomized QMC estimate (see sampler.py and tally.replicate_rate)
+
+    :param nevent: number of events per replicate (a power of 2 for the best balance of the Sobol points)
+    :param nreplicates: number of replicates [Default = 16]
+    :param kwargs: see generate_tally. tally is required
+        seed = master seed [Default = None -> fresh entropy]
+        sampler = 'sobol' or 'random' [Default = 'sobol']
+    :return: list of tallies, one per replicate
+    """
+    entropy = np.random.SeedSequence(kwargs.pop('seed', None)).entropy
+    sampler = kwargs.pop('sampler', 'sobol')
+    if (sampler == 'sobol') and (nevent & (nevent - 1) != 0):
+        print('driver::generate_replicates nevent = ', nevent, ' is not a power of 2: the Sobol points are '
+              'not balanced')
+
+    tallies = []
+    for i in range(nreplicates):
+        # the same scrambling for all pieces of a replicate
+        sampler_seed = int(np.random.SeedSequence([entropy, i, 1]).generate_state(1, np.uint64)[0])
+        tallies.append(generate_tally(nevent, seed=[entropy, i], sampler=sampler, sampler_seed=sampler_seed,
+                                      **kwargs))
+
+    return tallies
+
+
+def generate(nevent, **kwargs):
+    """
+    Generate nevent events on a pool of worker processes
+
+    :param nevent: number of events
+    :param kwargs: see generate_chunks
+    :return: array with one record per event, ordered by event number
+    """
+    return np.concatenate(list(generate_chunks(nevent, **kwargs)))
+
+
+def generate_tally(nevent, **kwargs):
+    """
+    Generate nevent events on a pool of worker processes and only keep the tally. With a target
+    relative error the run stops as soon as the target is reached, so nevent is the maximum
+
+    :param nevent: (maximum) number of events
+    :param kwargs: see generate_chunks. tally is required
+        target = target relative error of the rate of monitor_nscatter [Default = None -> run all events]
+        monitor_nscatter = scatter multiplicity of the monitored rate [Default = 1]
+        interval = seconds between progress reports [Default = None -> no reports]
+        min_pass = minimum number of selected events before the run can stop [Default = 100]
+    :return: merged tally
+    """
+    target = kwargs.pop('target', None)
+    interval = kwargs.pop('interval', None)
+    monitor_nscatter = kwargs.pop('monitor_nscatter', 1)
+    min_pass = kwargs.pop('min_pass', 100)
+    if (target is not None) and (kwargs.get('chunk_size') is None):
+        # small pieces, so that the run can stop close to the target
+        kwargs['chunk_size'] = 100000
+
+    result = kwargs['tally'].empty_copy()
+    monitor = None
+    if (target is not None) or (interval is not None):
+        monitor = convergence(result, nscatter=monitor_nscatter, target=target, interval=interval,
+                              min_pass=min_pass)
+
+    for t in generate_chunks(nevent, **kwargs):
+        result.merge(t)
+        if (monitor is not None) and monitor.update():
+            break
+
+    if monitor is not None:
+        monitor.finish()
+
+    return result
@@ -0,0 +1,259 @@
+import json
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+#
+# Columnar event files.
+#
+# An event file is a compressed zip archive in the .npz layout: every column of every chunk is
+# stored as a separate .npy member 'chunkNNNNNN/<column>.npy', plus a 'meta.json' member with the
+# run settings. Chunks are written as the run progresses, and readers only decompress the columns
+# they ask for.
+#
+
+
+def event_columns(writeout=4, primary=False):
+    """
+    Column names of the per-event records, identical to the layout written by event_generator
+
+    :param writeout: number of interactions that are stored per event
+    :param primary: add the primary energy 'e0' as last column (runs with a line source)
+    :return: list of column names
+    """
+    names = ['#', 'nscatters', 'w', 'de', 'x0', 'y0', 'z0']
+    for i in range(1, writeout + 1):
+        names.extend(['x' + str(i), 'y' + str(i), 'z' + str(i), 'de' + str(i)])
+    if primary:
+        names.append('e0')
+
+    return names
+
+
+def event_dtypes(writeout=4, primary=False):
+    """
+    Storage type of every event column
+
+    :param writeout: number of interactions that are stored per event
+    :param primary: records with the primary energy column 'e0'
+    :return: dictionary column -> numpy dtype
+    """
+    dtypes = {}
+    for name in event_columns(writeout, primary):
+        dtypes[name] = np.float32
+    dtypes['#'] = np.int64
+    dtypes['nscatters'] = np.int16
+
+    return dtypes
+
+
+class event_writer:
+    """
+    Stream per-event records to a columnar event file
+    """
+
+    def __init__(self, fn, **kwargs):
+        """
+        Open an event file for writing
+
+        :param fn: file name (.npz)
+        :param kwargs:
+            writeout = number of interactions stored per event [Default = 4]
+            primary = the records have the primary energy column of a line source [Default = False]
+            chunk_size = number of events per chunk [Default = 1000000]
+            compress = deflate the columns [Default = True]
+            meta = dictionary with run settings stored in the file [Default = {}]
+            resume = state returned by checkpoint(). The file is cut back to that state and the new
+                     events are appended [Default = None -> new file]
+        """
+        self.fn = fn
+        self.writeout = kwargs.pop('writeout', 4)
+        primary = kwargs.pop('primary', False)
+        self.chunk_size = kwargs.pop('chunk_size', 1000000)
+        compress = kwargs.pop('compress', True)
+        self.meta = dict(kwargs.pop('meta', {}))
+        resume = kwargs.pop('resume', None)
+
+        self.columns = event_columns(self.writeout, primary)
+        self.dtypes = event_dtypes(self.writeout, primary)
+        self.compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        self.nchunk = 0
+        self.nevent = 0
+        self.buffer = []
+        self.nbuffer = 0
+
+        if resume is None:
+            self.zf = zipfile.ZipFile(fn, 'w', compression=self.compression, allowZip64=True)
+        else:
+            #
+            # drop what was written after the checkpoint and restore the zip directory of the checkpoint
+            #
+            with open(fn, 'r+b') as f:
+                f.truncate(resume['offset'])
+                f.seek(resume['offset'])
+                f.write(resume['directory'])
+            self.zf = zipfile.ZipFile(fn, 'a', compression=self.compression, allowZip64=True)
+            self.nchunk = resume['nchunk']
+            self.nevent = resume['nevent']
+
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, records):
+        """
+        Add records to the file. Full chunks are written immediately
+
+        :param records: array of shape (n, 7+4*writeout) (+1 with primary), see eventio.event_columns()
+        :return:
+        """
+        records = np.asarray(records)
+        if records.shape[1] != len(self.columns):
+            print('event_writer::write ERROR records have ', records.shape[1], ' columns, expected ', len(self.columns))
+            return
+
+        self.buffer.append(records)
+        self.nbuffer += len(records)
+        if self.nbuffer >= self.chunk_size:
+            data = np.concatenate(self.buffer)
+            nfull = (len(data) // self.chunk_size) * self.chunk_size
+            for start in range(0, nfull, self.chunk_size):
+                self.write_chunk(data[start:start + self.chunk_size])
+            self.buffer = [data[nfull:]]
+            self.nbuffer = len(data) - nfull
+
+        return
+
+    def write_chunk(self, data):
+        """
+        Write one chunk, column by column
+
+        :param data: records of the chunk
+        :return:
+        """
+        for i, name in enumerate(self.columns):
+            column = data[:, i]
+            if np.issubdtype(self.dtypes[name], np.integer):
+                column = np.nan_to_num(column)
+            with self.zf.open('chunk%06i/%s.npy' % (self.nchunk, name), 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, column.astype(self.dtypes[name]), allow_pickle=False)
+
+        self.nchunk += 1
+        self.nevent += len(data)
+
+        return
+
+    def checkpoint(self):
+        """
+        Flush the buffered events and make the file a valid zip archive (without metadata), so that a
+        killed run can continue from here with event_writer(fn, resume=state)
+
+        :return: state: dictionary with offset (start of the zip directory), directory (bytes), nchunk and nevent
+        """
+        if self.nbuffer > 0:
+            self.write_chunk(np.concatenate(self.buffer))
+        self.buffer = []
+        self.nbuffer = 0
+
+        # closing writes the zip directory. The next chunk is written over it
+        self.zf.close()
+        self.zf = zipfile.ZipFile(self.fn, 'a', compression=self.compression, allowZip64=True)
+        offset = self.zf.start_dir
+        with open(self.fn, 'rb') as f:
+            f.seek(offset)
+            directory = f.read()
+
+        return {'offset': offset, 'directory': directory, 'nchunk': self.nchunk, 'nevent': self.nevent}
+
+    def close(self):
+        """
+        Flush the remaining events and write the metadata
+
+        :return:
+        """
+        if self.zf is None:
+            return
+
+        if self.nbuffer > 0:
+            self.write_chunk(np.concatenate(self.buffer))
+        self.buffer = []
+        self.nbuffer = 0
+
+        meta = dict(self.meta)
+        meta.update({'nevent': self.nevent, 'nchunk': self.nchunk, 'writeout': self.writeout,
+                     'columns': self.columns})
+        self.zf.writestr('meta.json', json.dumps(meta, default=str))
+        self.zf.close()
+        self.zf = None
+
+        return
+
+
+def read_meta(fn):
+    """
+    Read the metadata of an event file
+
+    :param fn: file name
+    :return: dictionary with the run settings, nevent, nchunk, writeout and columns
+    """
+    with zipfile.ZipFile(fn, 'r') as zf:
+        return json.loads(zf.read('meta.json'))
+
+
+def iter_events(fn, columns=None, where=None, where_columns=None):
+    """
+    Iterate over the chunks of an event file. With a predicate only the where_columns are decompressed
+    first; the other columns of a chunk are read only if events in the chunk pass, and only the passing
+    rows are returned
+
+    :param fn: file name
+    :param columns: list of columns to read [Default = None -> all columns]
+    :param where: function DataFrame -> boolean mask, evaluated on the where_columns [Default = None -> all rows]
+    :param where_columns: columns needed by where [Default = None -> columns]
+    :return: generator of pandas DataFrames, one per chunk (chunks without passing events are skipped)
+    """
+    with zipfile.ZipFile(fn, 'r') as zf:
+        meta = json.loads(zf.read('meta.json'))
+        if columns is None:
+            columns = meta['columns']
+        if where_columns is None:
+            where_columns = columns
+
+        def read_column(ichunk, name):
+            with zf.open('chunk%06i/%s.npy' % (ichunk, name), 'r') as f:
+                return np.lib.format.read_array(f, allow_pickle=False)
+
+        for ichunk in range(meta['nchunk']):
+            data = {}
+            if where is not None:
+                for name in where_columns:
+                    data[name] = read_column(ichunk, name)
+                mask = np.asarray(where(pd.DataFrame(data)))
+                if not mask.any():
+                    continue
+                data = {name: column[mask] for name, column in data.items()}
+            for name in columns:
+                if name not in data:
+                    column = read_column(ichunk, name)
+                    data[name] = column if where is None else column[mask]
+            yield pd.DataFrame(data, columns=columns)
+
+
+def read_events(fn, columns=None):
+    """
+    Read (selected columns of) an event file
+
+    :param fn: file name
+    :param columns: list of columns to read [Default = None -> all columns]
+    :return: pandas DataFrame
+    """
+    chunks = list(iter_events(fn, columns=columns))
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=columns)
+
+    return pd.concat(chunks, ignore_index=True)
@@ -0,0 +1,130 @@
+import time
+from contextlib import contextmanager
+
+#
+# Optional counters and per-stage timers of the transport.
+#
+# particle, photon_bank and em_physics take an instrument=<instrumentation> argument. Without it
+# (the default) the only cost is an 'is not None' test per instrumented call. The same instance can be
+# shared by the physics and the particles of a run, and instances of several runs can be merged.
+#
+
+# counters that are always reported
+counter_names = ['histories', 'intersections', 'compton', 'photoelectric', 'fiducial_miss', 'escaped',
+                 'nscatter_max_terminations', 'weight_killed', 'cross_section_lookups', 'compton_samples',
+                 'ww_splits', 'ww_roulette_kills']
+# stages of a history
+stage_names = ['source', 'geometry', 'physics', 'angle', 'output']
+
+
+class instrumentation:
+    """
+    Counters and accumulated wall time per stage of the photon transport
+    """
+
+    def __init__(self):
+        """
+        Initialize empty counters and timers
+        """
+        self.counters = dict.fromkeys(counter_names, 0)
+        self.times = dict.fromkeys(stage_names, 0.0)
+        self.calls = dict.fromkeys(stage_names, 0)
+        self.t_start = time.perf_counter()
+
+        return
+
+    def count(self, name, n=1):
+        """
+        Increase a counter
+
+        :param name: counter name
+        :param n: increment
+        :return:
+        """
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+        return
+
+    def add_time(self, stage, t0):
+        """
+        Add the time since t0 to a stage
+
+        :param stage: stage name
+        :param t0: start time from time.perf_counter()
+        :return:
+        """
+        self.times[stage] = self.times.get(stage, 0.0) + time.perf_counter() - t0
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+
+        return
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Time a block of code, e.g. the output stage of an event loop:
+
+            with instrument.timer('output'):
+                ...
+
+        :param stage: stage name
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, t0)
+
+    def merge(self, other):
+        """
+        Add the counters and times of another instance
+
+        :param other: instrumentation
+        :return:
+        """
+        for k, v in other.counters.items():
+            self.counters[k] = self.counters.get(k, 0) + v
+        for k, v in other.times.items():
+            self.times[k] = self.times.get(k, 0.0) + v
+        for k, v in other.calls.items():
+            self.calls[k] = self.calls.get(k, 0) + v
+
+        return
+
+    def summary(self):
+        """
+        Structured summary of the run
+
+        :return: dictionary with
+            counters = all counters
+            stages = per stage: time (s), calls, fraction of the instrumented time, time per history (us)
+            wall_time = time since the instance was created (s)
+        """
+        total = sum(self.times.values())
+        nhist = max(self.counters['histories'], 1)
+
+        stages = {}
+        for k, v in self.times.items():
+            stages[k] = {'time': v, 'calls': self.calls.get(k, 0),
+                         'fraction': v / total if total > 0 else 0.0,
+                         'us_per_history': 1e6 * v / nhist}
+
+        return {'counters': dict(self.counters), 'stages': stages, 'instrumented_time': total,
+                'wall_time': time.perf_counter() - self.t_start}
+
+    def print_summary(self):
+        """
+        Print the summary
+
+        :return:
+        """
+        s = self.summary()
+        print('instrumentation:: counters')
+        for k, v in s['counters'].items():
+            print('instrumentation::    %-28s %14i' % (k, v))
+        print('instrumentation:: stages (instrumented %.3f s of %.3f s wall time)' % (s['instrumented_time'],
+                                                                                    s['wall_time']))
+        for k, v in s['stages'].items():
+            print('instrumentation::    %-10s %10.4f s %6.1f %% %12.3f us/history %12i calls' %
+                  (k, v['time'], 100 * v['fraction'], v['us_per_history'], v['calls']))
+
+        return
@@ -0,0 +1,518 @@
+import numpy as np
+from numba import njit
+
+from biasing import get_cone
+from transport import check_vrt
+
+#
+# Compiled transport kernel. All functions work on plain floats and arrays so that they
+# can be compiled in nopython mode. The compiled code is cached on disk (cache=True), so
+# only the very first import on a machine pays the JIT cost.
+#
+# The particle/em_physics/cylinder classes remain the configuration front end: generate_events()
+# takes the same arguments as particle and converts the objects to arrays with physics_arrays()
+# and geometry_arrays().
+#
+
+VRT_NONE = 0
+VRT_FIDUCIAL_SCATTER = 1
+
+
+@njit(cache=True)
+def seed(s):
+    """
+    Seed the random generator of the compiled code (independent of the numpy global state)
+
+    :param s: random seed
+    :return:
+    """
+    np.random.seed(s)
+
+
+@njit(cache=True)
+def intersect(radius, height, x0, t, eps=1e-5):
+    """
+    Intersect a track with a cylinder. Same as cylinder.intersect for a single track
+
+    :param radius, height: cylinder dimensions
+    :param x0: starting point
+    :param t: unit direction
+    :param eps: path length tolerance in cm
+    :return: s_in, s_out (inf, inf if the track misses the cylinder)
+    """
+    #
+    # slab between the bottom and top planes
+    #
+    if t[2] == 0.0:
+        if np.abs(x0[2]) < height / 2:
+            lo, hi = -np.inf, np.inf
+        else:
+            lo, hi = np.inf, -np.inf
+    else:
+        s1 = (-height / 2 - x0[2]) / t[2]
+        s2 = (+height / 2 - x0[2]) / t[2]
+        lo, hi = min(s1, s2), max(s1, s2)
+
+    #
+    # infinite cylindrical shell
+    #
+    A = t[0] ** 2 + t[1] ** 2
+    B = 2 * (x0[0] * t[0] + x0[1] * t[1])
+    C = x0[0] ** 2 + x0[1] ** 2 - radius ** 2
+    discriminant = B ** 2 - 4 * A * C
+    if A == 0.0:
+        if C < 0:
+            lo_r, hi_r = -np.inf, np.inf
+        else:
+            lo_r, hi_r = np.inf, -np.inf
+    elif discriminant > 0:
+        q = -0.5 * (B + np.copysign(np.sqrt(discriminant), B))
+        r1 = q / A
+        r2 = C / q if q != 0.0 else r1
+        lo_r, hi_r = min(r1, r2), max(r1, r2)
+    else:
+        lo_r, hi_r = np.inf, -np.inf
+
+    s_in = max(max(lo, lo_r), 0.0)
+    s_out = min(hi, hi_r)
+    if s_in <= eps:
+        s_in = 0.0
+    if not (s_out > max(s_in, eps)):
+        return np.inf, np.inf
+
+    return s_in, s_out
+
+
+@njit(cache=True)
+def interaction_point(mu, smax):
+    """
+    Generate the path length to the next interaction. Same as particle.generate_interaction_point
+
+    :param mu: attenuation length
+    :param smax: maximum path length (<=0 -> infinite)
+    :return: path length, weight factor rmax
+    """
+    rmax = 1.0
+    if smax > 0.0:
+        rmax = 1.0 - np.exp(-smax / mu)
+    r = np.random.random() * rmax
+
+    return -np.log(1 - r) * mu, rmax
+
+
+@njit(cache=True)
+def table_lookup(table, loge0, dloge, energy, x):
+    """
+    Bilinear lookup in a Compton table, see em_physics.table_lookup
+
+    :param table: table_inverse or table_cdf of em_physics
+    :param loge0, dloge: first node and spacing of the log(E) grid
+    :param energy: gamma energy (keV)
+    :param x: coordinate in [0,1] along the second table axis
+    :return: interpolated table value
+    """
+    ne, nx = table.shape
+
+    fe = min(max((np.log(energy) - loge0) / dloge, 0.0), ne - 1.0)
+    ie = min(int(fe), ne - 2)
+    fe = fe - ie
+
+    fx = min(max(x, 0.0), 1.0) * (nx - 1)
+    ix = min(int(fx), nx - 2)
+    fx = fx - ix
+
+    lo = table[ie, ix] * (1 - fx) + table[ie, ix + 1] * fx
+    hi = table[ie + 1, ix] * (1 - fx) + table[ie + 1, ix + 1] * fx
+
+    return lo * (1 - fe) + hi * fe
+
+
+@njit(cache=True)
+def compton_angle(table_inverse, table_cdf, loge0, dloge, m_electron, energy, de_max):
+    """
+    Sample the Compton scattering angle from the tabulated cdf. Same as em_physics.sample_compton
+
+    :param table_inverse, table_cdf, loge0, dloge: Compton tables of em_physics
+    :param m_electron: electron mass (keV)
+    :param energy: gamma energy (keV)
+    :param de_max: maximum energy deposit (keV)
+    :return: cos(theta), phi, weight
+    """
+    rmin = 0.0
+    if de_max < energy:
+        cost_min = 1.0 - m_electron * (1. / (energy - de_max) - 1. / energy)
+        rmin = table_lookup(table_cdf, loge0, dloge, energy, (cost_min + 1.0) / 2.0)
+
+    weight = 1 - rmin
+    cost = table_lookup(table_inverse, loge0, dloge, energy, rmin + np.random.random() * weight)
+    phi = 2 * np.pi * np.random.random()
+
+    return cost, phi, weight
+
+
+@njit(cache=True)
+def rotate(t, cost, phi, tnew):
+    """
+    Apply a scatter (cos(theta), phi) to the direction t. Same closed form as physics.rotate_direction
+
+    :param t: direction before the scatter
+    :param cost, phi: scattering angles
+    :param tnew: output array with the new direction
+    :return:
+    """
+    sint = np.sqrt(max(1.0 - cost ** 2, 0.0))
+    cphi = np.cos(phi)
+    sphi = np.sin(phi)
+
+    s = np.sqrt(max(1.0 - t[2] ** 2, 0.0))
+    if s < 1e-10:
+        tnew[0] = sint * cphi
+        tnew[1] = sint * sphi
+        tnew[2] = np.copysign(cost, t[2])
+    else:
+        tnew[0] = t[0] * cost + sint * (t[0] * t[2] * cphi - t[1] * sphi) / s
+        tnew[1] = t[1] * cost + sint * (t[1] * t[2] * cphi + t[0] * sphi) / s
+        tnew[2] = t[2] * cost - sint * cphi * s
+
+
+@njit(cache=True)
+def generate_point(radius, height, f_cyl, f_top, x0):
+    """
+    Generate a point at a random location on the cylinder. Same as cylinder.generate_point
+
+    :param radius, height, f_cyl, f_top: cylinder description
+    :param x0: output array
+    :return: surface id (0 = side, 1 = top, 2 = bottom, as cylinder.SURFACE_CYL/TOP/BOT)
+    """
+    r = np.random.random()
+    phi = 2 * np.pi * np.random.random()
+    if r <= f_cyl:
+        x0[0] = radius * np.cos(phi)
+        x0[1] = radius * np.sin(phi)
+        x0[2] = height * (np.random.random() - 0.5)
+        return 0
+    else:
+        rho = radius * np.sqrt(np.random.random())
+        x0[0] = rho * np.cos(phi)
+        x0[1] = rho * np.sin(phi)
+        if r < f_cyl + f_top:
+            x0[2] = height / 2
+            return 1
+        else:
+            x0[2] = -height / 2
+            return 2
+
+
+@njit(cache=True)
+def cone_direction(x0, surface, cone_step, axis_side, cos_side, axis_cap, cos_cap, t, tnew):
+    """
+    Generate a direction in the cone around the fiducial volume. Same as biasing.fiducial_cone
+
+    :param x0: point on the cryostat surface
+    :param surface: surface id of the point
+    :param cone_step, axis_side, cos_side, axis_cap, cos_cap: cone tables, see cone_arrays
+    :param t: output array with the direction
+    :param tnew: work array
+    :return: weight of the direction
+    """
+    rho = np.sqrt(x0[0] ** 2 + x0[1] ** 2)
+    if surface == 0:
+        i = min(int(abs(x0[2]) / cone_step), len(cos_side) - 1)
+        ax = axis_side[i, 0]
+        az = axis_side[i, 2]
+        cosa = cos_side[i]
+    else:
+        i = min(int(rho / cone_step), len(cos_cap) - 1)
+        ax = axis_cap[i, 0]
+        az = axis_cap[i, 2]
+        cosa = cos_cap[i]
+    if x0[2] < 0:
+        az = -az
+
+    if rho > 0:
+        t[0] = ax * x0[0] / rho
+        t[1] = ax * x0[1] / rho
+    else:
+        t[0] = ax
+        t[1] = 0.0
+    t[2] = az
+
+    cost = 1.0 - np.random.random() * (1.0 - cosa)
+    phi = 2 * np.pi * np.random.random()
+    rotate(t, cost, phi, tnew)
+    t[:] = tnew
+
+    return 0.5 * (1.0 - cosa)
+
+
+@njit(cache=True)
+def cross_section(sigma_table, loge0, dloge, row, energy):
+    """
+    Direct-index lookup in the resampled cross section table. Same as em_physics.get_cross_sections
+
+    :param sigma_table: table of em_physics (rows: length, att, inc, pho, pp)
+    :param loge0, dloge: first node and spacing of the log(E) grid
+    :param row: table row
+    :param energy: photon energy (keV)
+    :return: interpolated value
+    """
+    n = sigma_table.shape[1]
+    f = min(max((np.log(energy) - loge0) / dloge, 0.0), n - 1.0)
+    i = min(int(f), n - 2)
+    f -= i
+
+    return sigma_table[row, i] * (1 - f) + sigma_table[row, i + 1] * f
+
+
+@njit(cache=True)
+def propagate(energy, x0, t, weight, cryo, fid, sigma_table, sigma_loge0, sigma_dloge,
+              table_inverse, table_cdf, loge0, dloge, m_electron,
+              vrt, nscatter_max, edep_max, record):
+    """
+    Propagate a single photon history. Same physics as particle.propagate
+
+    :param energy: photon energy (keV)
+    :param x0: starting point (modified)
+    :param t: direction (modified)
+    :param weight: starting weight
+    :param cryo, fid: (radius, height, f_cyl, f_top) of the cryostat and fiducial volume
+    :param sigma_table, sigma_loge0, sigma_dloge: resampled cross section table of em_physics
+    :param table_inverse, table_cdf, loge0, dloge, m_electron: Compton tables of em_physics
+    :param vrt: VRT_NONE or VRT_FIDUCIAL_SCATTER
+    :param nscatter_max: maximum number of scatters (only with VRT)
+    :param edep_max: maximum energy deposit (keV)
+    :param record: output record [event, nscatters, w, de, x0, y0, z0, x1, y1, z1, de1, ...]
+    :return:
+    """
+    writeout = (len(record) - 7) // 4
+    tnew = np.empty(3)
+
+    edep = 0.0
+    nscatter = 0
+    record[4:7] = x0
+
+    while True:
+        #
+        # maximum path length before exiting the cryostat
+        #
+        s_in, s_out = intersect(cryo[0], cryo[1], x0, t)
+        if s_out == np.inf:
+            break
+        s_max = s_in if s_in > 0 else s_out
+        mu = cross_section(sigma_table, sigma_loge0, sigma_dloge, 0, energy)
+
+        s_max_fiducial = -1.0
+        if vrt == VRT_FIDUCIAL_SCATTER:
+            if nscatter == 0:
+                #
+                # transport to the fiducial volume
+                #
+                f_in, f_out = intersect(fid[0], fid[1], x0, t)
+                if (f_out == np.inf) or (f_in == 0.0):
+                    break
+                weight *= np.exp(-f_in / mu)
+                x0 += t * f_in
+                s_max -= f_in
+                s_max_fiducial = f_out - f_in
+            elif nscatter < nscatter_max:
+                f_in, f_out = intersect(fid[0], fid[1], x0, t)
+                if f_out == np.inf:
+                    break
+                s_max_fiducial = f_in if f_in > 0 else f_out
+            else:
+                #
+                # probability to reach the outside world
+                #
+                weight *= np.exp(-s_max / mu)
+                break
+
+        s_gen, rmax = interaction_point(mu, s_max_fiducial)
+        weight *= rmax
+        if s_gen >= s_max:
+            break
+
+        #
+        # select the scatter process. With a restricted energy deposit the PE effect is switched off
+        #
+        x0 += t * s_gen
+        frac = (cross_section(sigma_table, sigma_loge0, sigma_dloge, 2, energy) /
+                cross_section(sigma_table, sigma_loge0, sigma_dloge, 1, energy))
+        if edep_max < energy:
+            weight *= frac
+            compton = True
+        else:
+            compton = np.random.random() < frac
+
+        if compton:
+            cost, phi, w_s = compton_angle(table_inverse, table_cdf, loge0, dloge, m_electron, energy, edep_max)
+            rotate(t, cost, phi, tnew)
+            t[:] = tnew
+            enew = energy / (1. + (energy / m_electron) * (1 - cost))
+            weight *= w_s
+        else:
+            enew = 0.0
+
+        de = energy - enew
+        if nscatter < writeout:
+            record[7 + 4 * nscatter:10 + 4 * nscatter] = x0
+            record[10 + 4 * nscatter] = de
+        edep += de
+        edep_max -= de
+        energy = enew
+        nscatter += 1
+
+        if not compton:
+            break
+
+    record[1] = nscatter
+    record[2] = weight
+    record[3] = edep
+
+
+@njit(cache=True)
+def run_histories(records, first_event, energies, cryo, fid, cone_step, axis_side, cos_side, axis_cap, cos_cap,
+                  sigma_table, sigma_loge0, sigma_dloge,
+                  table_inverse, table_cdf, loge0, dloge, m_electron, vrt, nscatter_max, edep_max):
+    """
+    Generate and propagate one history per row of records
+
+    :param records: output array of shape (nevent, 7+4*writeout), initialized with nan
+    :param first_event: event number of the first history
+    :param energies: primary energy of every history (keV)
+    :param cone_step, axis_side, cos_side, axis_cap, cos_cap: cone tables of the source biasing, see
+                                                              cone_arrays (cone_step = 0 -> isotropic)
+    :param other: see propagate
+    :return:
+    """
+    x0 = np.empty(3)
+    t = np.empty(3)
+    tnew = np.empty(3)
+    for i in range(records.shape[0]):
+        surface = generate_point(cryo[0], cryo[1], cryo[2], cryo[3], x0)
+        if cone_step > 0:
+            weight = cone_direction(x0, surface, cone_step, axis_side, cos_side, axis_cap, cos_cap, t, tnew)
+        else:
+            cost = 2 * np.random.random() - 1
+            sint = np.sqrt(1 - cost ** 2)
+            phi = 2 * np.pi * np.random.random()
+            t[0] = np.cos(phi) * sint
+            t[1] = np.sin(phi) * sint
+            t[2] = cost
+            weight = 1.0
+
+        records[i, 0] = first_event + i
+        propagate(energies[i], x0, t, weight, cryo, fid, sigma_table, sigma_loge0, sigma_dloge,
+                  table_inverse, table_cdf, loge0, dloge, m_electron,
+                  vrt, nscatter_max, edep_max, records[i])
+
+
+def geometry_arrays(cyl):
+    """
+    Convert a cylinder to the array used by the kernel
+
+    :param cyl: instant of the cylinder class
+    :return: array (radius, height, f_cyl, f_top)
+    """
+    return np.array([cyl.radius, cyl.height, cyl.f_cyl, cyl.f_top], dtype=float)
+
+
+def cone_arrays(cone):
+    """
+    Convert the cone tables of the source biasing to the arrays used by the kernel
+
+    :param cone: instant of biasing.fiducial_cone, or None for isotropic sources
+    :return: tuple (cone_step, axis_side, cos_side, axis_cap, cos_cap)
+    """
+    if cone is None:
+        return 0.0, np.zeros((1, 3)), np.zeros(1), np.zeros((1, 3)), np.zeros(1)
+
+    return float(cone.step), cone.axis_side, cone.cos_side, cone.axis_cap, cone.cos_cap
+
+
+def physics_arrays(phys):
+    """
+    Convert the em_physics tables to the arrays used by the kernel
+
+    :param phys: instant of the em_physics class (with Compton tables)
+    :return: tuple (sigma_table, sigma_loge0, sigma_dloge, table_inverse, table_cdf, loge0, dloge, m_electron)
+    """
+    return (np.asarray(phys.sigma_table),
+            float(phys.sigma_loge[0]), float(phys.sigma_dloge),
+            np.asarray(phys.table_inverse), np.asarray(phys.table_cdf),
+            float(phys.table_loge[0]), float(phys.table_dloge),
+            float(phys.m_electron))
+
+
+def generate_events(nevent, **kwargs):
+    """
+    Generate nevent photon histories with the compiled kernel
+
+    :param nevent: number of events
+    :param kwargs:
+        energy, physics, geometry, fiducial, vrt, nscatter_max, edep_max = as for particle
+        source = line source, see transport.photon_bank [Default = None]
+        source_mode = 'isotropic' or 'fiducial', see transport.photon_bank [Default = 'isotropic']
+        writeout = number of interactions stored per event [Default = 4]
+        seed = random seed of the kernel [Default = None -> not reseeded]
+        first_event = event number of the first event [Default = 0]
+    :return: array with one record per event, see eventio.event_columns()
+
+    Options of the numpy engine that the kernel does not implement raise a ValueError
+    """
+    energy = kwargs.pop('energy', 0.0)
+    source = kwargs.pop('source', None)
+    phys = kwargs.pop('physics', None)
+    cryostat = kwargs.pop('geometry', None)
+    fiducial = kwargs.pop('fiducial', None)
+    vrt = kwargs.pop('vrt', None)
+    nscatter_max = kwargs.pop('nscatter_max', 1)
+    edep_max = kwargs.pop('edep_max', 100000.)
+    writeout = kwargs.pop('writeout', 4)
+    s = kwargs.pop('seed', None)
+    first_event = kwargs.pop('first_event', 0)
+    source_mode = kwargs.pop('source_mode', 'isotropic')
+    if source_mode not in ('isotropic', 'fiducial'):
+        print('kernel::generate_events ERROR only isotropic and fiducial sources are implemented in the kernel')
+        raise ValueError('source_mode %s is not implemented in the kernel' % source_mode)
+    if kwargs.pop('weight_window', None) is not None:
+        print('kernel::generate_events ERROR weight windows are not implemented in the kernel, use engine numpy')
+        raise ValueError('weight windows are not implemented in the kernel')
+    kwargs.pop('sampler_seed', None)
+    if kwargs.pop('sampler', 'random') != 'random':
+        print('kernel::generate_events ERROR QMC sampling is not implemented in the kernel, use engine numpy')
+        raise ValueError('QMC sampling is not implemented in the kernel')
+    if kwargs.pop('counter_seed', None) is not None:
+        print('kernel::generate_events ERROR the counter-based generator is not implemented in the kernel, '
+              'use engine numpy')
+        raise ValueError('the counter-based generator is not implemented in the kernel')
+
+    check_vrt(vrt)
+    if vrt == 'fiducial_scatter':
+        ivrt = VRT_FIDUCIAL_SCATTER
+        fid = geometry_arrays(fiducial)
+    else:
+        ivrt = VRT_NONE
+        fid = np.zeros(4)
+    cone = None
+    if source_mode == 'fiducial':
+        if vrt != 'fiducial_scatter':
+            print('kernel::generate_events ERROR source_mode = fiducial needs vrt = fiducial_scatter')
+            raise ValueError('source_mode fiducial needs vrt fiducial_scatter')
+        cone = get_cone(cryostat, fiducial)
+
+    if s is not None:
+        seed(s)
+
+    if source is None:
+        energies = np.full(nevent, float(energy))
+        records = np.full((nevent, 7 + 4 * writeout), np.nan)
+    else:
+        # the lines are sampled outside the kernel, from a generator seeded like the kernel
+        energies = source.sample(nevent, rng=np.random.default_rng(s))[1]
+        records = np.full((nevent, 8 + 4 * writeout), np.nan)
+        records[:, -1] = energies
+
+    run_histories(records, first_event, energies, geometry_arrays(cryostat), fid, *cone_arrays(cone),
+                  *physics_arrays(phys), ivrt, nscatter_max, float(edep_max))
+
+    return records
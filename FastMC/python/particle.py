@@ -1,6 +1,15 @@
+import copy
+import time
+
 import numpy as np
 import pandas as pd
 
+from physics import rotate_direction
+from cylinder import surface_names
+from biasing import get_cone
+from sampler import uniform_stream
+from transport import check_vrt
+
 
 class particle:
     #@jit()
@@ -18,6 +27,19 @@ class particle:
             nscatter_max = maximum number of scatters (only when vrt<>None)
             edep_max = maximum energy deposit in the xenon (keV)
             debug = show debug printout information [Default = False]
+            instrument = instrumentation instance (see instrument.py) that counts the transport decisions
+                         and times the source and geometry stages [Default = None -> off]
+            weight_window = weight window (see weight_window.py) applied before every interaction in the
+                            fiducial volume with vrt = 'fiducial_scatter'. Split photons end up in
+                            self.tracks [Default = None -> off]
+            source_mode = 'isotropic' or 'fiducial' = directions biased into a cone around the fiducial volume,
+                          with the weight correction (see biasing.py, only with vrt = 'fiducial_scatter')
+                          [Default = 'isotropic']
+            uniforms = QMC point of the event (see sampler.py): the draws of the first interaction (start point,
+                       direction, depth, process and Compton angle) are taken from it [Default = None -> np.random]
+            counter = counter-based generator (see counter_rng.philox_stream) that all other draws are taken
+                      from instead of np.random [Default = None -> np.random]
+            event = event number of the particle, the counter of its draws [Default = 0]
         """
         # # # print("particle::initialize")
 
@@ -27,11 +49,19 @@ class particle:
         self.cryostat = kwargs.pop('geometry',None)
         self.fiducial = kwargs.pop('fiducial',None)
         self.debug = kwargs.pop('debug',False)
+        self.instrument = kwargs.pop('instrument',None)
+        self.weight_window = kwargs.pop('weight_window',None)
+        self.source_mode = kwargs.pop('source_mode','isotropic')
+        uniforms = kwargs.pop('uniforms',None)
+        self.stream = None if uniforms is None else uniform_stream(uniforms)
+        self.counter = kwargs.pop('counter',None)
+        self.ctr_event = np.array([kwargs.pop('event',0)], dtype=np.int64)
 
         #
         # vrt = variance reduction technique
         #
         self.vrt = kwargs.pop('vrt', None)
+        check_vrt(self.vrt)
         #
         # default number of scatters = 1 (only with vrt<>None)
         #
@@ -53,6 +83,18 @@ class particle:
         self.direction = np.zeros(3)
         self.edep = 0 # deposited energy
 
+        #
+        # weight window: scatter level of the last check (-1 = not checked yet). Photons that are split
+        # restart from the interaction point search, in the fiducial volume
+        #
+        self.ww_level = -1
+        if (self.weight_window is not None) and (self.vrt != 'fiducial_scatter'):
+            print('particle::__init__ ERROR weight windows need vrt = fiducial_scatter')
+            raise ValueError('weight windows need vrt fiducial_scatter')
+        if (self.source_mode == 'fiducial') and (self.vrt != 'fiducial_scatter'):
+            print('particle::__init__ ERROR source_mode = fiducial needs vrt = fiducial_scatter')
+            raise ValueError('source_mode fiducial needs vrt fiducial_scatter')
+
         # generate the x0 and direction of the particle
         self.generate()
 
@@ -78,35 +120,57 @@ class particle:
         :param:
         :return:
         """
+        t0 = time.perf_counter() if self.instrument is not None else 0.0
 
         #
         # generate x0 of the particle to be at a random location on the cylinder
         #
-        self.x0 = self.cryostat.generate_point()['x']
+        self.nscatter = 0
+        # counter-based generator: track number and number of draws of this photon, number of tracks of the event
+        self.ctr_track = np.zeros(1, dtype=np.int64)
+        self.ctr_draw = np.zeros(1, dtype=np.int64)
+        self.ntrack = [1]
+        point = self.cryostat.generate_point(rng=self.draw_rng('surface'))
+        self.x0 = point['x']
         self.x0start = self.x0
 
-        #
-        # generate a random direction for the particle
-        #
-        cost = np.random.uniform(-1, 1)
-        sint = np.sqrt(1 - cost ** 2)
-        phi = 2 * np.pi * np.random.uniform(0, 1)
+        if self.source_mode == 'fiducial':
+            #
+            # direction in the cone around the fiducial volume. The weight corrects for the bias
+            #
+            cone = get_cone(self.cryostat, self.fiducial)
+            points = {'x': self.x0[None, :], 'surface': np.array([surface_names.index(point['surface'])])}
+            direction, w = cone.generate_directions(points, rng=self.draw_rng('direction_1', rows=[0]))
+            self.direction = direction[0]
+            self.weight = float(w[0])
+            self.theta = np.arccos(self.direction[2])
+            self.phi = np.arctan2(self.direction[1], self.direction[0])
+        else:
+            #
+            # generate a random direction for the particle
+            #
+            rng = self.draw_rng('direction_1')
+            cost = rng.uniform(-1, 1)
+            sint = np.sqrt(1 - cost ** 2)
+            phi = 2 * np.pi * rng.uniform(0, 1)
 
-        tx = np.cos(phi) * sint
-        ty = np.sin(phi) * sint
-        tz = cost
+            tx = np.cos(phi) * sint
+            ty = np.sin(phi) * sint
+            tz = cost
 
-        #
-        # store theta and phi
-        #
-        self.theta = np.arccos(cost)
-        self.phi = phi
+            #
+            # store theta and phi
+            #
+            self.theta = np.arccos(cost)
+            self.phi = phi
 
-        #
-        # store the directional unit vector
-        #
-        self.direction = np.array([tx, ty, tz])
+            #
+            # store the directional unit vector
+            #
+            self.direction = np.array([tx, ty, tz])
 
+        if self.instrument is not None:
+            self.instrument.add_time('source', t0)
 
         return
 
@@ -121,6 +185,7 @@ class particle:
         2=particle hits the cylinder at two spots
 
         """
+        t0 = time.perf_counter() if self.instrument is not None else 0.0
 
         #
         # intersection with top plane of cylinder
@@ -147,6 +212,10 @@ class particle:
             except:
                 pass
 
+        if self.instrument is not None:
+            self.instrument.count('intersections')
+            self.instrument.add_time('geometry', t0)
+
         return intersections
 
     def intersect_with_side(self, cylinder):
@@ -216,15 +285,35 @@ class particle:
 
     def propagate(self):
         """
-        Propagate the particle
+        Propagate the particle. With a weight window the photons split from it are propagated as well, and
+        self.tracks holds the particle and all its split copies (one record each)
         :return:
         """
-
-        terminate = False
         if self.debug == True:
             print("particle::propagate Next event")
 
         self.nscatter = 0
+        if self.instrument is not None:
+            self.instrument.count('histories')
+
+        self.stack = []
+        self.transport()
+        self.tracks = [self]
+        while len(self.stack) > 0:
+            track = self.stack.pop()
+            track.transport()
+            self.tracks.append(track)
+
+        return
+
+    def transport(self):
+        """
+        Transport the photon until it is absorbed, escapes or is terminated by the VRT
+        :return:
+        """
+
+        terminate = False
+        ins = self.instrument
         while terminate == False:
             #
             # intersection of track with cryostat
@@ -248,7 +337,7 @@ class particle:
                 #
                 if self.vrt == 'fiducial_scatter':
 
-                    if self.nscatter == 0: # transport to the fiducial volume
+                    if (self.nscatter == 0) and (self.ww_level < 0): # transport to the fiducial volume
                         if self.debug == True:
                             print('particle::propagate VRT - transport to fiducial volume is ON')
 
@@ -265,9 +354,11 @@ class particle:
                             s_max = s_max - s_fiducial_entry
                             s_max_fiducial = s_fiducial_exit-s_fiducial_entry
                         else:
+                            if ins is not None:
+                                ins.count('fiducial_miss')
                             terminate = True
                             continue # jump out of while loop
-                    elif (self.nscatter>0) & (self.nscatter<self.nscatter_max):
+                    elif ((self.nscatter>0) or (self.ww_level>=0)) and (self.nscatter<self.nscatter_max):
                         #  multiple scatters as well!
                         #  determine s to boundary of fiducial volume.... (we are already inside so we will find an intersection)
                         fiducial_intersections = self.intersect(self.fiducial)
@@ -288,9 +379,23 @@ class particle:
                         #
                         prob = self.phys.get_att_probability(energy=self.energy, distance=s_max)
                         self.weight = self.weight*prob
+                        if ins is not None:
+                            ins.count('nscatter_max_terminations')
                         terminate = True
                         continue
 
+                    #
+                    # weight window, once per scatter level
+                    #
+                    if (self.weight_window is not None) and (self.ww_level < self.nscatter):
+                        n = self.apply_weight_window()
+                        if n == 0:
+                            terminate = True
+                            continue
+                        if n > 1:
+                            # the photon and its copies start again from here
+                            continue
+
                 # 1. if one intersection this gives the exit point.
                 # 2. if two intersection this gives the entry point to a new volume (needed for fiducial)
                 #    volume variance reduction
@@ -306,6 +411,8 @@ class particle:
                     # actual scattering: either Compton or Photo-electric effect
                     #
                     process = self.scatter(s_gen)
+                    if ins is not None:
+                        ins.count('compton' if process == 'inc' else 'photoelectric')
                     #
                     # if the scattering was by the Photo-electric effect, the photon is terminated
                     #
@@ -315,18 +422,73 @@ class particle:
                     #
                     # terminate photon tracking if it exits the xenon volume
                     #
+                    if ins is not None:
+                        ins.count('escaped')
                     terminate = True
             else:
                 #
                 # no intersection.... terminate the propagator
                 #
+                if ins is not None:
+                    ins.count('escaped')
                 terminate = True
 
+        if (ins is not None) and (self.weight == 0.0):
+            ins.count('weight_killed')
+
         if self.debug == True:
             print('particle::propagate exit propagator')
 
         return
 
+    def apply_weight_window(self):
+        """
+        Split or roulette the photon with the weight window of the current scatter level. The copies of a
+        split photon are put on the stack of the primary
+
+        :return: number of photons after the check (0 = killed)
+        """
+        self.ww_level = self.nscatter
+        n, w = self.weight_window.apply(self.weight, self.nscatter, self.draw_rng().uniform(0, 1))
+        n = int(n)
+        self.weight = float(w)
+        if n > 1:
+            # the copies restart from here: their first interaction is no longer sampled from the QMC point
+            self.stream = None
+
+        for i in range(n - 1):
+            track = copy.copy(self)
+            track.xint = list(self.xint)
+            # a copy is a new track of the event, with its own random sequence
+            track.ctr_track = np.array([self.ntrack[0]], dtype=np.int64)
+            track.ctr_draw = np.zeros(1, dtype=np.int64)
+            self.ntrack[0] += 1
+            self.stack.append(track)
+
+        if self.instrument is not None:
+            if n == 0:
+                self.instrument.count('ww_roulette_kills')
+            elif n > 1:
+                self.instrument.count('ww_splits', n - 1)
+
+        return n
+
+    def draw_rng(self, dimension=None, rows=None):
+        """
+        Random generator of a draw: the QMC point of the particle before the first interaction, otherwise
+        the counter-based generator or np.random
+
+        :param dimension: name of the draw, see sampler.sampler_dimensions [Default = None -> never QMC]
+        :param rows: None for draws of a float, [0] for draws of an array of one value
+        :return: generator with a uniform(low, high, size) method
+        """
+        if (self.stream is not None) and (self.nscatter == 0) and (dimension is not None):
+            return self.stream.select(rows, dimension)
+        if self.counter is not None:
+            return self.counter.select(self.ctr_event, self.ctr_track, self.ctr_draw, rows)
+
+        return np.random
+
     def get_info(self, i):
         data = []
 
@@ -354,7 +516,7 @@ class particle:
         #
         # generate the path length
         #
-        r = np.random.uniform(0,rmax)
+        r = self.draw_rng('interaction').uniform(0,rmax)
         L =  - np.log(1-r) * mu
 
         return L
@@ -372,7 +534,8 @@ class particle:
             #
             # Compton scatter
             #
-            theta_s, phi_s, w_s = self.phys.do_compton(self.energy, self.edep_max)
+            theta_s, phi_s, w_s = self.phys.do_compton(self.energy, self.edep_max,
+                                                       rng=self.draw_rng('compton_r', rows=[0]))
             self.update_particle('inc',s,theta_s, phi_s, w_s)
 
             # calculate teh energy deposit in the xenon
@@ -415,13 +578,8 @@ class particle:
             #
             # calculate the particle direction after interaction
             #
-            sint = np.sin(theta_scatter)
             cost = np.cos(theta_scatter)
-
-            t = [sint * np.cos(phi_scatter), sint * np.sin(phi_scatter), cost]
-            m = self.calculate_rotation_matrix()
-            t_new = np.array(m.dot(t))
-            t_new = t_new.flatten()
+            t_new = rotate_direction(self.direction, cost, phi_scatter)
 
             #
             # calculate the new photon energy
@@ -496,7 +654,7 @@ class particle:
             #
             # choose incoherent or photo-electric effect based on their relative cross sections
             #
-            r = np.random.uniform(0,1)
+            r = self.draw_rng('process').uniform(0,1)
             # # # print('stot = ',sigma_total,' sinc = ',sigma_inc,' frac = ',frac,' r= ',r)
             if r < frac:
                 process = 'inc'
@@ -504,25 +662,3 @@ class particle:
                 process = 'pho'
 
         return process
-
-    def calculate_rotation_matrix(self):
-        """
-        Calculate the rotation matrix to go from local scattering system to global coordinate system. Needed
-        after a scatter.
-        :return:
-        """
-
-        theta = np.arccos(self.direction[2])
-        cth = np.cos(theta)
-        sth = np.sin(theta)
-
-        phi = np.arctan2(self.direction[1],self.direction[0])
-        cph = np.cos(phi)
-        sph = np.sin(phi)
-
-        rot_phi = np.matrix([[cph,-sph,0],[sph,cph,0],[0,0,1]])
-        rot_the = np.matrix([[cth,0,sth],[0,1,0],[-sth,0,cth]])
-
-        mrot = rot_phi * rot_the
-
-        return mrot
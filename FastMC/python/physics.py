@@ -1,5 +1,77 @@
+import hashlib
+import math
+import os
+import shutil
+import tempfile
+import time
+
 import numpy as np
 
+# location of the cross section data, relative to this file
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'xenon_cross_section')
+# default location of the binary table cache
+cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'FastMC')
+# bump when the content or layout of the cached tables changes
+cache_version = 2
+
+# tables that are stored in the binary cache
+cached_tables = ['e', 'sigma_coh', 'sigma_inc', 'sigma_pho', 'sigma_pp_nuc', 'sigma_pp_el', 'sigma_pp',
+                 'sigma_att', 'att', 'x', 'Fx', 'Sx',
+                 'table_loge', 'table_prob', 'table_inverse', 'table_cdf', 'sigma_loge', 'sigma_table']
+# optional tables: only in caches with compton_table = True and sigma_table = True
+compton_tables = ['table_loge', 'table_prob', 'table_inverse', 'table_cdf']
+lookup_tables = ['sigma_loge', 'sigma_table']
+
+# rows of em_physics.sigma_table: attenuation length (cm), then the cross sections (cm2/g) of get_sigma
+sigma_rows = ['length', 'att', 'inc', 'pho', 'pp']
+
+
+def rotate_direction(t, cost, phi):
+    """
+    Apply a scatter with polar angle cos(theta) and azimuth phi to the direction(s) t, with the
+    closed-form rotation to the global frame. Same mapping as the rotation Rz(phi_t)*Ry(theta_t) of the
+    local scattering frame, without trigonometric round trips. For |tz| ~ 1 the local frame is the
+    global one.
+
+    :param t: unit direction(s), array (3) or (n,3)
+    :param cost: cosine of the scattering angle (float or array (n))
+    :param phi: azimuthal scattering angle (float or array (n))
+    :return: new unit direction(s), same shape as t
+    """
+    t = np.asarray(t, dtype=float)
+    if t.ndim == 1:
+        #
+        # single direction: plain float arithmetic
+        #
+        ux, uy, uz = float(t[0]), float(t[1]), float(t[2])
+        sint = math.sqrt(max(1.0 - cost ** 2, 0.0))
+        cphi = math.cos(phi)
+        sphi = math.sin(phi)
+        s = math.sqrt(max(1.0 - uz ** 2, 0.0))
+        if s < 1e-10:
+            return np.array([sint * cphi, sint * sphi, math.copysign(cost, uz)])
+        return np.array([ux * cost + sint * (ux * uz * cphi - uy * sphi) / s,
+                         uy * cost + sint * (uy * uz * cphi + ux * sphi) / s,
+                         uz * cost - sint * cphi * s])
+
+    ux, uy, uz = t[:, 0], t[:, 1], t[:, 2]
+
+    sint = np.sqrt(np.maximum(1.0 - cost ** 2, 0.0))
+    cphi = np.cos(phi)
+    sphi = np.sin(phi)
+
+    s = np.sqrt(np.maximum(1.0 - uz ** 2, 0.0))
+    pole = s < 1e-10
+    s = np.where(pole, 1.0, s)
+
+    tnew = np.empty(t.shape)
+    tnew[:, 0] = np.where(pole, sint * cphi, ux * cost + sint * (ux * uz * cphi - uy * sphi) / s)
+    tnew[:, 1] = np.where(pole, sint * sphi, uy * cost + sint * (uy * uz * cphi + ux * sphi) / s)
+    tnew[:, 2] = np.where(pole, np.copysign(cost, uz), uz * cost - sint * cphi * s)
+
+    return tnew
+
+
 class em_physics:
     """
     The electromagnetic physics driver for the simulation
@@ -11,6 +83,17 @@ class em_physics:
         Initialize EM physics
 
         :param kwargs:
+            compton_table = build the Compton sampling tables at startup [Default = True]
+            table_emin, table_emax = energy range of the Compton tables in keV [Default = 1, 10000]
+            table_nenergy = number of log-spaced energy nodes [Default = 201]
+            table_nprob = number of cumulative probability nodes [Default = 4097]
+            data_dir = directory with gamma_sigma.txt and formfactors.txt [Default = FastMC/data/xenon_cross_section]
+            cache_dir = directory of the binary table cache [Default = ~/.cache/FastMC]
+            use_cache = load/store the parsed tables in the binary cache [Default = True]
+            sigma_table = resample the cross sections on a uniform log(E) grid for O(1) lookups [Default = True]
+            sigma_nper_decade = number of nodes per decade of the cross section grid [Default = 2000]
+            instrument = instrumentation instance (see instrument.py) that counts and times the cross
+                         section lookups and the Compton sampling [Default = None -> off]
         """
 
         # physical constants
@@ -18,12 +101,119 @@ class em_physics:
         self.alpha = 1.0  # fine structure constant
         self.rc = 1.0  # reduced Compton wavelength rc=hbar/me/c
 
+        self.Z_xenon = 54
+        self.rho = 3.0 # gram/cm3
+
+        # cos(theta) grid of the exact Compton cdf
+        self.cost_range = np.linspace(-1.0, +1.0, 10001, endpoint=True)
+
+        self.instrument = kwargs.pop('instrument', None)
+        self.data_dir = kwargs.pop('data_dir', data_dir)
+        self.cache_dir = kwargs.pop('cache_dir', cache_dir)
+        use_cache = kwargs.pop('use_cache', True)
+        compton_table = kwargs.pop('compton_table', True)
+        table_settings = {'emin': kwargs.pop('table_emin', 1.0),
+                          'emax': kwargs.pop('table_emax', 10000.0),
+                          'nenergy': kwargs.pop('table_nenergy', 201),
+                          'nprob': kwargs.pop('table_nprob', 4097)}
+        sigma_table = kwargs.pop('sigma_table', True)
+        sigma_nper_decade = kwargs.pop('sigma_nper_decade', 2000)
+
+        fn_nist = os.path.join(self.data_dir, 'gamma_sigma.txt')
+        fn_ff = os.path.join(self.data_dir, 'formfactors.txt')
+
+        # the cache key changes with the content of the data files and the table settings
+        key = self.cache_key([fn_nist, fn_ff], [cache_version, compton_table, sorted(table_settings.items()),
+                                                sigma_table, sigma_nper_decade])
+        skip = ([] if compton_table else compton_tables) + ([] if sigma_table else lookup_tables)
+        if use_cache and self.read_cache(key, skip=skip):
+            if compton_table:
+                self.table_dloge = self.table_loge[1] - self.table_loge[0]
+            if sigma_table:
+                self.sigma_dloge = self.sigma_loge[1] - self.sigma_loge[0]
+            return
+
         # extract data from the NIST textfile
-        self.extract_nist('../data/xenon_cross_section/gamma_sigma.txt')
+        self.extract_nist(fn_nist)
         # extract data from the Hubbel form factor data
-        self.extract_formfactors('../data/xenon_cross_section/formfactors.txt')
+        self.extract_formfactors(fn_ff)
 
-        self.Z_xenon = 54
+        # resample the cross sections for direct-index lookups
+        if sigma_table:
+            self.build_sigma_table(nper_decade=sigma_nper_decade)
+
+        # tabulate the Compton angular distribution once
+        if compton_table:
+            self.build_compton_table(**table_settings)
+
+        if use_cache:
+            self.write_cache(key)
+
+        return
+
+    def cache_key(self, files, settings):
+        """
+        Checksum of the data files and the settings that determine the cached tables
+
+        :param files: list of data files
+        :param settings: anything with a stable repr()
+        :return: hex digest
+        """
+        h = hashlib.sha256()
+        for fn in files:
+            with open(fn, 'rb') as f:
+                h.update(f.read())
+        h.update(repr(settings).encode())
+
+        return h.hexdigest()[:16]
+
+    def read_cache(self, key, skip=()):
+        """
+        Load the tables from the binary cache. The arrays are memory-mapped
+
+        :param key: cache key (see cache_key)
+        :param skip: optional tables that are not used with the current settings (compton_tables, lookup_tables)
+        :return: True if the cache was found with all other tables
+        """
+        path = os.path.join(self.cache_dir, 'xenon_' + key)
+        if not os.path.isdir(path):
+            return False
+
+        names = [name for name in cached_tables if name not in skip]
+        if not all(os.path.exists(os.path.join(path, name + '.npy')) for name in names):
+            print('em_physics::read_cache WARNING incomplete cache', path, ', the tables are rebuilt')
+            return False
+
+        for name in names:
+            # plain ndarray view of the mapping: indexing a np.memmap has a per-call overhead
+            setattr(self, name, np.asarray(np.load(os.path.join(path, name + '.npy'), mmap_mode='r')))
+
+        return True
+
+    def write_cache(self, key):
+        """
+        Store the tables in the binary cache
+
+        :param key: cache key (see cache_key)
+        :return:
+        """
+        path = os.path.join(self.cache_dir, 'xenon_' + key)
+        tmp = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = tempfile.mkdtemp(dir=self.cache_dir)
+            for name in cached_tables:
+                if hasattr(self, name):
+                    np.save(os.path.join(tmp, name + '.npy'), getattr(self, name))
+            # atomic: concurrent jobs either see the complete cache or none
+            os.rename(tmp, path)
+        except OSError as err:
+            # a partial cache is never left behind
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
+            # unless another process wrote the same cache in the meantime
+            if not os.path.isdir(path):
+                print('em_physics::write_cache WARNING could not write cache to', path, ':', err)
 
         return
 
@@ -45,7 +235,7 @@ class em_physics:
                 if len(line) < 5:
                     continue
                 # Cut off the shell indication and newline character
-                params = [np.float(el) for el in line.split()]
+                params = [float(el) for el in line.split()]
 
                 all_params.append(params)
 
@@ -84,13 +274,12 @@ class em_physics:
                     continue
                 # Cut off the shell indication and newline character
                 line = line[7:-1]
-                params = [np.float(el) for el in line.split(sep=' ')]
+                params = [float(el) for el in line.split(sep=' ')]
 
                 all_params.append(params)
 
         d = np.array(all_params)
 
-        self.rho = 3.0 # gram/cm3
         self.e = d[:, 0] # energy range
         self.sigma_coh = d[:, 1]  # Coherent
         self.sigma_inc = d[:, 2]  # Incoherent. This is Compton scattering
@@ -103,6 +292,114 @@ class em_physics:
 
         return
 
+    def interp_loglog(self, energy, sigma):
+        """
+        Log-log interpolation of a NIST table at the energies of the data file. At the absorption edges
+        (energies listed twice) the value above the edge is used. Where one of the two nodes is zero
+        (pair production close to threshold) the interpolation is linear
+
+        :param energy: array of gamma energies (keV)
+        :param sigma: table on the NIST energy grid (self.e)
+        :return: interpolated values
+        """
+        loge = np.log(np.asarray(energy, dtype=float) / 1e3)
+        loge_nist = np.log(self.e)
+
+        i = np.clip(np.searchsorted(loge_nist, loge, side='right') - 1, 0, len(loge_nist) - 2)
+        f = np.clip((loge - loge_nist[i]) / (loge_nist[i + 1] - loge_nist[i]), 0.0, 1.0)
+
+        lo = sigma[i]
+        hi = sigma[i + 1]
+        positive = (lo > 0) & (hi > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            loglog = np.exp(np.log(lo) + f * (np.log(hi) - np.log(lo)))
+
+        return np.where(positive, loglog, lo + f * (hi - lo))
+
+    def build_sigma_table(self, nper_decade=2000):
+        """
+        Resample the cross sections and the attenuation length on a uniform grid in log(E) that spans the
+        NIST energy range. The nodes are filled with the log-log interpolation of the NIST points
+        (interp_loglog), so that a lookup is a direct index computation plus a linear interpolation
+        between two nodes (see get_cross_sections).
+
+        Accuracy: with the default 2000 nodes per decade the lookup deviates from the log-log interpolation
+        of the NIST data by less than 1e-4 (relative) for the attenuation, Compton and PE tables and by less
+        than 5e-4 for pair production close to threshold. Within one node spacing (0.12% in energy) of an
+        absorption edge the jump is spread over the grid cell (see check_sigma_table).
+
+        :param nper_decade: number of nodes per decade of energy
+        :return:
+        """
+        loge_min = np.log(self.e[0] * 1e3)
+        loge_max = np.log(self.e[-1] * 1e3)
+        n = int(np.ceil((loge_max - loge_min) / np.log(10.) * nper_decade)) + 1
+
+        self.sigma_loge = np.linspace(loge_min, loge_max, n)
+        self.sigma_dloge = self.sigma_loge[1] - self.sigma_loge[0]
+
+        energy = np.exp(self.sigma_loge)
+        self.sigma_table = np.empty((len(sigma_rows), n))
+        self.sigma_table[1] = self.interp_loglog(energy, self.sigma_att)
+        self.sigma_table[2] = self.interp_loglog(energy, self.sigma_inc)
+        self.sigma_table[3] = self.interp_loglog(energy, self.sigma_pho)
+        self.sigma_table[4] = self.interp_loglog(energy, self.sigma_pp)
+        self.sigma_table[0] = 1 / (self.rho * self.sigma_table[1])
+
+        return
+
+    def get_cross_sections(self, energy):
+        """
+        Attenuation length and all cross sections for an array of energies in a single lookup on the
+        resampled grid (build_sigma_table). Energies outside the NIST range are clipped to the range
+
+        :param energy: gamma energies in keV (float or array)
+        :return: array (5, n) with rows sigma_rows: attenuation length (cm), att, inc, pho, pp (cm2/g)
+        """
+        n = self.sigma_table.shape[1]
+        if np.ndim(energy) == 0:
+            #
+            # single energy: plain float arithmetic for the index
+            #
+            f = min(max((math.log(energy) - self.sigma_loge[0]) / self.sigma_dloge, 0.0), n - 1.0)
+            i = min(int(f), n - 2)
+            f = f - i
+            return (self.sigma_table[:, i] * (1 - f) + self.sigma_table[:, i + 1] * f)[:, None]
+
+        loge = np.log(np.asarray(energy, dtype=float))
+        # np.minimum/np.maximum instead of np.clip: np.clip has a large per-call overhead
+        f = np.minimum(np.maximum((loge - self.sigma_loge[0]) / self.sigma_dloge, 0), n - 1)
+        i = np.minimum(f.astype(np.int64), n - 2)
+        f = f - i
+
+        return self.sigma_table[:, i] * (1 - f) + self.sigma_table[:, i + 1] * f
+
+    def check_sigma_table(self, energies=None):
+        """
+        Compare the resampled cross sections with the log-log interpolation of the NIST data
+
+        :param energies: energies to test (keV). Default: midpoints between the grid nodes, without the
+                         grid cells that contain an absorption edge
+        :return: maximum relative deviation per row of sigma_table
+        """
+        if energies is None:
+            loge = self.sigma_loge[:-1] + self.sigma_dloge / 2
+            edges = np.log(self.e[np.flatnonzero(np.diff(self.e) == 0)] * 1e3)
+            cell = np.floor((loge - self.sigma_loge[0]) / self.sigma_dloge)
+            near_edge = np.isin(cell, np.floor((edges - self.sigma_loge[0]) / self.sigma_dloge))
+            energies = np.exp(loge[~near_edge])
+
+        table = self.get_cross_sections(energies)
+        exact = np.array([self.interp_loglog(energies, self.sigma_att), self.interp_loglog(energies, self.sigma_att),
+                          self.interp_loglog(energies, self.sigma_inc), self.interp_loglog(energies, self.sigma_pho),
+                          self.interp_loglog(energies, self.sigma_pp)])
+        exact[0] = 1 / (self.rho * exact[0])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rel = np.where(exact > 0, np.abs(table / exact - 1), np.abs(table - exact))
+
+        return rel.max(axis=1)
+
     def get_sigma(self, **kwargs):
         """
 
@@ -111,17 +408,26 @@ class em_physics:
                  "pho" = PE absorption,
                  "inc" = incoherent scatter - Compton,
                  "pp"  = pair creation
-        energy=energy of gamma in keV,
+        energy=energy of gamma in keV (float or array),
 
         :return: cross section in cm2/g
         """
         process = kwargs.pop('process','att')
         energy = kwargs.pop('energy',-1.0)
-        if energy<0:
+        if np.any(np.asarray(energy)<0):
             print('emphysics::get_sigma ERROR wrong energy. E=',energy)
             return -1
 
-        if process == "att":  # total cross section
+        if process not in sigma_rows[1:]:
+            print('em_physics::get_sigma ERROR wrong process selected')
+            return -1
+
+        t0 = time.perf_counter() if self.instrument is not None else 0.0
+
+        if hasattr(self, 'sigma_table'):
+            mu = self.get_cross_sections(energy)[sigma_rows.index(process)]
+            mu = mu if np.ndim(energy) > 0 else mu[0]
+        elif process == "att":  # total cross section
             mu = np.interp(energy / 1e3, self.e, self.sigma_att)
         elif process == "pho": # PE absorption
             mu = np.interp(energy / 1e3,self.e,self.sigma_pho)
@@ -129,8 +435,10 @@ class em_physics:
             mu = np.interp(energy / 1e3,self.e,self.sigma_inc)
         elif process == "pp": # pair creation
             mu = np.interp(energy / 1e3,self.e,self.sigma_pp)
-        else:
-            print('em_physics::get_sigma ERROR wrong process selected')
+
+        if self.instrument is not None:
+            self.instrument.count('cross_section_lookups', np.size(energy))
+            self.instrument.add_time('physics', t0)
 
         return mu
 
@@ -143,9 +451,20 @@ class em_physics:
         :return: attenuation length in cm
         """
         energy = kwargs.pop('energy',-1.0)
+        t0 = time.perf_counter() if self.instrument is not None else 0.0
+
+        if hasattr(self, 'sigma_table'):
+            att = self.get_cross_sections(energy)[0]
+            att = att if np.ndim(energy) > 0 else att[0]
+        else:
+            mu = np.interp(energy / 1e3, self.e, self.sigma_att)
+            att = 1/ ( mu * self.rho)
 
-        mu = np.interp(energy / 1e3, self.e, self.sigma_att)
-        return 1/ ( mu * self.rho)
+        if self.instrument is not None:
+            self.instrument.count('cross_section_lookups', np.size(energy))
+            self.instrument.add_time('physics', t0)
+
+        return att
 
     def get_att_probability(self, **kwargs):
         """
@@ -234,45 +553,153 @@ class em_physics:
         """
         return np.interp(x,self.x,self.Sx)
 
-    def do_compton(self, energy, de_max):
+    def compton_cdf(self, energy):
         """
-        Select the Compton scattering angle based on the Klein-Nishina differential cross section
+        Exact cdf of cos(theta) for Compton scattering, constructed from the Klein-Nishina
+        differential cross section with the Hubbel form factor on the cost_range grid
 
         :param energy: gamma energy
-        :param de_max: maximum energy deposit
+        :return: cdf on cost_range
+        """
+        dsigma = self.KleinNishina(energy, self.cost_range, formfactor=True)
+        return dsigma.cumsum() / dsigma.sum()
+
+    def build_compton_table(self, emin=1.0, emax=10000.0, nenergy=201, nprob=4097):
+        """
+        Tabulate the Compton angular distribution on a log-spaced energy grid.
+
+        Two tables are filled from the exact cdf (compton_cdf) at every energy node:
+            * the inverse cdf cos(theta)(E, r) on a uniform grid in the cumulative probability r
+            * the cdf r(E, cos(theta)) on cost_range, used for the rmin of the truncated sampling
+              when de_max < energy
+        Between energy nodes both tables are interpolated linearly in log(E) at fixed r (or cos(theta)).
+
+        Accuracy: with the default grid (50 nodes per decade, 4097 probability nodes) the cdf of the
+        tabulated sampling deviates from the exact construction by less than 2e-4 between 10 keV and
+        10 MeV, and rmin (i.e. the weight 1-rmin) by less than 1e-4 (see check_compton_table).
+
+        :param emin, emax: energy range in keV
+        :param nenergy: number of energy nodes
+        :param nprob: number of cumulative probability nodes
         :return:
         """
+        self.table_loge = np.linspace(np.log(emin), np.log(emax), nenergy)
+        self.table_dloge = self.table_loge[1] - self.table_loge[0]
+        self.table_prob = np.linspace(0.0, 1.0, nprob)
 
-        #
-        # if the energy deposit is unrestricted then cos(theta)_min = -1.0
-        #
-        cost_min = -1.0
-        rmin = 0.
-        weight = 1.0
+        self.table_inverse = np.empty((nenergy, nprob))
+        self.table_cdf = np.empty((nenergy, len(self.cost_range)))
+        for i, loge in enumerate(self.table_loge):
+            cdf = self.compton_cdf(np.exp(loge))
+            self.table_inverse[i] = np.interp(self.table_prob, cdf, self.cost_range)
+            self.table_cdf[i] = cdf
 
+        return
+
+    def table_lookup(self, table, energy, x):
+        """
+        Bilinear lookup in a Compton table with a uniform grid in log(E) and x in [0,1]
+
+        :param table: table_inverse or table_cdf
+        :param energy: array of gamma energies (keV)
+        :param x: array of coordinates in [0,1] along the second table axis
+        :return: interpolated table values
+        """
+        ne, nx = table.shape
+
+        fe = (np.log(energy) - self.table_loge[0]) / self.table_dloge
+        fe = np.minimum(np.maximum(fe, 0), ne - 1)
+        ie = np.minimum(fe.astype(np.int64), ne - 2)
+        fe = fe - ie
+
+        fx = np.minimum(np.maximum(x, 0.0), 1.0) * (nx - 1)
+        ix = np.minimum(fx.astype(np.int64), nx - 2)
+        fx = fx - ix
+
+        lo = table[ie, ix] * (1 - fx) + table[ie, ix + 1] * fx
+        hi = table[ie + 1, ix] * (1 - fx) + table[ie + 1, ix + 1] * fx
+
+        return lo * (1 - fe) + hi * fe
+
+    def sample_compton(self, energy, de_max, rng=None):
+        """
+        Select Compton scattering angles for an array of photons from the tabulated Klein-Nishina x form
+        factor distribution. If de_max < energy the cos(theta) range is truncated to cost_min and the
+        weight is 1-rmin
+
+        :param energy: array of gamma energies (keV)
+        :param de_max: array (or float) of maximum energy deposits (keV)
+        :param rng: numpy.random.Generator [Default = None -> np.random]
+        :return: cos(theta), phi, weight
+        """
+        if rng is None:
+            rng = np.random
+        t0 = time.perf_counter() if self.instrument is not None else 0.0
+
+        energy = np.asarray(energy, dtype=float)
+        de_max = np.broadcast_to(np.asarray(de_max, dtype=float), energy.shape)
 
-            
-        #
-        # make the cdf from the differential cross section
-        #
-        cost_range = np.linspace(-1.0, +1.0, 10001, endpoint=True)
-        dsigma = self.KleinNishina(energy, cost_range, formfactor=True)
-        cdf = dsigma.cumsum() / dsigma.sum()
         #
-        # draw a random number from the dsigma distribution to get scatter angle
+        # cdf value at cos(theta)_min for a restricted energy deposit
         #
-        if de_max < energy:
-            cost_min = self.calculate_cost_min(energy=energy, de_max=de_max)
-            rmin = np.interp(cost_min, cost_range, cdf)
+        rmin = np.zeros(energy.shape)
+        restricted = de_max < energy
+        if restricted.any():
+            e = energy[restricted]
+            with np.errstate(divide='ignore'):
+                cost_min = 1.0 - self.m_electron * (1. / (e - de_max[restricted]) - 1. / e)
+            rmin[restricted] = self.table_lookup(self.table_cdf, e, (cost_min + 1.0) / 2.0)
 
         weight = 1 - rmin
-        # # # print('weight ..... =',weight,' rmin = ',rmin,' cost_min =',cost_min)
-        theta = np.arccos(np.interp(np.random.uniform(rmin, 1.), cdf, cost_range))
+        r = rmin + rng.uniform(0, 1, energy.shape) * weight
+        cost = self.table_lookup(self.table_inverse, energy, r)
         #
         # random angle in phi between 0 and 2pi
         #
-        phi = 2 * np.pi * np.random.uniform(0, 1)
+        phi = 2 * np.pi * rng.uniform(0, 1, energy.shape)
+
+        if self.instrument is not None:
+            self.instrument.count('compton_samples', energy.size)
+            self.instrument.add_time('angle', t0)
+
+        return cost, phi, weight
+
+    def check_compton_table(self, energies=None):
+        """
+        Compare the tabulated Compton sampling with the exact cdf construction
 
-        return theta, phi, weight
+        :param energies: energies to test (keV). Default: midpoints between the energy nodes above 10 keV
+        :return: maximum deviation of the cdf, maximum deviation of rmin
+        """
+        if energies is None:
+            loge = self.table_loge[:-1] + self.table_dloge / 2
+            energies = np.exp(loge[loge > np.log(10.)])
+
+        dcdf = 0.0
+        drmin = 0.0
+        for energy in energies:
+            cdf = self.compton_cdf(energy)
+            e = np.full(len(self.table_prob), energy)
+            # cdf of the tabulated sampling evaluated at the exact quantiles
+            cost = self.table_lookup(self.table_inverse, e, self.table_prob)
+            dcdf = max(dcdf, np.max(np.abs(np.interp(cost, self.cost_range, cdf) - self.table_prob)))
+            # rmin over the full cos(theta) range
+            e = np.full(len(self.cost_range), energy)
+            r = self.table_lookup(self.table_cdf, e, (self.cost_range + 1.0) / 2.0)
+            drmin = max(drmin, np.max(np.abs(r - cdf)))
+
+        return dcdf, drmin
+
+    def do_compton(self, energy, de_max, rng=None):
+        """
+        Select the Compton scattering angle based on the Klein-Nishina differential cross section.
+        The angle is sampled from the precomputed tables (see build_compton_table)
 
+        :param energy: gamma energy
+        :param de_max: maximum energy deposit
+        :param rng: random generator, see sample_compton [Default = None -> np.random]
+        :return:
+        """
+        cost, phi, weight = self.sample_compton(np.array([energy]), de_max, rng=rng)
 
+        return np.arccos(cost[0]), phi[0], weight[0]
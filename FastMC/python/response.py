@@ -0,0 +1,268 @@
+import json
+import time
+
+import numpy as np
+
+from cylinder import cylinder
+from tally import tally
+from source import line_source
+import driver
+
+#
+# Detector response matrix.
+#
+# R[fiducial, nscatter, E_gamma, E_dep] is the deposited-energy spectrum per primary photon (events per
+# primary in every E_dep bin below edep_max) for a grid of primary energies, with the variance of every
+# element. It is filled once with the usual transport (by default the fiducial_scatter VRT, one run per
+# nscatter_max), after which the spectrum of any line list or activity mix is a matrix-vector product:
+# the lines are distributed over the two neighbouring grid energies with linear weights.
+#
+
+# fiducial volumes (radius, height) in cm, as in Sigma_study
+fiducial_sizes = {'Normal': (57., 134.), 'Neutrinoless': (40., 100.)}
+
+
+class response_matrix:
+    """
+    Response of the fiducial volume to primary photons on a grid of energies
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Initialize an empty response matrix
+
+        :param kwargs:
+            energies = grid of primary energies in keV [Default = 50 to 3000 keV in steps of 10 keV]
+            fiducials = dictionary name -> (radius, height) of the fiducial volumes [Default = fiducial_sizes]
+            nscatter = list of scatter multiplicities [Default = [1, 2]]
+            edep_max = maximum deposited energy (the ROI) in keV [Default = 250]
+            nbins = number of deposited-energy bins between 0 and edep_max [Default = 250]
+            vrt = None (one analog run per energy fills all nscatter) or 'fiducial_scatter' (one run per
+                  energy and nscatter, with nscatter_max = nscatter) [Default = 'fiducial_scatter']
+        """
+        self.energies = np.asarray(kwargs.pop('energies', np.arange(50., 3000.1, 10.)), dtype=float)
+        self.fiducials = dict(kwargs.pop('fiducials', fiducial_sizes))
+        self.nscatter = list(kwargs.pop('nscatter', [1, 2]))
+        self.edep_max = float(kwargs.pop('edep_max', 250.))
+        nbins = kwargs.pop('nbins', 250)
+        self.vrt = kwargs.pop('vrt', 'fiducial_scatter')
+
+        if np.any(np.diff(self.energies) <= 0):
+            print('response_matrix::__init__ ERROR the energy grid must be increasing')
+            raise ValueError('the energy grid must be increasing')
+        self.names = list(self.fiducials)
+        self.edges = np.linspace(0., self.edep_max, nbins + 1)
+
+        shape = (len(self.names), len(self.nscatter), len(self.energies))
+        # spectrum per primary and its variance
+        self.r = np.zeros(shape + (nbins,))
+        self.r_var = np.zeros(shape + (nbins,))
+        # integrated rate in the ROI per primary and its variance (from the running moments of the tally)
+        self.rate = np.zeros(shape)
+        self.rate_var = np.zeros(shape)
+        # number of primaries and wall time per element, 0 = not generated
+        self.nevent = np.zeros(shape, dtype=np.int64)
+        self.wall_time = np.zeros(shape)
+
+        return
+
+    def index(self, fiducial, nscatter):
+        """
+        :param fiducial: fiducial volume name
+        :param nscatter: scatter multiplicity
+        :return: indices of the fiducial volume and the scatter multiplicity
+        """
+        return self.names.index(fiducial), self.nscatter.index(nscatter)
+
+    def fill(self, ifid, ie, t, nscatter, dt):
+        """
+        Store the result of one run
+
+        :param ifid: index of the fiducial volume
+        :param ie: index of the primary energy
+        :param t: tally of the run
+        :param nscatter: scatter multiplicities of the tally that are stored
+        :param dt: wall time of the run (s)
+        :return:
+        """
+        for ns in nscatter:
+            ins = self.nscatter.index(ns)
+            edges, mean, err = t.spectrum(ns)
+            rate, rate_err = t.rate(ns)
+            self.r[ifid, ins, ie] = mean
+            self.r_var[ifid, ins, ie] = err ** 2
+            self.rate[ifid, ins, ie] = rate
+            self.rate_var[ifid, ins, ie] = rate_err ** 2 if np.isfinite(rate_err) else 0.0
+            self.nevent[ifid, ins, ie] = t.nevent
+            self.wall_time[ifid, ins, ie] = dt
+
+        return
+
+    def generate(self, nevents, **kwargs):
+        """
+        Fill the matrix. Elements that already have events are skipped, so an interrupted generation
+        continues where it stopped when the saved matrix is loaded again
+
+        :param nevents: number of primaries per energy (and per nscatter with the VRT)
+        :param kwargs:
+            physics, geometry = em_physics and cryostat cylinder (required)
+            engine, nworkers, chunk_size = see driver.generate_chunks [Default = 'numba', 1, None]
+            seed = master seed; every run gets the seed sequence (seed, fiducial, energy, nscatter) [Default = None]
+            output = file name to save the matrix to after every energy [Default = None]
+        :return:
+        """
+        output = kwargs.pop('output', None)
+        seed = kwargs.pop('seed', None)
+        settings = dict(physics=kwargs.pop('physics'), geometry=kwargs.pop('geometry'),
+                        engine=kwargs.pop('engine', 'numba'), nworkers=kwargs.pop('nworkers', 1),
+                        chunk_size=kwargs.pop('chunk_size', None))
+        entropy = np.random.SeedSequence(seed).entropy
+
+        # (nscatter_max, multiplicities filled by the run)
+        if self.vrt is None:
+            runs = [(max(self.nscatter), self.nscatter)]
+        else:
+            runs = [(ns, [ns]) for ns in self.nscatter]
+
+        for ifid, name in enumerate(self.names):
+            fid = cylinder(R=self.fiducials[name][0], h=self.fiducials[name][1])
+            for ie, energy in enumerate(self.energies):
+                for nscatter_max, nscatter in runs:
+                    if self.nevent[ifid, self.nscatter.index(nscatter[0]), ie] > 0:
+                        continue
+                    t = tally(fiducial=fid, nscatter=nscatter, edep_max=self.edep_max, emin=0.,
+                              emax=self.edep_max, nbins=len(self.edges) - 1)
+                    t0 = time.time()
+                    t = driver.generate_tally(nevents, tally=t, energy=energy, edep_max=self.edep_max, fiducial=fid,
+                                              vrt=self.vrt, nscatter_max=nscatter_max,
+                                              seed=[entropy, ifid, ie, nscatter_max], **settings)
+                    self.fill(ifid, ie, t, nscatter, time.time() - t0)
+                print('response_matrix::generate ', name, ' E = ', energy, ' keV done')
+                if output is not None:
+                    self.save(output)
+
+        return
+
+    def line_weights(self, lines, activity=1.0, drop_outside=False):
+        """
+        Weights of the grid energies for a line list: every line is split over the two neighbouring grid
+        energies with linear weights. Lines outside the grid raise a ValueError, unless drop_outside is set
+
+        :param lines: line list (DataFrame with energy, intensity and optionally nuclide and chain, see
+                      source.read_lines) or a source.line_source
+        :param activity: decays per unit time of every nuclide: a number, or a dictionary nuclide/chain -> activity
+                         (a chain entry applies to all nuclides of the chain) [Default = 1 -> result per decay]
+        :param drop_outside: leave out the lines outside the energy grid [Default = False]
+        :return: array of weights, one per grid energy
+        """
+        if isinstance(lines, line_source):
+            lines = lines.lines
+        energy = np.asarray(lines['energy'], dtype=float)
+        photons = np.asarray(lines['intensity'], dtype=float) / 100.
+
+        if isinstance(activity, dict):
+            a = np.zeros(len(lines))
+            for key in ('chain', 'nuclide'):
+                if key in lines:
+                    for name, value in activity.items():
+                        a[np.asarray(lines[key] == name)] = value
+            photons = photons * a
+        else:
+            photons = photons * activity
+
+        inside = (energy >= self.energies[0]) & (energy <= self.energies[-1])
+        if not inside.all():
+            if not drop_outside:
+                print('response_matrix::line_weights ERROR lines outside the energy grid: ', energy[~inside])
+                raise ValueError('lines outside the energy grid')
+            print('response_matrix::line_weights lines outside the energy grid are dropped: ', energy[~inside])
+        energy, photons = energy[inside], photons[inside]
+
+        i = np.clip(np.searchsorted(self.energies, energy, side='right') - 1, 0, len(self.energies) - 2)
+        f = (energy - self.energies[i]) / (self.energies[i + 1] - self.energies[i])
+        v = np.bincount(i, weights=photons * (1 - f), minlength=len(self.energies))
+        v += np.bincount(i + 1, weights=photons * f, minlength=len(self.energies))
+
+        return v
+
+    def fold(self, lines, **kwargs):
+        """
+        Deposited-energy spectrum of a line list or activity mix
+
+        :param lines: see line_weights
+        :param kwargs:
+            activity = see line_weights [Default = 1]
+            fiducial = fiducial volume name [Default = first]
+            nscatter = scatter multiplicity [Default = first]
+            drop_outside = see line_weights [Default = False]
+        :return: bin edges, spectrum (events per unit time, or per decay for activity 1), error
+        """
+        activity = kwargs.pop('activity', 1.0)
+        ifid, ins = self.index(kwargs.pop('fiducial', self.names[0]), kwargs.pop('nscatter', self.nscatter[0]))
+
+        v = self.line_weights(lines, activity, kwargs.pop('drop_outside', False))
+        self.check_filled(ifid, ins, v)
+
+        return self.edges, v @ self.r[ifid, ins], np.sqrt((v ** 2) @ self.r_var[ifid, ins])
+
+    def fold_rate(self, lines, **kwargs):
+        """
+        Rate in the ROI of a line list or activity mix
+
+        :param lines: see line_weights
+        :param kwargs: see fold
+        :return: rate (events per unit time, or per decay for activity 1), error
+        """
+        activity = kwargs.pop('activity', 1.0)
+        ifid, ins = self.index(kwargs.pop('fiducial', self.names[0]), kwargs.pop('nscatter', self.nscatter[0]))
+
+        v = self.line_weights(lines, activity, kwargs.pop('drop_outside', False))
+        self.check_filled(ifid, ins, v)
+
+        return v @ self.rate[ifid, ins], np.sqrt((v ** 2) @ self.rate_var[ifid, ins])
+
+    def check_filled(self, ifid, ins, v):
+        """
+        Raise a ValueError if a fold uses grid energies that were not generated
+        """
+        missing = (v != 0) & (self.nevent[ifid, ins] == 0)
+        if missing.any():
+            print('response_matrix::fold ERROR no events generated for E = ', self.energies[missing])
+            raise ValueError('fold over grid energies without events')
+
+        return
+
+    def save(self, fn):
+        """
+        Save the matrix to a .npz file
+
+        :param fn: file name
+        :return:
+        """
+        settings = {'fiducials': self.fiducials, 'nscatter': self.nscatter, 'edep_max': self.edep_max,
+                    'vrt': self.vrt}
+        np.savez_compressed(fn, settings=json.dumps(settings), energies=self.energies, edges=self.edges,
+                            r=self.r, r_var=self.r_var, rate=self.rate, rate_var=self.rate_var,
+                            nevent=self.nevent, wall_time=self.wall_time)
+
+        return
+
+
+def load_response(fn):
+    """
+    Load a response matrix saved with response_matrix.save
+
+    :param fn: file name
+    :return: response_matrix
+    """
+    d = np.load(fn)
+    settings = json.loads(str(d['settings']))
+
+    m = response_matrix(energies=d['energies'], fiducials={k: tuple(v) for k, v in settings['fiducials'].items()},
+                        nscatter=settings['nscatter'], edep_max=settings['edep_max'], nbins=len(d['edges']) - 1,
+                        vrt=settings['vrt'])
+    m.edges = d['edges']
+    for name in ['r', 'r_var', 'rate', 'rate_var', 'nevent', 'wall_time']:
+        setattr(m, name, d[name])
+
+    return m
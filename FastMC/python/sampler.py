@@ -0,0 +1,93 @@
+import warnings
+
+import numpy as np
+from scipy.stats import qmc
+
+#
+# Randomized quasi-Monte Carlo sampling of the first interaction.
+#
+# The first-scatter estimate is a smooth integral over a few dimensions: the starting point on the cryostat,
+# the direction, the depth of the first interaction and its process and Compton angle. With sampler =
+# 'sobol' these draws of event i are the coordinates of point i of a scrambled Sobol sequence, all later
+# draws come from the normal random generator. The dimensions of a point are assigned in the order of
+# sampler_dimensions.
+#
+# A single scrambled sequence is unbiased, but the spread of its events does not measure its error (the
+# events are not independent). The error follows from replicates: independent scramblings of the same
+# sequence, whose estimates are independent (see driver.generate_replicates and tally.replicate_rate).
+#
+
+# draws of a history that are taken from the Sobol point, in this order
+sampler_dimensions = ['surface', 'surface_phi', 'surface_u', 'direction_1', 'direction_2', 'interaction',
+                      'process', 'compton_r', 'compton_phi']
+
+
+def sobol_engine(seed=None, first_event=0):
+    """
+    :param seed: seed of the scrambling
+    :param first_event: index of the first point that is drawn (event number)
+    :return: scipy.stats.qmc.Sobol engine with one dimension per entry of sampler_dimensions
+    """
+    engine = qmc.Sobol(d=len(sampler_dimensions), scramble=True, seed=seed)
+    if first_event > 0:
+        engine.fast_forward(first_event)
+
+    return engine
+
+
+def sobol_points(engine, n):
+    """
+    Draw the next n points. The balance of the sequence is a property of the whole run, so the scipy warning
+    for blocks that are not a power of 2 is not shown
+
+    :param engine: Sobol engine, see sobol_engine
+    :param n: number of points
+    :return: array (n, len(sampler_dimensions))
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        return engine.random(n)
+
+
+class uniform_stream:
+    """
+    Random generator look-alike that hands out the coordinates of a block of QMC points. It can be passed as
+    rng to the functions that draw with rng.uniform(low, high, size): every call returns the next dimension of
+    the points of the selected rows
+    """
+
+    def __init__(self, u):
+        """
+        :param u: QMC points, array (n, d) or a single point (d)
+        """
+        self.u = np.atleast_2d(u)
+        self.rows = None
+        self.dimension = 0
+
+        return
+
+    def select(self, rows, dimension):
+        """
+        Select the points and the dimension of the next draw
+
+        :param rows: row indices of the points (None = the first point, draws return a float)
+        :param dimension: name (see sampler_dimensions) or index of the dimension
+        :return: self
+        """
+        self.rows = rows
+        self.dimension = sampler_dimensions.index(dimension) if isinstance(dimension, str) else dimension
+
+        return self
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        """
+        :return: uniform numbers between low and high from the current dimension of the selected points.
+                 size is ignored: the number of values is the number of selected rows
+        """
+        if self.rows is None:
+            x = float(self.u[0, self.dimension])
+        else:
+            x = self.u[self.rows, self.dimension]
+        self.dimension += 1
+
+        return low + (high - low) * x
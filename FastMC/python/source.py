@@ -0,0 +1,177 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+#
+# Multi-line gamma sources.
+#
+# The lines of a nuclide or decay chain are read from data/GAMMA-RAY ISOTOPES.csv and sampled with a
+# Walker alias table: one uniform integer and one uniform float per photon, independent of the number of
+# lines. The primary energy of every event is stored in the 'e0' column of the records, from which the
+# tally recovers the line of the event (see tally.tally(source=...)).
+#
+
+# default line list
+isotope_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'GAMMA-RAY ISOTOPES.csv')
+
+
+def read_lines(fn=isotope_file):
+    """
+    Read a gamma line list
+
+    :param fn: semicolon separated file with columns Nuclide, chain, E (keV) and I (photons per 100 decays)
+    :return: pandas DataFrame with columns nuclide, chain, energy, intensity
+    """
+    df = pd.read_csv(fn, sep=';')
+    lines = pd.DataFrame({'nuclide': df['Nuclide'].astype(str).str.strip(),
+                          'chain': df['chain'].fillna('').astype(str).str.strip(),
+                          'energy': df['E'].astype(float),
+                          'intensity': df['I'].astype(float)})
+    # 208Tl is spelled with a capital I in the table
+    lines['nuclide'] = lines['nuclide'].str.replace('TI', 'Tl')
+    # nuclides without a chain form their own chain
+    lines.loc[lines['chain'] == '', 'chain'] = lines['nuclide']
+    # lines without an intensity (60Co, 137Cs, 40K) are emitted in every decay
+    lines['intensity'] = lines['intensity'].fillna(100.)
+
+    return lines
+
+
+class alias_table:
+    """
+    Walker alias table of a discrete distribution
+    """
+
+    def __init__(self, weights):
+        """
+        Build the table with Vose's method in O(n)
+
+        :param weights: non-negative weights of the n outcomes
+        """
+        p = np.asarray(weights, dtype=float)
+        if (len(p) == 0) or (p.min() < 0) or (p.sum() <= 0):
+            print('alias_table::__init__ ERROR invalid weights ', weights)
+            raise ValueError('invalid weights')
+
+        n = len(p)
+        self.p = p / p.sum()
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+
+        scaled = self.p * n
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # the remaining columns are full up to rounding
+        for i in small + large:
+            self.prob[i] = 1.0
+
+        return
+
+    def sample(self, n, rng=None):
+        """
+        Draw n outcomes
+
+        :param n: number of samples
+        :param rng: numpy.random.Generator [Default = None -> fresh generator]
+        :return: array of outcome indices
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        i = rng.integers(len(self.prob), size=n)
+        u = rng.random(n)
+
+        return np.where(u < self.prob[i], i, self.alias[i])
+
+
+class line_source:
+    """
+    Gamma source with the lines of one or more nuclides or decay chains
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Select the lines of a source
+
+        :param kwargs:
+            nuclide = nuclide name or list of names, e.g. '214Bi' [Default = None]
+            chain = decay chain or list of chains, e.g. '238U' [Default = None]
+            lines = line list, see read_lines [Default = None -> read fn]
+            fn = line list file [Default = data/GAMMA-RAY ISOTOPES.csv]
+            emin = lowest line energy in keV [Default = 0]
+        Lines of the given nuclides and chains are combined. Without nuclide and chain all lines are used.
+        """
+        nuclide = kwargs.pop('nuclide', None)
+        chain = kwargs.pop('chain', None)
+        lines = kwargs.pop('lines', None)
+        fn = kwargs.pop('fn', isotope_file)
+        emin = kwargs.pop('emin', 0.0)
+
+        if lines is None:
+            lines = read_lines(fn)
+        if isinstance(nuclide, str):
+            nuclide = [nuclide]
+        if isinstance(chain, str):
+            chain = [chain]
+
+        sel = np.ones(len(lines), dtype=bool)
+        if (nuclide is not None) or (chain is not None):
+            sel = lines['nuclide'].isin(nuclide or []) | lines['chain'].isin(chain or [])
+        sel &= lines['energy'] >= emin
+        if not sel.any():
+            print('line_source::__init__ ERROR no lines for nuclide =', nuclide, ' chain =', chain)
+            raise ValueError('no lines selected')
+
+        self.lines = lines[sel].sort_values('energy').reset_index(drop=True)
+        self.energy = self.lines['energy'].values
+        self.table = alias_table(self.lines['intensity'].values)
+        # photons per decay summed over the selected lines
+        self.yield_per_decay = self.lines['intensity'].sum() / 100.
+
+        return
+
+    @property
+    def emax(self):
+        return float(self.energy.max())
+
+    def sample(self, n, rng=None):
+        """
+        Sample the lines of n photons
+
+        :param n: number of photons
+        :param rng: numpy.random.Generator
+        :return: line indices, energies (keV)
+        """
+        i = self.table.sample(n, rng=rng)
+
+        return i, self.energy[i]
+
+    def line_index(self, e0):
+        """
+        :param e0: primary energies (keV)
+        :return: line indices
+        """
+        return line_index(self.energy, e0)
+
+
+def line_index(energy, e0):
+    """
+    Line of photons with primary energy e0: the nearest line, so that energies stored as float32 match
+
+    :param energy: line energies, sorted
+    :param e0: primary energies (keV)
+    :return: line indices
+    """
+    mid = 0.5 * (energy[1:] + energy[:-1])
+
+    return np.searchsorted(mid, e0)
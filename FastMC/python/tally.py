@@ -0,0 +1,542 @@
+import copy
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from source import line_index
+
+
+class tally:
+    """
+    In-run tallies of the generated events: weighted deposited-energy spectra with the sum of
+    weights and the sum of squared weights per bin, total weight counters and cut-flow counters.
+    The tally is filled with the per-event records of photon_bank/kernel, batch by batch
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Initialize a tally
+
+        :param kwargs:
+            fiducial = instant of the cylinder class used for the fiducial cut [Default = None -> no cut]
+            nscatter = list of scatter multiplicities to tally [Default = [1]]
+            edep_max = cut on the total deposited energy in keV [Default = None -> no cut]
+            emin, emax = range of the energy histograms in keV [Default = 0, 3000]
+            nbins = number of bins of the energy histograms [Default = 300]
+            source = line source (see source.line_source). The records then carry the primary energy and the
+                     rates are also tallied per line [Default = None]
+        """
+        fiducial = kwargs.pop('fiducial', None)
+        source = kwargs.pop('source', None)
+        self.r_fiducial = None if fiducial is None else fiducial.radius
+        self.z_fiducial = None if fiducial is None else fiducial.height
+        self.nscatter = list(kwargs.pop('nscatter', [1]))
+        self.edep_max = kwargs.pop('edep_max', None)
+        emin = kwargs.pop('emin', 0.0)
+        emax = kwargs.pop('emax', 3000.0)
+        nbins = kwargs.pop('nbins', 300)
+
+        self.edges = np.linspace(emin, emax, nbins + 1)
+
+        nsel = len(self.nscatter)
+        # all events
+        self.nevent = 0
+        self.sum_w = 0.0
+        self.sum_w2 = 0.0
+        # cut flow per nscatter selection: [nscatter, + fiducial, + energy]
+        self.n_pass = np.zeros((nsel, 3), dtype=np.int64)
+        # events passing all cuts
+        self.sum_w_pass = np.zeros(nsel)
+        self.sum_w2_pass = np.zeros(nsel)
+        # energy spectra of the events passing all cuts
+        self.hist_w = np.zeros((nsel, nbins))
+        self.hist_w2 = np.zeros((nsel, nbins))
+        # running mean and sum of squared deviations of the per-event weight w*pass (Welford/Chan updates)
+        self.mean_pass = np.zeros(nsel)
+        self.m2_pass = np.zeros(nsel)
+        # per line of a line source: number of primaries, sum of weights and squared weights passing all cuts
+        self.lines = None
+        if source is not None:
+            self.set_lines(source.lines)
+
+        return
+
+    def set_lines(self, lines):
+        """
+        Enable the per-line counters
+
+        :param lines: line list of the source (DataFrame with nuclide, chain, energy, intensity), sorted by energy
+        :return:
+        """
+        self.lines = lines.reset_index(drop=True)
+        nline = len(self.lines)
+        self.n_line = np.zeros(nline, dtype=np.int64)
+        self.sum_w_line = np.zeros((len(self.nscatter), nline))
+        self.sum_w2_line = np.zeros((len(self.nscatter), nline))
+
+        return
+
+    def update_moments(self, i, n, x):
+        """
+        Add a batch of per-event values to the running mean and M2 of selection i. The batch moments are
+        merged with the pairwise update of Chan et al., which is stable for any batch size
+
+        :param i: selection index
+        :param n: number of events before the batch
+        :param x: per-event values of the batch
+        :return:
+        """
+        if len(x) == 0:
+            return
+        mean_b = x.mean()
+        self.merge_moments(i, n, len(x), mean_b, ((x - mean_b) ** 2).sum())
+
+        return
+
+    def merge_moments(self, i, n, m, mean_b, m2_b):
+        """
+        Merge the moments (m, mean_b, m2_b) of m events into the running moments of selection i that hold n events
+
+        :return:
+        """
+        delta = mean_b - self.mean_pass[i]
+        self.mean_pass[i] += delta * m / (n + m)
+        self.m2_pass[i] += m2_b + delta ** 2 * n * m / (n + m)
+
+        return
+
+    def fill(self, records):
+        """
+        Add a batch of events. Records of photons split by a weight window have the event number of their
+        primary and follow it: the weights are summed per primary for the moments and the squared-weight
+        sums, the cut-flow counters count records
+
+        :param records: array of per-event records, see eventio.event_columns()
+        :return:
+        """
+        # check the layout before the tally is changed
+        if (self.lines is not None) and ((records.shape[1] - 7) % 4 != 1):
+            print('tally::fill ERROR the records have no primary energy column')
+            raise ValueError('tally with a line source needs records with the e0 column')
+
+        w = records[:, 2]
+        de = records[:, 3]
+
+        ev = records[:, 0]
+        shared = (len(ev) > 1) and bool(np.any(ev[1:] == ev[:-1]))
+        if shared:
+            first = np.concatenate(([True], ev[1:] != ev[:-1]))
+            primary = np.cumsum(first) - 1
+            nprimary = int(primary[-1]) + 1
+
+        def per_event(x):
+            return np.bincount(primary, weights=x, minlength=nprimary) if shared else x
+
+        n = self.nevent
+        self.nevent += nprimary if shared else len(records)
+        self.sum_w += w.sum()
+        self.sum_w2 += (per_event(w) ** 2).sum()
+
+        if self.lines is not None:
+            line = line_index(self.lines['energy'].values, records[:, -1])
+            line_event = line[first] if shared else line
+            nline = len(self.lines)
+            self.n_line += np.bincount(line_event, minlength=nline)
+
+        nbins = len(self.edges) - 1
+        for i, ns in enumerate(self.nscatter):
+            cut = records[:, 1] == ns
+            self.n_pass[i, 0] += np.count_nonzero(cut)
+            #
+            # all stored interactions of the event inside the fiducial volume
+            #
+            if self.r_fiducial is not None:
+                for k in range(min(ns, (records.shape[1] - 7) // 4)):
+                    x, y, z = records[:, 7 + 4 * k], records[:, 8 + 4 * k], records[:, 9 + 4 * k]
+                    cut &= (x ** 2 + y ** 2 < self.r_fiducial ** 2) & (np.abs(z) < self.z_fiducial / 2)
+            self.n_pass[i, 1] += np.count_nonzero(cut)
+
+            if self.edep_max is not None:
+                cut &= de < self.edep_max
+            self.n_pass[i, 2] += np.count_nonzero(cut)
+
+            x = per_event(np.where(cut, w, 0.0))
+            self.sum_w_pass[i] += w[cut].sum()
+            self.sum_w2_pass[i] += (x ** 2).sum()
+            self.update_moments(i, n, x)
+            self.hist_w[i] += np.histogram(de[cut], bins=self.edges, weights=w[cut])[0]
+            if shared:
+                #
+                # squared weight per primary and bin
+                #
+                b = np.minimum(np.searchsorted(self.edges, de[cut], side='right') - 1, nbins - 1)
+                inside = (de[cut] >= self.edges[0]) & (de[cut] <= self.edges[-1])
+                key, inv = np.unique(primary[cut][inside] * nbins + b[inside], return_inverse=True)
+                s = np.bincount(inv, weights=w[cut][inside])
+                self.hist_w2[i] += np.bincount(key % nbins, weights=s ** 2, minlength=nbins)
+            else:
+                self.hist_w2[i] += np.histogram(de[cut], bins=self.edges, weights=w[cut] ** 2)[0]
+            if self.lines is not None:
+                self.sum_w_line[i] += np.bincount(line[cut], weights=w[cut], minlength=nline)
+                self.sum_w2_line[i] += np.bincount(line_event, weights=x ** 2, minlength=nline)
+
+        return
+
+    def empty_copy(self):
+        """
+        A tally with the same settings and no events
+
+        :return: tally
+        """
+        t = copy.deepcopy(self)
+        t.reset()
+
+        return t
+
+    def reset(self):
+        """
+        Clear all counters
+        :return:
+        """
+        self.nevent = 0
+        self.sum_w = 0.0
+        self.sum_w2 = 0.0
+        for a in (self.n_pass, self.sum_w_pass, self.sum_w2_pass, self.hist_w, self.hist_w2, self.mean_pass,
+                  self.m2_pass):
+            a[...] = 0
+        if self.lines is not None:
+            for a in (self.n_line, self.sum_w_line, self.sum_w2_line):
+                a[...] = 0
+
+        return
+
+    def merge(self, other):
+        """
+        Add the counters of another tally with the same settings
+
+        :param other: tally
+        :return:
+        """
+        if (len(other.edges) != len(self.edges)) or (other.nscatter != self.nscatter):
+            print('tally::merge ERROR incompatible tallies')
+            return
+
+        if other.nevent > 0:
+            for i in range(len(self.nscatter)):
+                self.merge_moments(i, self.nevent, other.nevent, other.mean_pass[i], other.m2_pass[i])
+
+        self.nevent += other.nevent
+        self.sum_w += other.sum_w
+        self.sum_w2 += other.sum_w2
+        self.n_pass += other.n_pass
+        self.sum_w_pass += other.sum_w_pass
+        self.sum_w2_pass += other.sum_w2_pass
+        self.hist_w += other.hist_w
+        self.hist_w2 += other.hist_w2
+        if self.lines is not None:
+            self.n_line += other.n_line
+            self.sum_w_line += other.sum_w_line
+            self.sum_w2_line += other.sum_w2_line
+
+        return
+
+    def rate(self, nscatter=1):
+        """
+        Weighted fraction of primaries that pass all cuts, with its statistical error
+
+        :param nscatter: scatter multiplicity
+        :return: rate, error
+        """
+        i = self.nscatter.index(nscatter)
+        n = self.nevent
+        if n < 2:
+            return self.mean_pass[i], np.inf
+
+        return self.mean_pass[i], np.sqrt(self.m2_pass[i] / (n - 1) / n)
+
+    def relative_error(self, nscatter=1):
+        """
+        Relative statistical error of the rate
+
+        :param nscatter: scatter multiplicity
+        :return: error / rate (inf if the rate is zero)
+        """
+        mean, err = self.rate(nscatter)
+
+        return err / mean if mean > 0 else np.inf
+
+    def fom(self, nscatter, wall_time):
+        """
+        Figure of merit 1/(R^2 T) of the rate, with R the relative error and T the wall time
+
+        :param nscatter: scatter multiplicity
+        :param wall_time: time spent to generate the events (s)
+        :return: figure of merit (1/s)
+        """
+        rel = self.relative_error(nscatter)
+
+        return 1.0 / (rel ** 2 * wall_time) if (0 < rel < np.inf) and (wall_time > 0) else 0.0
+
+    def spectrum(self, nscatter=1):
+        """
+        Deposited-energy spectrum per primary photon with the statistical error per bin
+
+        :param nscatter: scatter multiplicity
+        :return: bin edges, content, error
+        """
+        i = self.nscatter.index(nscatter)
+        n = max(self.nevent, 1)
+        mean = self.hist_w[i] / n
+        err = np.sqrt(np.maximum(self.hist_w2[i] / n - mean ** 2, 0.0) / n)
+
+        return self.edges, mean, err
+
+    def efficiency(self, nscatter=1):
+        """
+        Cut efficiencies (unweighted): fraction of events passing nscatter, +fiducial and +energy cuts
+
+        :param nscatter: scatter multiplicity
+        :return: array of 3 fractions
+        """
+        i = self.nscatter.index(nscatter)
+
+        return self.n_pass[i] / max(self.nevent, 1)
+
+    def line_rates(self, nscatter=1):
+        """
+        Contribution of every source line to the rate
+
+        :param nscatter: scatter multiplicity
+        :return: DataFrame with per line: nuclide, chain, energy, intensity, nprimary, rate and error
+                 (per primary photon of the source, the rates of all lines add up to rate()), efficiency
+                 and efficiency_error (per primary photon of the line)
+        """
+        if self.lines is None:
+            print('tally::line_rates ERROR the tally has no line source')
+            return None
+
+        i = self.nscatter.index(nscatter)
+        df = self.lines.copy()
+        df['nprimary'] = self.n_line
+        df['rate'], df['error'] = self.mean_error(self.sum_w_line[i], self.sum_w2_line[i], self.nevent)
+        df['efficiency'], df['efficiency_error'] = self.mean_error(self.sum_w_line[i], self.sum_w2_line[i],
+                                                                   self.n_line)
+
+        return df
+
+    def chain_rates(self, nscatter=1):
+        """
+        Contribution of every decay chain (or nuclide without chain) to the rate
+
+        :param nscatter: scatter multiplicity
+        :return: DataFrame with per chain: nline, nprimary, rate, error, efficiency, efficiency_error (see line_rates)
+                 and rate_per_decay (rate per decay of the chain, for the selected lines)
+        """
+        if self.lines is None:
+            print('tally::chain_rates ERROR the tally has no line source')
+            return None
+
+        i = self.nscatter.index(nscatter)
+        df = pd.DataFrame({'chain': self.lines['chain'], 'intensity': self.lines['intensity'],
+                           'nprimary': self.n_line, 'sum_w': self.sum_w_line[i], 'sum_w2': self.sum_w2_line[i]})
+        g = df.groupby('chain', sort=False)
+        chains = g.sum()
+        chains.insert(0, 'nline', g.size())
+        chains['rate'], chains['error'] = self.mean_error(chains['sum_w'].values, chains['sum_w2'].values,
+                                                          self.nevent)
+        chains['efficiency'], chains['efficiency_error'] = self.mean_error(chains['sum_w'].values,
+                                                                           chains['sum_w2'].values,
+                                                                           chains['nprimary'].values)
+        # photons per decay of the chain (intensities are per 100 decays) times efficiency per photon
+        chains['rate_per_decay'] = chains['efficiency'] * chains['intensity'] / 100.
+
+        return chains.drop(columns=['sum_w', 'sum_w2', 'intensity']).reset_index()
+
+    @staticmethod
+    def mean_error(sum_w, sum_w2, n):
+        """
+        Mean per event and its statistical error from the sums of weights and squared weights
+
+        :param sum_w: sum of weights
+        :param sum_w2: sum of squared weights
+        :param n: number of events
+        :return: mean, error
+        """
+        n = np.maximum(np.asarray(n, dtype=float), 1)
+        mean = sum_w / n
+        err = np.sqrt(np.maximum(sum_w2 / n - mean ** 2, 0.0) / n)
+
+        return mean, err
+
+    def line_arrays(self):
+        """
+        :return: dictionary with the line list and the per-line counters, for save (empty without line source)
+        """
+        if self.lines is None:
+            return {}
+
+        arrays = {'line_' + c: self.lines[c].values.astype(str) for c in ['nuclide', 'chain']}
+        arrays.update({'line_energy': self.lines['energy'].values, 'line_intensity': self.lines['intensity'].values,
+                       'n_line': self.n_line, 'sum_w_line': self.sum_w_line, 'sum_w2_line': self.sum_w2_line})
+
+        return arrays
+
+    def save(self, fn):
+        """
+        Save the tally to a .npz file
+
+        :param fn: file name
+        :return:
+        """
+        settings = {'r_fiducial': self.r_fiducial, 'z_fiducial': self.z_fiducial,
+                    'nscatter': self.nscatter, 'edep_max': self.edep_max}
+        np.savez_compressed(fn, settings=json.dumps(settings), edges=self.edges,
+                            nevent=self.nevent, sum_w=self.sum_w, sum_w2=self.sum_w2,
+                            n_pass=self.n_pass, sum_w_pass=self.sum_w_pass, sum_w2_pass=self.sum_w2_pass,
+                            hist_w=self.hist_w, hist_w2=self.hist_w2, mean_pass=self.mean_pass, m2_pass=self.m2_pass,
+                            **self.line_arrays())
+
+        return
+
+
+def load_tally(fn):
+    """
+    Load a tally saved with tally.save
+
+    :param fn: file name
+    :return: tally
+    """
+    d = np.load(fn)
+    settings = json.loads(str(d['settings']))
+
+    t = tally(nscatter=settings['nscatter'], edep_max=settings['edep_max'])
+    t.r_fiducial = settings['r_fiducial']
+    t.z_fiducial = settings['z_fiducial']
+    t.edges = d['edges']
+    t.nevent = int(d['nevent'])
+    t.sum_w = float(d['sum_w'])
+    t.sum_w2 = float(d['sum_w2'])
+    t.n_pass = d['n_pass']
+    t.sum_w_pass = d['sum_w_pass']
+    t.sum_w2_pass = d['sum_w2_pass']
+    t.hist_w = d['hist_w']
+    t.hist_w2 = d['hist_w2']
+    if 'mean_pass' in d:
+        t.mean_pass = d['mean_pass']
+        t.m2_pass = d['m2_pass']
+    else:
+        # files written before the running moments were stored
+        t.mean_pass = t.sum_w_pass / max(t.nevent, 1)
+        t.m2_pass = np.maximum(t.sum_w2_pass - t.nevent * t.mean_pass ** 2, 0.0)
+    if 'n_line' in d:
+        t.set_lines(pd.DataFrame({c: d['line_' + c] for c in ['nuclide', 'chain', 'energy', 'intensity']}))
+        t.n_line = d['n_line']
+        t.sum_w_line = d['sum_w_line']
+        t.sum_w2_line = d['sum_w2_line']
+
+    return t
+
+
+def replicate_rate(tallies, nscatter=1):
+    """
+    Rate and error from independent replicates of a run, e.g. the randomized QMC replicates of
+    driver.generate_replicates. The error is the spread of the replicate rates, which is also valid when
+    the events inside a replicate are correlated
+
+    :param tallies: list of tallies, one per replicate
+    :param nscatter: scatter multiplicity
+    :return: mean rate, error of the mean
+    """
+    rates = np.array([t.rate(nscatter)[0] for t in tallies])
+    if len(rates) < 2:
+        print('tally::replicate_rate ERROR need at least 2 replicates for an error')
+        return rates.mean(), np.inf
+
+    return rates.mean(), rates.std(ddof=1) / np.sqrt(len(rates))
+
+
+class convergence:
+    """
+    Follow the relative error and figure of merit of a tally during a run, and decide when a target
+    relative error is reached
+    """
+
+    def __init__(self, t, **kwargs):
+        """
+        Initialize a convergence monitor
+
+        :param t: instant of the tally class that is filled during the run
+        :param kwargs:
+            nscatter = scatter multiplicity of the monitored rate [Default = 1]
+            target = target relative error of the rate [Default = None -> never stop]
+            min_pass = minimum number of events passing the cuts before the run can stop [Default = 100]
+            interval = seconds between progress reports [Default = 10, None -> no reports]
+        """
+        self.tally = t
+        self.nscatter = kwargs.pop('nscatter', 1)
+        self.target = kwargs.pop('target', None)
+        self.min_pass = kwargs.pop('min_pass', 100)
+        self.interval = kwargs.pop('interval', 10.0)
+
+        self.t0 = time.time()
+        self.last_report = self.t0
+        # (nevent, wall time, relative error, fom) at every report
+        self.history = []
+
+        return
+
+    def status(self):
+        """
+        :return: dictionary with nevent, wall_time, rate, error, rel_error and fom of the monitored rate
+        """
+        dt = time.time() - self.t0
+        mean, err = self.tally.rate(self.nscatter)
+
+        return {'nevent': self.tally.nevent, 'wall_time': dt, 'rate': mean, 'error': err,
+                'rel_error': self.tally.relative_error(self.nscatter), 'fom': self.tally.fom(self.nscatter, dt)}
+
+    def update(self):
+        """
+        Call after the tally was filled with a new batch: report periodically and check the target
+
+        :return: True if the target relative error is reached
+        """
+        s = self.status()
+        if (self.interval is not None) and (time.time() - self.last_report >= self.interval):
+            self.report(s)
+
+        if self.target is None:
+            return False
+        npass = self.tally.n_pass[self.tally.nscatter.index(self.nscatter), 2]
+
+        return (npass >= self.min_pass) and (s['rel_error'] <= self.target)
+
+    def report(self, s=None):
+        """
+        Print the status of the run
+
+        :param s: status (see status) [Default = None -> current status]
+        :return:
+        """
+        if s is None:
+            s = self.status()
+        self.last_report = time.time()
+        self.history.append((s['nevent'], s['wall_time'], s['rel_error'], s['fom']))
+        print('convergence:: nevent = ', s['nevent'], ' rate = %.6g +- %.3g' % (s['rate'], s['error']),
+              ' rel. error = %.4g' % s['rel_error'], ' FOM = %.4g /s' % s['fom'], ' t = %.1f s' % s['wall_time'])
+
+        return
+
+    def finish(self):
+        """
+        Final report of the run (skipped if the last report already covers all events)
+
+        :return: status, see status
+        """
+        s = self.status()
+        if (len(self.history) == 0) or (self.history[-1][0] != s['nevent']):
+            self.report(s)
+
+        return s
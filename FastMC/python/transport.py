@@ -0,0 +1,527 @@
+import time
+
+import numpy as np
+
+from physics import rotate_direction
+from biasing import get_cone
+from sampler import sobol_engine, sobol_points, uniform_stream
+from counter_rng import philox_stream
+from eventio import event_columns
+
+# variance reduction techniques of the engines (photon_bank, particle, kernel)
+vrt_modes = [None, 'fiducial_scatter']
+
+
+def check_vrt(vrt):
+    """
+    Raise a ValueError for an unknown variance reduction technique, before any event is generated with it
+
+    :param vrt: variance reduction technique, see vrt_modes
+    :return:
+    """
+    if vrt not in vrt_modes:
+        print('transport::check_vrt ERROR unknown vrt =', vrt, ', use one of', vrt_modes)
+        raise ValueError('unknown vrt %s' % vrt)
+
+    return
+
+
+class photon_bank:
+    """
+    Batched photon transport. A bank of photons is stored as a structure of arrays and all
+    live photons are advanced one interaction step at a time. The physics follows particle.propagate
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Initialize a bank of photons
+
+        :param kwargs:
+            energy = energy of the photons in keV
+            source = line source (see source.line_source). Replaces energy: the primary energies are sampled
+                     from the lines and stored in an extra record column 'e0' [Default = None]
+            physics = physics class
+            geometry = geometry description. Instant of cylinder class
+            fiducial  = fiducial volume. Instant of cylinder class
+            vrt = variance reduction technique. Values: [None, "fiducial_scatter"]
+            nscatter_max = maximum number of scatters (only when vrt<>None)
+            edep_max = maximum energy deposit in the xenon (keV)
+            source_mode = direction of the primaries: 'isotropic' or 'cosine' (see cylinder.generate_directions),
+                          or 'fiducial' = isotropic biased into a cone around the fiducial volume, with the
+                          weight correction (see biasing.py, only with vrt = 'fiducial_scatter')
+                          [Default = 'isotropic']
+            writeout = number of interactions stored per event [Default = 4]
+            nbatch = number of photons transported simultaneously [Default = 100000]
+            seed = random seed used to initialize the random generator
+            rng = numpy.random.Generator. Overrides seed
+            debug = show debug printout information [Default = False]
+            instrument = instrumentation instance (see instrument.py) that counts the transport decisions
+                         and times the source, geometry, physics and output stages [Default = None -> off]
+            weight_window = weight window (see weight_window.py) applied before every interaction in the
+                            fiducial volume with vrt = 'fiducial_scatter'. Split photons are added to the
+                            bank and give one record each, with the event number of their primary
+                            [Default = None -> off]
+            sampler = 'random' or 'sobol': take the draws of the first interaction of event i (start point,
+                      direction, depth, process and Compton angle) from point i of a scrambled Sobol sequence,
+                      see sampler.py [Default = 'random']
+            sampler_seed = seed of the Sobol scrambling. Runs that are split in pieces need the same seed in
+                           every piece [Default = None -> from the random generator]
+            counter_seed = draw all random numbers from the counter-based generator of counter_rng.py, keyed by
+                           this run seed and the event number, instead of seed/rng. Every event is then
+                           independent of the way the run is split, and can be replayed on its own
+                           [Default = None -> off]
+        """
+        self.energy = kwargs.pop('energy', 0.0)
+        self.source = kwargs.pop('source', None)
+        self.phys = kwargs.pop('physics', None)
+        self.cryostat = kwargs.pop('geometry', None)
+        self.fiducial = kwargs.pop('fiducial', None)
+        self.vrt = kwargs.pop('vrt', None)
+        self.nscatter_max = kwargs.pop('nscatter_max', 1)
+        self.edep_max = kwargs.pop('edep_max', 100000.)
+        self.source_mode = kwargs.pop('source_mode', 'isotropic')
+        self.writeout = kwargs.pop('writeout', 4)
+        self.nbatch = kwargs.pop('nbatch', 100000)
+        self.debug = kwargs.pop('debug', False)
+        self.instrument = kwargs.pop('instrument', None)
+        self.weight_window = kwargs.pop('weight_window', None)
+        self.sampler = kwargs.pop('sampler', 'random')
+        self.sampler_seed = kwargs.pop('sampler_seed', None)
+
+        seed = kwargs.pop('seed', None)
+        self.rng = kwargs.pop('rng', None)
+        if self.rng is None:
+            self.rng = np.random.default_rng(seed)
+        if self.sampler not in ('random', 'sobol'):
+            print('photon_bank::__init__ ERROR unknown sampler =', self.sampler)
+            raise ValueError('unknown sampler %s, use random or sobol' % self.sampler)
+        if (self.sampler == 'sobol') and (self.sampler_seed is None):
+            self.sampler_seed = int(self.rng.integers(2 ** 63))
+        self.sobol = None
+        self.stream = None
+        counter_seed = kwargs.pop('counter_seed', None)
+        self.counter = None if counter_seed is None else philox_stream(counter_seed)
+        self.first_event = 0
+
+        check_vrt(self.vrt)
+        if (self.weight_window is not None) and (self.vrt != 'fiducial_scatter'):
+            print('photon_bank::__init__ ERROR weight windows need vrt = fiducial_scatter')
+            raise ValueError('weight windows need vrt fiducial_scatter')
+        self.cone = None
+        if self.source_mode == 'fiducial':
+            if self.vrt != 'fiducial_scatter':
+                print('photon_bank::__init__ ERROR source_mode = fiducial needs vrt = fiducial_scatter')
+                raise ValueError('source_mode fiducial needs vrt fiducial_scatter')
+            self.cone = get_cone(self.cryostat, self.fiducial)
+
+        return
+
+    def run(self, nevent, first_event=0):
+        """
+        Generate and propagate nevent photons in batches of nbatch
+
+        :param nevent: number of events
+        :param first_event: event number of the first event
+        :return: array with one record per event (per photon with a weight window), see event_columns()
+        """
+        records = []
+        ins = self.instrument
+        if self.sampler == 'sobol':
+            self.sobol = sobol_engine(self.sampler_seed, first_event)
+
+        for start in range(0, nevent, self.nbatch):
+            n = min(self.nbatch, nevent - start)
+            if self.debug == True:
+                print('photon_bank::run generated ', start, ' events')
+            t0 = time.perf_counter() if ins is not None else 0.0
+            self.first_event = first_event + start
+            self.generate(n)
+            if ins is not None:
+                ins.add_time('source', t0)
+                ins.count('histories', n)
+
+            self.propagate()
+
+            t0 = time.perf_counter() if ins is not None else 0.0
+            records.append(self.get_records(first_event + start))
+            if ins is not None:
+                ins.add_time('output', t0)
+                ins.count('weight_killed', np.count_nonzero(self.weight == 0))
+
+        if len(records) == 0:
+            return np.full((0, len(event_columns(self.writeout, self.source is not None))), np.nan)
+
+        return np.concatenate(records)
+
+    def generate(self, n):
+        """
+        Generate the starting points and directions of n photons on the cryostat surface
+
+        :param n: number of photons
+        :return:
+        """
+        self.n = n
+
+        #
+        # starting point uniform over the cryostat surface with a direction
+        #
+        self.stream = None
+        if self.sobol is not None:
+            self.stream = uniform_stream(sobol_points(self.sobol, n))
+        primaries = np.arange(n)
+        self.event = np.arange(n)
+        # counter-based generator: draws per photon, track number per photon and number of tracks per event
+        self.ndraw = np.zeros(n, dtype=np.int64)
+        self.track = np.zeros(n, dtype=np.int64)
+        self.ntrack = np.ones(n, dtype=np.int64)
+        points = self.cryostat.generate_points(n, rng=self.draw_rng(primaries, 'surface'))
+        self.x0 = points['x']
+        self.x0start = self.x0.copy()
+        if self.cone is None:
+            self.direction = self.cryostat.generate_directions(points, mode=self.source_mode,
+                                                               rng=self.draw_rng(primaries, 'direction_1'))
+            self.weight = np.ones(n)
+        else:
+            self.direction, self.weight = self.cone.generate_directions(points,
+                                                                        rng=self.draw_rng(primaries, 'direction_1'))
+
+        if self.source is None:
+            self.e = np.full(n, float(self.energy))
+        else:
+            self.e = self.source.sample(n, rng=self.draw_rng(primaries))[1]
+        self.e0 = self.e.copy()
+        self.nprimary = n
+        self.ww_level = np.full(n, -1)
+        self.nscatter = np.zeros(n, dtype=np.int64)
+        self.edep = np.zeros(n)
+        self.edep_left = np.full(n, float(self.edep_max))
+        self.alive = np.ones(n, dtype=bool)
+        self.xint = np.full((n, self.writeout, 4), np.nan)
+
+        return
+
+    def propagate(self):
+        """
+        Propagate all photons in the bank until they are absorbed, escape or are terminated by the VRT
+        :return:
+        """
+        nstep = 0
+        while self.alive.any():
+            self.step(np.flatnonzero(self.alive))
+            # only the first interaction is sampled from the QMC points
+            self.stream = None
+            nstep += 1
+            if (self.debug == True) and (self.n <= 16):
+                self.print_photons(nstep)
+
+        return
+
+    def print_photons(self, nstep):
+        """
+        Debug printout of all photons in the bank
+
+        :param nstep: number of steps done
+        :return:
+        """
+        for i in range(self.n):
+            print('photon_bank::propagate step', nstep, 'event', self.first_event + self.event[i], 'track',
+                  self.track[i], 'nscatter', self.nscatter[i], 'alive', self.alive[i], 'e', self.e[i], 'w',
+                  self.weight[i], 'edep', self.edep[i], 'x', self.x0[i], 'ndraw', self.ndraw[i])
+
+        return
+
+    def draw_rng(self, bank, dimension=None):
+        """
+        Random generator of a draw: the QMC points of the photons bank before their first interaction (with
+        sampler = 'sobol'), otherwise the counter-based generator of the photons (with counter_seed) or the
+        random generator of the bank
+
+        :param bank: bank indices of the photons
+        :param dimension: name of the draw, see sampler.sampler_dimensions [Default = None -> never QMC]
+        :return: generator with a uniform(low, high, size) method
+        """
+        if (self.stream is not None) and (dimension is not None):
+            return self.stream.select(bank, dimension)
+        if self.counter is not None:
+            return self.counter.select(self.first_event + self.event, self.track, self.ndraw, bank)
+
+        return self.rng
+
+    def step(self, idx):
+        """
+        Advance the live photons idx by one interaction
+
+        :param idx: indices of the photons to propagate
+        :return:
+        """
+        x0 = self.x0[idx]
+        t = self.direction[idx]
+        e = self.e[idx]
+        w = self.weight[idx]
+        nscat = self.nscatter[idx]
+        ww_level = self.ww_level[idx]
+        alive = np.ones(len(idx), dtype=bool)
+        # photons split by the weight window, they continue in the next step
+        pending = np.zeros(len(idx), dtype=bool)
+        ins = self.instrument
+
+        #
+        # maximum path length before exiting the cryostat
+        #
+        t0 = time.perf_counter() if ins is not None else 0.0
+        s_in, s_out = self.cryostat.intersect(x0, t)
+        s_max = np.where(s_in > 0, s_in, s_out)
+        alive &= np.isfinite(s_max)
+        if ins is not None:
+            ins.add_time('geometry', t0)
+            ins.count('intersections', len(idx))
+            ins.count('escaped', len(idx) - np.count_nonzero(alive))
+
+        s_max_fiducial = np.full(len(idx), -1.0)
+        if self.vrt == 'fiducial_scatter':
+            mu = self.phys.get_att(energy=e)
+            #
+            # transport to the fiducial volume the first time
+            #
+            first = alive & (nscat == 0) & (ww_level < 0)
+            if first.any():
+                t0 = time.perf_counter() if ins is not None else 0.0
+                f_in, f_out = self.fiducial.intersect(x0[first], t[first])
+                hit = np.isfinite(f_out) & (f_in > 0)
+                if ins is not None:
+                    ins.add_time('geometry', t0)
+                    ins.count('intersections', len(hit))
+                    ins.count('fiducial_miss', len(hit) - np.count_nonzero(hit))
+                entry = np.where(hit, f_in, 0.0)
+                sel = np.flatnonzero(first)
+                w[sel] *= np.where(hit, np.exp(-entry / mu[sel]), 1.0)
+                x0[sel] += t[sel] * entry[:, None]
+                s_max[sel] -= entry
+                s_max_fiducial[sel] = f_out - entry
+                alive[sel[~hit]] = False
+            #
+            # path length to the fiducial boundary for the next scatters
+            #
+            middle = alive & ((nscat > 0) | (ww_level >= 0)) & (nscat < self.nscatter_max)
+            if middle.any():
+                t0 = time.perf_counter() if ins is not None else 0.0
+                f_in, f_out = self.fiducial.intersect(x0[middle], t[middle])
+                sf = np.where(f_in > 0, f_in, f_out)
+                if ins is not None:
+                    ins.add_time('geometry', t0)
+                    ins.count('intersections', len(sf))
+                sel = np.flatnonzero(middle)
+                bad = ~np.isfinite(sf)
+                if bad.any():
+                    print('photon_bank::step ERROR.... bad intersection. discard', bad.sum(), 'events.')
+                s_max_fiducial[sel] = sf
+                alive[sel[bad]] = False
+            #
+            # probability to reach the outside world after the last allowed scatter
+            #
+            last = alive & (nscat >= self.nscatter_max)
+            w[last] *= np.exp(-s_max[last] / mu[last])
+            alive[last] = False
+            if ins is not None:
+                ins.count('nscatter_max_terminations', np.count_nonzero(last))
+            #
+            # weight window, once per scatter level
+            #
+            if self.weight_window is not None:
+                check = np.flatnonzero(alive & (ww_level < nscat))
+                if len(check) > 0:
+                    nsplit = self.apply_weight_window(idx, check, w, nscat, alive)
+                    pending[check] = nsplit > 1
+                    nsplit = nsplit[nsplit > 1]
+
+        #
+        # generate the interaction point for the photons that are still alive
+        #
+        sel = np.flatnonzero(alive & ~pending)
+        s_gen = self.generate_interaction_point(e[sel], w, sel, s_max_fiducial[sel],
+                                                rng=self.draw_rng(idx[sel], 'interaction'))
+        inside = s_gen < s_max[sel]
+        alive[sel[~inside]] = False
+        if ins is not None:
+            ins.count('escaped', len(inside) - np.count_nonzero(inside))
+
+        sel = sel[inside]
+        if len(sel) > 0:
+            self.scatter(idx, sel, x0, t, e, w, nscat, s_gen[inside])
+            alive[sel] &= self.e[idx[sel]] > 0
+
+        #
+        # store the modified photon parameters. scatter() already wrote its own photons
+        #
+        done = np.setdiff1d(np.arange(len(idx)), sel, assume_unique=True)
+        self.x0[idx[done]] = x0[done]
+        self.weight[idx[done]] = w[done]
+        self.alive[idx] = alive
+
+        if pending.any():
+            self.add_copies(idx[pending], nsplit)
+
+        return
+
+    def apply_weight_window(self, idx, check, w, nscat, alive):
+        """
+        Split or roulette the photons check of the step with the weight window of their scatter level
+
+        :param idx: bank indices of the photons in this step
+        :param check: indices (into idx) of the photons that are checked
+        :param w, nscat, alive: photon parameters of the step (w and alive are modified)
+        :return: number of photons after the check (0 = killed), per checked photon
+        """
+        n, w_new = self.weight_window.apply(w[check], nscat[check],
+                                            self.draw_rng(idx[check]).uniform(0, 1, len(check)))
+        w[check] = w_new
+        alive[check[n == 0]] = False
+        self.ww_level[idx[check]] = nscat[check]
+
+        if self.instrument is not None:
+            self.instrument.count('ww_roulette_kills', np.count_nonzero(n == 0))
+            self.instrument.count('ww_splits', (n[n > 1] - 1).sum())
+
+        return n
+
+    def add_copies(self, bank, n):
+        """
+        Add the copies of split photons to the bank
+
+        :param bank: bank indices of the split photons
+        :param n: number of photons after the split, per split photon
+        :return:
+        """
+        rep = np.repeat(bank, n - 1)
+        for name in ['x0', 'x0start', 'direction', 'e', 'e0', 'weight', 'nscatter', 'edep', 'edep_left', 'alive',
+                     'xint', 'event', 'ww_level']:
+            a = getattr(self, name)
+            setattr(self, name, np.concatenate([a, a[rep]]))
+        self.n = len(self.e)
+
+        #
+        # the copies get the next track numbers of their event, in bank order, and start a new random sequence
+        #
+        event = self.event[rep]
+        order = np.argsort(event, kind='stable')
+        start = np.searchsorted(event[order], event[order])
+        rank = np.empty(len(rep), dtype=np.int64)
+        rank[order] = np.arange(len(rep)) - start
+        self.track = np.concatenate([self.track, self.ntrack[event] + rank])
+        self.ndraw = np.concatenate([self.ndraw, np.zeros(len(rep), dtype=np.int64)])
+        np.add.at(self.ntrack, event, 1)
+
+        return
+
+    def generate_interaction_point(self, e, w, sel, smax, rng=None):
+        """
+        Generate the path length to the next interaction. Same as particle.generate_interaction_point
+
+        :param e: photon energies
+        :param w: weights of the photons in the step (modified in place for rmax)
+        :param sel: indices in w of the photons that are generated
+        :param smax: maximum path length (-1 = infinite)
+        :param rng: random generator [Default = None -> self.rng]
+        :return: path lengths
+        """
+        mu = self.phys.get_att(energy=e)
+
+        limited = smax > 0.0
+        rmax = np.ones(len(e))
+        rmax[limited] = 1.0 - np.exp(-smax[limited] / mu[limited])
+        w[sel] *= rmax
+
+        if rng is None:
+            rng = self.rng
+        r = rng.uniform(0, rmax)
+        return -np.log(1 - r) * mu
+
+    def scatter(self, idx, sel, x0, t, e, w, nscat, s):
+        """
+        Scatter the photons sel after path length s. Choose between Compton scatter and the PE effect
+
+        :param idx: bank indices of the photons in this step
+        :param sel: indices (into idx) of the photons that interact
+        :param x0, t, e, w, nscat: photon parameters of the step
+        :param s: path lengths to the interaction point
+        :return:
+        """
+        bank = idx[sel]
+        energy = e[sel]
+        weight = w[sel]
+        xnew = x0[sel] + t[sel] * s[:, None]
+        tnew = t[sel].copy()
+        edep_left = self.edep_left[bank]
+
+        #
+        # select the scatter process. With a restricted energy deposit the PE effect is switched off
+        #
+        t0 = time.perf_counter() if self.instrument is not None else 0.0
+        sigma = self.phys.get_cross_sections(energy)  # rows: length, att, inc, pho, pp
+        frac = sigma[2] / sigma[1]
+        if self.instrument is not None:
+            self.instrument.add_time('physics', t0)
+            self.instrument.count('cross_section_lookups', len(energy))
+        restricted = edep_left < energy
+        weight[restricted] *= frac[restricted]
+        compton = restricted | (self.draw_rng(bank, 'process').uniform(0, 1, len(sel)) < frac)
+        if self.instrument is not None:
+            self.instrument.count('compton', np.count_nonzero(compton))
+            self.instrument.count('photoelectric', len(compton) - np.count_nonzero(compton))
+
+        #
+        # Compton scatter
+        #
+        enew = np.zeros(len(sel))
+        c = np.flatnonzero(compton)
+        if len(c) > 0:
+            cost, phi, w_s = self.phys.sample_compton(energy[c], edep_left[c],
+                                                      rng=self.draw_rng(bank[c], 'compton_r'))
+            tnew[c] = rotate_direction(t[sel][c], cost, phi)
+            enew[c] = self.phys.P(energy[c], cost) * energy[c]
+            weight[c] *= w_s
+        #
+        # Photo-electric effect: all energy is deposited
+        #
+        tnew[~compton] = 0.0
+
+        de = energy - enew
+
+        #
+        # store the interaction
+        #
+        n = nscat[sel]
+        store = n < self.writeout
+        self.xint[bank[store], n[store], :3] = xnew[store]
+        self.xint[bank[store], n[store], 3] = de[store]
+
+        self.x0[bank] = xnew
+        self.direction[bank] = tnew
+        self.e[bank] = enew
+        self.weight[bank] = weight
+        self.edep[bank] += de
+        self.edep_left[bank] -= de
+        self.nscatter[bank] += 1
+
+        return
+
+    def get_records(self, first_event=0):
+        """
+        Per-event records of the bank: [event, nscatters, w, de, x0, y0, z0, x1, y1, z1, de1, ...]
+
+        :param first_event: event number of the first photon in the bank
+        :return: array of shape (n, 7+4*writeout), with the primary energy as extra column for a line source
+        """
+        # split photons follow their primary
+        order = np.argsort(self.event, kind='stable') if self.n > self.nprimary else slice(None)
+        records = np.empty((self.n, len(event_columns(self.writeout, self.source is not None))))
+        records[:, 0] = first_event + self.event[order]
+        records[:, 1] = self.nscatter[order]
+        records[:, 2] = self.weight[order]
+        records[:, 3] = self.edep[order]
+        records[:, 4:7] = self.x0start[order]
+        records[:, 7:7 + 4 * self.writeout] = self.xint[order].reshape(self.n, -1)
+        if self.source is not None:
+            records[:, -1] = self.e0[order]
+
+        return records
@@ -0,0 +1,81 @@
+import numpy as np
+
+#
+# Weight windows for the fiducial_scatter VRT.
+#
+# Before every interaction inside the fiducial volume (level = number of scatters so far) the weight of a
+# photon is compared with the window [lower, upper] of that level:
+#
+#   w > upper: the photon is split in n = min(ceil(w / upper), max_split) photons of weight w / n
+#   w < lower: Russian roulette. The photon survives with probability w / survival and gets the weight
+#              survival, otherwise it is killed (weight 0)
+#
+# Both keep the expected weight. The split photons are written as separate records with the event number
+# of their primary, the tally sums them per primary (see tally.fill).
+#
+
+
+class weight_window:
+    """
+    Weight window, global or per scatter level
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Define a weight window
+
+        :param kwargs:
+            lower = lower bound: a number, or a list with the bound per level (number of scatters before the
+                    interaction, the last value is used for the higher levels). 0 switches a level off
+            ratio = upper / lower [Default = 5]
+            survival = weight after a successful roulette, as a fraction between lower (0) and upper (1) on
+                       a log scale [Default = 0.5 -> geometric mean of the bounds]
+            max_split = maximum number of photons after a split [Default = 10]
+        """
+        self.lower = np.atleast_1d(np.asarray(kwargs.pop('lower'), dtype=float))
+        self.ratio = kwargs.pop('ratio', 5.0)
+        self.survival_fraction = kwargs.pop('survival', 0.5)
+        self.max_split = kwargs.pop('max_split', 10)
+
+        if (self.ratio <= 1) or np.any(self.lower < 0):
+            print('weight_window::__init__ ERROR invalid window: lower = ', self.lower, ' ratio = ', self.ratio)
+            raise ValueError('invalid weight window: lower bounds must be >= 0 and ratio > 1')
+
+        on = self.lower > 0
+        self.upper = np.where(on, self.lower * self.ratio, np.inf)
+        self.survival = np.where(on, self.lower * self.ratio ** self.survival_fraction, 0.0)
+
+        return
+
+    def bounds(self, level):
+        """
+        :param level: scatter level(s)
+        :return: lower, upper and survival weight of the level(s)
+        """
+        i = np.minimum(level, len(self.lower) - 1)
+
+        return self.lower[i], self.upper[i], self.survival[i]
+
+    def apply(self, w, level, u):
+        """
+        Apply the window
+
+        :param w: weight(s)
+        :param level: scatter level(s)
+        :param u: uniform random number(s) for the roulette
+        :return: number of photons after the check (0 = killed, 1 = unchanged or survived, >1 = split),
+                 weight of every photon
+        """
+        lower, upper, survival = self.bounds(level)
+        w = np.asarray(w, dtype=float)
+
+        split = w > upper
+        n = np.where(split, np.minimum(np.ceil(w / np.where(split, upper, 1.0)), self.max_split), 1).astype(np.int64)
+        w_new = w / n
+
+        roulette = w < lower
+        killed = roulette & (u * survival >= w)
+        n = np.where(killed, 0, n)
+        w_new = np.where(roulette, np.where(killed, 0.0, survival), w_new)
+
+        return n, w_new
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../python/'))
+
+import numpy as np
+import pandas as pd
+
+from physics import em_physics
+from cylinder import cylinder
+from eventio import event_writer, event_columns
+from tally import tally, convergence
+from source import line_source
+from weight_window import weight_window
+from catalog import job_catalog, catalog_file
+from checkpoint import checkpoint_file, save_checkpoint, load_checkpoint
+import driver
+
+# arguments that may change when a run is resumed from a checkpoint
+resume_arguments = ['resume', 'checkpoint_interval', 'report_interval', 'job_id', 'catalog']
+
+
+def parse_arguments(argv=None):
+    """
+    Command line arguments. The names follow the job settings written by generate_jobs.py
+
+    :param argv: argument list [Default = sys.argv]
+    :return: parsed arguments
+    """
+    parser = argparse.ArgumentParser(description='FastMC event generation')
+    parser.add_argument('--nevents', type=int, default=100000)
+    parser.add_argument('--energy', type=float, default=1000.)
+    parser.add_argument('--nuclide', type=str, nargs='+', default=None,
+                        help='line source: lines of these nuclides from GAMMA-RAY ISOTOPES.csv (replaces --energy)')
+    parser.add_argument('--chain', type=str, nargs='+', default=None,
+                        help='line source: lines of these decay chains, e.g. 238U 232Th (replaces --energy)')
+    parser.add_argument('--vrt', type=str, default='None')
+    parser.add_argument('--edep_max', type=float, default=100000.)
+    parser.add_argument('--nscatter', type=int, default=1)
+    parser.add_argument('--ran_seed', type=int, default=None)
+    parser.add_argument('--r_cryostat', type=float, default=65.)
+    parser.add_argument('--z_cryostat', type=float, default=150.)
+    parser.add_argument('--r_fiducial', type=float, default=57.)
+    parser.add_argument('--z_fiducial', type=float, default=134.)
+    parser.add_argument('--output', type=str, default='mcdata')
+    parser.add_argument('--nworkers', type=int, default=1)
+    parser.add_argument('--engine', type=str, default='numpy', choices=['numpy', 'numba'])
+    parser.add_argument('--source_mode', type=str, default='isotropic', choices=['isotropic', 'cosine', 'fiducial'],
+                        help='direction of the primaries. fiducial = biased into a cone around the fiducial '
+                             'volume with weight correction (vrt fiducial_scatter only)')
+    parser.add_argument('--ww_lower', type=float, nargs='+', default=None,
+                        help='weight window lower bound (per scatter level) for the fiducial_scatter VRT')
+    parser.add_argument('--ww_ratio', type=float, default=5., help='weight window upper / lower bound')
+    parser.add_argument('--ww_max_split', type=int, default=10, help='maximum number of photons after a split')
+    parser.add_argument('--rng', type=str, default='sequential', choices=['sequential', 'counter'],
+                        help='counter = random numbers keyed by the master seed and the event number: results do '
+                             'not depend on nworkers/chunk_size and single events can be replayed with '
+                             'replay_event.py (engine numpy only)')
+    parser.add_argument('--format', type=str, default='npz', choices=['npz', 'csv', 'none'])
+    parser.add_argument('--tally', action='store_true', help='store the energy spectra in <output>_tally.npz')
+    parser.add_argument('--chunk_size', type=int, default=1000000)
+    parser.add_argument('--target_error', type=float, default=None,
+                        help='stop when the relative error of the fiducial single-scatter rate reaches this value')
+    parser.add_argument('--report_interval', type=float, default=None, help='seconds between progress reports')
+    parser.add_argument('--job_id', type=int, default=None, help='store the result of the job in the catalog')
+    parser.add_argument('--catalog', type=str, default=catalog_file)
+    parser.add_argument('--checkpoint_interval', type=float, default=600.,
+                        help='seconds between checkpoints in <output>_checkpoint.npz (0: no checkpoints)')
+    parser.add_argument('--resume', action='store_true', help='continue from the checkpoint of an interrupted run')
+
+    args = parser.parse_args(argv)
+    if (args.ww_lower is not None) and (args.vrt != 'fiducial_scatter'):
+        parser.error('--ww_lower needs --vrt fiducial_scatter')
+    if (args.source_mode == 'fiducial') and (args.vrt != 'fiducial_scatter'):
+        parser.error('--source_mode fiducial needs --vrt fiducial_scatter')
+
+    return args
+
+
+def transport_settings(args):
+    """
+    Physics, geometry, source and VRT settings of the photon transport
+
+    :param args: parsed arguments, see parse_arguments
+    :return: dictionary of settings for driver.generate_chunks
+    """
+    source = None
+    if (args.nuclide is not None) or (args.chain is not None):
+        source = line_source(nuclide=args.nuclide, chain=args.chain)
+        print('MC_run:: line source with ', len(source.energy), ' lines between ', source.energy.min(), ' and ',
+              source.emax, ' keV')
+
+    ww = None
+    if args.ww_lower is not None:
+        ww = weight_window(lower=args.ww_lower, ratio=args.ww_ratio, max_split=args.ww_max_split)
+
+    return dict(engine=args.engine,
+                source_mode=args.source_mode,
+                energy=args.energy,
+                source=source,
+                weight_window=ww,
+                physics=em_physics(),
+                geometry=cylinder(R=args.r_cryostat, h=args.z_cryostat),
+                fiducial=cylinder(R=args.r_fiducial, h=args.z_fiducial),
+                vrt=None if args.vrt == 'None' else args.vrt,
+                nscatter_max=args.nscatter,
+                edep_max=args.edep_max)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+
+    settings = transport_settings(args)
+    source = settings['source']
+    fiducial = settings['fiducial']
+    emax = args.energy if source is None else source.emax
+
+    monitored = (args.target_error is not None) or (args.report_interval is not None)
+    if args.tally or (args.format == 'none') or monitored or (source is not None):
+        t = tally(fiducial=fiducial, nscatter=[1, 2, 3, 4], edep_max=args.edep_max, emax=emax, source=source)
+    else:
+        t = None
+
+    #
+    # state of an interrupted run
+    #
+    ckpt = checkpoint_file(args.output)
+    state, writer_state = None, None
+    if args.resume and os.path.exists(ckpt):
+        state, t_ckpt, writer_state = load_checkpoint(ckpt)
+        changed = [k for k in vars(args) if (k not in resume_arguments) and (state['args'].get(k) != vars(args)[k])]
+        if len(changed) > 0:
+            print('MC_run:: ERROR settings differ from the checkpoint ', ckpt, ': ', changed)
+            sys.exit(1)
+        if t_ckpt is not None:
+            t = t_ckpt
+        print('MC_run:: resume from ', ckpt, ' after ', state['nevent'], ' events')
+    elif args.resume:
+        print('MC_run:: no checkpoint ', ckpt, ', start a new run')
+
+    # the master seed is part of the checkpoint: without --ran_seed fresh entropy is drawn once
+    if state is not None:
+        seed = state['seed']
+    elif args.ran_seed is not None:
+        seed = args.ran_seed
+    else:
+        seed = int(np.random.SeedSequence().entropy)
+    nshard = 0 if state is None else state['nshard']
+    nevents = 0 if state is None else state['nevent']
+    total_weight = 0.0 if state is None else state['total_weight']
+    elapsed = 0.0 if state is None else state['wall_time']
+
+    settings.update(nworkers=args.nworkers, seed=seed, chunk_size=args.chunk_size)
+    if args.rng == 'counter':
+        settings['counter_seed'] = seed
+
+    print('MC_run:: generate ', args.nevents, ' events on ', args.nworkers, ' workers')
+    print('MC_run:: master seed ', seed, ' random numbers ', args.rng)
+    if args.target_error is not None:
+        print('MC_run:: stop at a relative error of ', args.target_error, ' on the fiducial single-scatter rate')
+        if args.chunk_size >= args.nevents:
+            settings['chunk_size'] = max(args.nevents // 100, 1000)
+    if args.format == 'none':
+        # no per-event output: the workers only fill the tally
+        settings['tally'] = t
+    monitor = None
+    if monitored:
+        monitor = convergence(t, target=args.target_error, interval=args.report_interval)
+        monitor.t0 -= elapsed
+    #
+    # output: columnar event file written chunk by chunk, or the csv layout of event_generator
+    #
+    writer = None
+    if args.format == 'npz':
+        writer = event_writer(args.output + '.npz', chunk_size=args.chunk_size, meta=vars(args), resume=writer_state,
+                              primary=source is not None)
+    elif args.format == 'csv':
+        with open(args.output + '.csv', 'w' if state is None else 'r+') as f:
+            if state is not None:
+                f.truncate(state['offset'])
+
+    t0 = time.time()
+    t_checkpoint = t0
+    for result in driver.generate_chunks(args.nevents, first_shard=nshard, **settings):
+        nshard += 1
+        if args.format == 'none':
+            t.merge(result)
+            nevents += result.nevent
+            total_weight += result.sum_w
+        else:
+            records = result
+            if writer is not None:
+                writer.write(records)
+            else:
+                df = pd.DataFrame(records, columns=event_columns(primary=source is not None))
+                df = df.astype({'#': int, 'nscatters': int})
+                df.to_csv(args.output + '.csv', mode='a', index=False, header=False)
+            # split photons of a weight window share the event number of their primary
+            nevents += int(records[-1, 0] - records[0, 0]) + 1 if len(records) > 0 else 0
+            total_weight += records[:, 2].sum()
+            if t is not None:
+                t.fill(records)
+        if (monitor is not None) and monitor.update():
+            break
+        #
+        # periodic checkpoint
+        #
+        if (args.checkpoint_interval > 0) and (time.time() - t_checkpoint >= args.checkpoint_interval):
+            state = {'args': vars(args), 'seed': seed, 'nshard': nshard, 'nevent': nevents,
+                     'total_weight': float(total_weight), 'wall_time': elapsed + time.time() - t0}
+            if args.format == 'csv':
+                state['offset'] = os.path.getsize(args.output + '.csv')
+            save_checkpoint(ckpt, state, tally=t, writer=None if writer is None else writer.checkpoint())
+            t_checkpoint = time.time()
+            print('MC_run:: checkpoint after ', nevents, ' events')
+
+    if writer is not None:
+        writer.close()
+
+    if t is not None:
+        t.save(args.output + '_tally.npz')
+
+    if monitor is not None:
+        monitor.finish()
+
+    if source is not None:
+        print('MC_run:: fiducial single-scatter rate per chain')
+        print(t.chain_rates(1).to_string(index=False))
+
+    if os.path.exists(ckpt):
+        os.remove(ckpt)
+
+    dt = elapsed + time.time() - t0
+    print('MC_run:: done in ', dt, ' s (', nevents / dt, ' events/s)')
+
+    if args.job_id is not None:
+        with job_catalog(args.catalog) as cat:
+            cat.update_result(args.job_id, output=args.output, nevents=nevents, wall_time=dt,
+                              total_weight=float(total_weight))
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../python/'))
+
+import numpy as np
+
+from physics import em_physics
+from cylinder import cylinder
+from tally import tally
+from weight_window import weight_window
+from source import isotope_file, read_lines
+import driver
+
+#
+# Figure-of-merit benchmark of the analog and fiducial_scatter simulations.
+#
+# For every (energy, edep_max, fiducial size) of the matrix an analog run and one fiducial_scatter run per
+# nscatter_max are made with the same number of events. The figure of merit FOM = 1/(R^2 T) of the fiducial
+# nscatter-scatter rate (R = relative error, T = wall time) is the cost measure: the acceleration factor of
+# the VRT is FOM_vrt / FOM_analog. With a weight window every VRT run is repeated with the window, and
+# FOM_ww / FOM_vrt measures what the window gains. The results are written as json and compared with a
+# stored baseline. The VRT runs can use the source direction biasing of biasing.py (source_mode =
+# 'fiducial'), the analog runs are always isotropic.
+#
+
+# fiducial volumes (radius, height) in cm, as in Sigma_study
+fiducial_sizes = {'Normal': (57., 134.), 'Neutrinoless': (40., 100.)}
+
+
+def isotope_energies(fn=isotope_file):
+    """
+    Gamma energies of the isotope line list
+
+    :param fn: line list, see source.read_lines
+    :return: sorted array of the distinct energies
+    """
+    return np.unique(read_lines(fn)['energy'].values)
+
+
+def config_key(r):
+    """
+    :param r: result dictionary
+    :return: string that identifies the configuration of a result
+    """
+    return '%s/E=%g/edep_max=%g/fid=%s/nscatter=%i' % (r['mode'], r['energy'], r['edep_max'], r['fiducial'],
+                                                       r['nscatter'])
+
+
+def run_config(energy, edep_max, fid, vrt, nscatter, nevents, settings):
+    """
+    Run one configuration and measure the rate of nscatter-scatter events in the fiducial volume
+
+    :param energy: gamma energy (keV)
+    :param edep_max: maximum energy deposit (keV)
+    :param fid: instant of the cylinder class for the fiducial volume
+    :param vrt: None or 'fiducial_scatter'
+    :param nscatter: list of scatter multiplicities to tally (the last one is nscatter_max for the VRT)
+    :param nevents: number of events
+    :param settings: other arguments of driver.generate_tally (physics, geometry, engine, ...)
+    :return: tally, wall time (s)
+    """
+    t = tally(fiducial=fid, nscatter=nscatter, edep_max=edep_max, emax=energy)
+
+    t0 = time.time()
+    t = driver.generate_tally(nevents, tally=t, energy=energy, edep_max=edep_max, fiducial=fid, vrt=vrt,
+                              nscatter_max=max(nscatter), **settings)
+    dt = time.time() - t0
+
+    return t, dt
+
+
+def result_row(mode, energy, edep_max, fiducial, nscatter, t, dt):
+    """
+    :return: result dictionary of one configuration and scatter multiplicity
+    """
+    mean, err = t.rate(nscatter)
+    rel = t.relative_error(nscatter)
+    npass = t.n_pass[t.nscatter.index(nscatter), 2]
+
+    return {'mode': mode, 'energy': float(energy), 'edep_max': float(edep_max), 'fiducial': fiducial,
+            'nscatter': int(nscatter), 'nevents': int(t.nevent), 'wall_time': dt, 'events_per_s': t.nevent / dt,
+            'npass': int(npass), 'rate': float(mean), 'error': float(err),
+            'rel_error': float(rel) if np.isfinite(rel) else None, 'fom': float(t.fom(nscatter, dt))}
+
+
+def run_benchmark(**kwargs):
+    """
+    Run the benchmark matrix
+
+    :param kwargs:
+        energies = gamma energies (keV) [Default = isotope_energies()]
+        edep_max = list of maximum energy deposits (keV) [Default = [250, 2700]]
+        nscatter_max = list of scatter multiplicities of the VRT [Default = [1, 2]]
+        fiducial = list of fiducial sizes, keys of fiducial_sizes [Default = all]
+        nevents = number of events per run [Default = 200000]
+        engine, nworkers, seed = see driver.generate_chunks [Default = 'numba', 1, 12345]
+        weight_window = weight window for an extra VRT run per configuration (engine numpy only) [Default = None]
+        source_mode = direction of the primaries of the VRT runs, 'isotropic' or 'fiducial' [Default = 'isotropic']
+    :return: list of result dictionaries, see result_row. The VRT rows have the acceleration factor, the
+             weight window rows the gain over the VRT without window
+    """
+    energies = kwargs.pop('energies', None)
+    if energies is None:
+        energies = isotope_energies()
+    edep_max_list = kwargs.pop('edep_max', [250., 2700.])
+    nscatter_list = sorted(kwargs.pop('nscatter_max', [1, 2]))
+    fiducials = kwargs.pop('fiducial', list(fiducial_sizes))
+    nevents = kwargs.pop('nevents', 200000)
+
+    cryostat = cylinder(R=65., h=150.)
+    em = em_physics()
+    settings = dict(physics=em, geometry=cryostat,
+                    engine=kwargs.pop('engine', 'numba'),
+                    nworkers=kwargs.pop('nworkers', 1),
+                    seed=kwargs.pop('seed', 12345))
+    ww = kwargs.pop('weight_window', None)
+    vrt_settings = dict(settings, source_mode=kwargs.pop('source_mode', 'isotropic'))
+    if (ww is not None) and (settings['engine'] != 'numpy'):
+        print('benchmark_fom::run_benchmark ERROR weight windows need engine numpy. Runs without window only')
+        ww = None
+
+    # load the compiled kernel before the first timed run
+    run_config(1000., 2700., cryostat, 'fiducial_scatter', [1], 1000, settings)
+
+    results = []
+    for name in fiducials:
+        fid = cylinder(R=fiducial_sizes[name][0], h=fiducial_sizes[name][1])
+        for energy in energies:
+            for edep_max in edep_max_list:
+                #
+                # one analog run gives the rates of all scatter multiplicities
+                #
+                t, dt = run_config(energy, edep_max, fid, None, nscatter_list, nevents, settings)
+                analog = {}
+                for ns in nscatter_list:
+                    analog[ns] = result_row('analog', energy, edep_max, name, ns, t, dt)
+                    results.append(analog[ns])
+
+                for ns in nscatter_list:
+                    t, dt = run_config(energy, edep_max, fid, 'fiducial_scatter', [ns], nevents, vrt_settings)
+                    r = result_row('fiducial_scatter', energy, edep_max, name, ns, t, dt)
+                    r['acceleration'] = r['fom'] / analog[ns]['fom'] if analog[ns]['fom'] > 0 else None
+                    results.append(r)
+                    print('benchmark_fom:: %-40s FOM = %10.4g /s  analog = %10.4g /s  %8.0f events/s' %
+                          (config_key(r), r['fom'], analog[ns]['fom'], r['events_per_s']))
+
+                    if ww is None:
+                        continue
+                    t, dt = run_config(energy, edep_max, fid, 'fiducial_scatter', [ns], nevents,
+                                       dict(vrt_settings, weight_window=ww))
+                    rw = result_row('weight_window', energy, edep_max, name, ns, t, dt)
+                    rw['gain'] = rw['fom'] / r['fom'] if r['fom'] > 0 else None
+                    results.append(rw)
+                    print('benchmark_fom:: %-40s FOM = %10.4g /s  no window = %10.4g /s  rate = %.4g +- %.2g '
+                          '(no window %.4g +- %.2g)' % (config_key(rw), rw['fom'], r['fom'], rw['rate'], rw['error'],
+                                                        r['rate'], r['error']))
+
+    return results
+
+
+def compare(results, baseline, threshold=0.7, min_pass=100):
+    """
+    Compare the figures of merit with a baseline report. Configurations with too few selected events
+    for a meaningful relative error are skipped
+
+    :param results: list of result dictionaries
+    :param baseline: baseline report (dictionary with 'results')
+    :param threshold: a configuration regresses if FOM / FOM_baseline < threshold
+    :param min_pass: minimum number of selected events in both reports
+    :return: list of (key, fom, fom_baseline, ratio), list of regressed keys
+    """
+    ref = {config_key(r): r for r in baseline['results']}
+
+    table = []
+    regressions = []
+    for r in results:
+        key = config_key(r)
+        if (key not in ref) or (min(r['npass'], ref[key]['npass']) < min_pass):
+            continue
+        ratio = r['fom'] / ref[key]['fom']
+        table.append((key, r['fom'], ref[key]['fom'], ratio))
+        if ratio < threshold:
+            regressions.append(key)
+
+    return table, regressions
+
+
+def machine_info():
+    """
+    :return: dictionary describing the machine and the code version
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'host': platform.node(), 'platform': platform.platform(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'cpu_count': os.cpu_count(), 'commit': commit,
+            'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FastMC figure-of-merit benchmark')
+    parser.add_argument('--energies', type=float, nargs='+', default=None, help='default: ISOTOPES.csv lines')
+    parser.add_argument('--edep_max', type=float, nargs='+', default=[250., 2700.])
+    parser.add_argument('--nscatter_max', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--fiducial', type=str, nargs='+', default=list(fiducial_sizes), choices=list(fiducial_sizes))
+    parser.add_argument('--nevents', type=int, default=200000)
+    parser.add_argument('--engine', type=str, default='numba', choices=['numpy', 'numba'])
+    parser.add_argument('--nworkers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=12345)
+    parser.add_argument('--ww_lower', type=float, nargs='+', default=None,
+                        help='also run the VRT with this weight window lower bound (per scatter level)')
+    parser.add_argument('--ww_ratio', type=float, default=5., help='weight window upper / lower bound')
+    parser.add_argument('--ww_max_split', type=int, default=10, help='maximum number of photons after a split')
+    parser.add_argument('--source_mode', type=str, default='isotropic', choices=['isotropic', 'fiducial'],
+                        help='direction of the primaries of the VRT runs')
+    parser.add_argument('--output', type=str, default='fom_benchmark.json')
+    parser.add_argument('--baseline', type=str, default=None, help='report to compare with')
+    parser.add_argument('--threshold', type=float, default=0.7, help='fail if FOM/FOM_baseline is below this')
+    parser.add_argument('--min_pass', type=int, default=100, help='compare configurations with at least this many '
+                                                                  'selected events')
+    args = parser.parse_args(argv)
+
+    ww = None
+    if args.ww_lower is not None:
+        ww = weight_window(lower=args.ww_lower, ratio=args.ww_ratio, max_split=args.ww_max_split)
+    results = run_benchmark(energies=args.energies, edep_max=args.edep_max, nscatter_max=args.nscatter_max,
+                            fiducial=args.fiducial, nevents=args.nevents, engine=args.engine,
+                            nworkers=args.nworkers, seed=args.seed, weight_window=ww,
+                            source_mode=args.source_mode)
+
+    report = {'machine': machine_info(), 'settings': vars(args), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print('benchmark_fom:: report written to ', args.output)
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    table, regressions = compare(results, baseline, threshold=args.threshold, min_pass=args.min_pass)
+    for key, fom, fom_ref, ratio in table:
+        print('benchmark_fom:: %-40s FOM = %10.4g /s  baseline = %10.4g /s  ratio = %6.3f %s' %
+              (key, fom, fom_ref, ratio, '<-- REGRESSION' if key in regressions else ''))
+    if len(regressions) > 0:
+        print('benchmark_fom:: ERROR ', len(regressions), ' configurations below ', args.threshold, ' x baseline')
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../python/'))
+
+import numpy as np
+
+from physics import em_physics, rotate_direction
+from cylinder import cylinder
+from particle import particle
+
+from benchmark_fom import machine_info
+
+#
+# Micro-benchmarks of the transport hot functions.
+#
+# Every benchmark prepares n inputs from a fixed seed with a realistic distribution (photon energies
+# log-uniform between 50 keV and 3 MeV, starting points on the cryostat surface, isotropic directions) and
+# returns a function that makes n calls. The best of several repeats gives the time per call. Scalar
+# functions are timed per call, the batch (numpy) versions per array element.
+#
+
+# energy range of the photons in the benchmarks (keV)
+emin = 50.
+emax = 3000.
+
+
+def make_setup(seed):
+    """
+    Common objects of the benchmarks
+
+    :param seed: random seed
+    :return: dictionary with physics, cryostat, fiducial and a particle
+    """
+    np.random.seed(seed)
+    setup = {'physics': em_physics(), 'cryostat': cylinder(R=65., h=150.), 'fiducial': cylinder(R=57., h=134.)}
+    setup['particle'] = particle(type='gamma', energy=1000., physics=setup['physics'], geometry=setup['cryostat'],
+                                 fiducial=setup['fiducial'], vrt='fiducial_scatter', edep_max=250.)
+
+    return setup
+
+
+def random_energies(rng, n):
+    return np.exp(rng.uniform(np.log(emin), np.log(emax), n))
+
+
+def random_directions(rng, n):
+    cost = rng.uniform(-1, 1, n)
+    sint = np.sqrt(1 - cost ** 2)
+    phi = rng.uniform(0, 2 * np.pi, n)
+    return np.stack([np.cos(phi) * sint, np.sin(phi) * sint, cost], axis=1)
+
+
+def bench_do_compton(setup, rng, n):
+    phys = setup['physics']
+    e = random_energies(rng, n)
+    de_max = np.where(rng.uniform(0, 1, n) < 0.5, 250., 1e5)
+
+    def run():
+        for i in range(n):
+            phys.do_compton(e[i], de_max[i])
+    return run
+
+
+def bench_get_sigma(setup, rng, n):
+    phys = setup['physics']
+    e = random_energies(rng, n)
+
+    def run():
+        for i in range(n):
+            phys.get_sigma(process='inc', energy=e[i])
+    return run
+
+
+def bench_get_att(setup, rng, n):
+    phys = setup['physics']
+    e = random_energies(rng, n)
+
+    def run():
+        for i in range(n):
+            phys.get_att(energy=e[i])
+    return run
+
+
+def bench_particle_intersect(setup, rng, n):
+    p = setup['particle']
+    cryostat = setup['cryostat']
+    x0 = cryostat.generate_points(n, rng=rng)['x']
+    t = random_directions(rng, n)
+
+    def run():
+        for i in range(n):
+            p.x0 = x0[i]
+            p.direction = t[i]
+            p.intersect(cryostat)
+    return run
+
+
+def bench_generate_interaction_point(setup, rng, n):
+    p = setup['particle']
+    e = random_energies(rng, n)
+    smax = np.where(rng.uniform(0, 1, n) < 0.5, rng.uniform(0, 130, n), -1.)
+
+    def run():
+        for i in range(n):
+            p.energy = e[i]
+            p.weight = 1.0
+            p.generate_interaction_point(smax=smax[i])
+    return run
+
+
+def bench_update_particle(setup, rng, n):
+    p = setup['particle']
+    e = random_energies(rng, n)
+    t = random_directions(rng, n)
+    theta = np.arccos(rng.uniform(-1, 1, n))
+    phi = rng.uniform(0, 2 * np.pi, n)
+    s = rng.uniform(0, 100, n)
+
+    def run():
+        p.xint = []
+        p.nscatter = 0
+        for i in range(n):
+            p.energy = e[i]
+            p.direction = t[i]
+            p.edep_max = 1e5
+            p.update_particle('inc', s[i], theta[i], phi[i], 1.0)
+    return run
+
+
+def bench_rotate_direction(setup, rng, n):
+    t = random_directions(rng, n)
+    cost = rng.uniform(-1, 1, n)
+    phi = rng.uniform(0, 2 * np.pi, n)
+
+    def run():
+        for i in range(n):
+            rotate_direction(t[i], cost[i], phi[i])
+    return run
+
+
+def bench_generate_point(setup, rng, n):
+    cryostat = setup['cryostat']
+
+    def run():
+        for i in range(n):
+            cryostat.generate_point()
+    return run
+
+
+#
+# batch versions, timed per element
+#
+def bench_get_cross_sections_batch(setup, rng, n):
+    phys = setup['physics']
+    e = random_energies(rng, n)
+    return lambda: phys.get_cross_sections(e)
+
+
+def bench_sample_compton_batch(setup, rng, n):
+    phys = setup['physics']
+    e = random_energies(rng, n)
+    de_max = np.where(rng.uniform(0, 1, n) < 0.5, 250., 1e5)
+    batch_rng = np.random.default_rng(1)
+    return lambda: phys.sample_compton(e, de_max, rng=batch_rng)
+
+
+def bench_cylinder_intersect_batch(setup, rng, n):
+    cryostat = setup['cryostat']
+    x0 = cryostat.generate_points(n, rng=rng)['x']
+    t = random_directions(rng, n)
+    return lambda: cryostat.intersect(x0, t)
+
+
+def bench_rotate_direction_batch(setup, rng, n):
+    t = random_directions(rng, n)
+    cost = rng.uniform(-1, 1, n)
+    phi = rng.uniform(0, 2 * np.pi, n)
+    return lambda: rotate_direction(t, cost, phi)
+
+
+def bench_generate_points_batch(setup, rng, n):
+    cryostat = setup['cryostat']
+    batch_rng = np.random.default_rng(1)
+    return lambda: cryostat.generate_points(n, rng=batch_rng)
+
+
+# name -> (benchmark, batch)
+benchmarks = {'do_compton': (bench_do_compton, False),
+              'get_sigma': (bench_get_sigma, False),
+              'get_att': (bench_get_att, False),
+              'particle.intersect': (bench_particle_intersect, False),
+              'generate_interaction_point': (bench_generate_interaction_point, False),
+              'update_particle': (bench_update_particle, False),
+              'rotate_direction': (bench_rotate_direction, False),
+              'cylinder.generate_point': (bench_generate_point, False),
+              'get_cross_sections[batch]': (bench_get_cross_sections_batch, True),
+              'sample_compton[batch]': (bench_sample_compton_batch, True),
+              'cylinder.intersect[batch]': (bench_cylinder_intersect_batch, True),
+              'rotate_direction[batch]': (bench_rotate_direction_batch, True),
+              'cylinder.generate_points[batch]': (bench_generate_points_batch, True)}
+
+
+def run_benchmarks(**kwargs):
+    """
+    Time the hot functions
+
+    :param kwargs:
+        names = benchmarks to run [Default = all, see benchmarks]
+        ncalls = number of calls per repeat of the scalar benchmarks [Default = 2000]
+        nbatch = array size of the batch benchmarks [Default = 100000]
+        repeat = number of repeats, the fastest is used [Default = 5]
+        seed = random seed of the inputs [Default = 12345]
+    :return: list of dictionaries with name, ns_per_call and calls_per_s
+    """
+    names = kwargs.pop('names', None)
+    ncalls = kwargs.pop('ncalls', 2000)
+    nbatch = kwargs.pop('nbatch', 100000)
+    repeat = kwargs.pop('repeat', 5)
+    seed = kwargs.pop('seed', 12345)
+    if names is None:
+        names = list(benchmarks)
+
+    setup = make_setup(seed)
+
+    results = []
+    for name in names:
+        bench, batch = benchmarks[name]
+        n = nbatch if batch else ncalls
+        run = bench(setup, np.random.default_rng(seed), n)
+
+        np.random.seed(seed)
+        run()  # warm up
+        best = np.inf
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - t0)
+
+        ns = best / n * 1e9
+        results.append({'name': name, 'batch': batch, 'n': n, 'ns_per_call': ns, 'calls_per_s': 1e9 / ns})
+        print('benchmark_micro:: %-34s %12.1f ns/%s %14.0f /s' % (name, ns, 'element' if batch else 'call', 1e9 / ns))
+
+    return results
+
+
+def compare(results, baseline, threshold=0.25):
+    """
+    Compare the timings with a baseline report
+
+    :param results: list of result dictionaries
+    :param baseline: baseline report (dictionary with 'results')
+    :param threshold: a benchmark regresses if it is more than threshold (fraction) slower than the baseline
+    :return: list of (name, ns_per_call, ns_baseline, ratio), list of regressed names
+    """
+    ref = {r['name']: r for r in baseline['results']}
+
+    table = []
+    regressions = []
+    for r in results:
+        if r['name'] not in ref:
+            continue
+        ratio = r['ns_per_call'] / ref[r['name']]['ns_per_call']
+        table.append((r['name'], r['ns_per_call'], ref[r['name']]['ns_per_call'], ratio))
+        if ratio > 1 + threshold:
+            regressions.append(r['name'])
+
+    return table, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FastMC micro-benchmarks of the transport hot functions')
+    parser.add_argument('--names', type=str, nargs='+', default=None, choices=list(benchmarks))
+    parser.add_argument('--ncalls', type=int, default=2000)
+    parser.add_argument('--nbatch', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=12345)
+    parser.add_argument('--output', type=str, default='micro_benchmark.json')
+    parser.add_argument('--baseline', type=str, default=None, help='report to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fail if a benchmark is more than this fraction slower than the baseline')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(names=args.names, ncalls=args.ncalls, nbatch=args.nbatch, repeat=args.repeat,
+                             seed=args.seed)
+
+    report = {'machine': machine_info(), 'settings': vars(args), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print('benchmark_micro:: report written to ', args.output)
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    table, regressions = compare(results, baseline, threshold=args.threshold)
+    for name, ns, ns_ref, ratio in table:
+        print('benchmark_micro:: %-34s %12.1f ns  baseline = %12.1f ns  ratio = %6.3f %s' %
+              (name, ns, ns_ref, ratio, '<-- REGRESSION' if name in regressions else ''))
+    if len(regressions) > 0:
+        print('benchmark_micro:: ERROR ', len(regressions), ' benchmarks more than ', args.threshold * 100,
+              '% slower than the baseline')
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../python/'))
+
+from physics import em_physics
+from cylinder import cylinder
+from tally import tally, replicate_rate
+import driver
+
+#
+# Convergence of randomized QMC against plain Monte Carlo for the fiducial_scatter rate.
+#
+# For every number of events N = 2^m the rate is estimated from R independent replicates with the normal
+# random generator and with scrambled Sobol points for the first interaction (see sampler.py). Both errors
+# are the spread of the replicates, so they are comparable: plain MC converges as N^-1/2, randomized QMC
+# faster for a smooth integrand. gain = (error_random / error_sobol)^2 is the factor in events (and, at equal
+# cost per event, in FOM) that QMC saves.
+#
+#   python benchmark_qmc.py --energy 1500 --nscatter 1 --log2n 14 16 18 --source_mode fiducial
+#
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FastMC randomized QMC convergence benchmark')
+    parser.add_argument('--energy', type=float, default=1500.)
+    parser.add_argument('--edep_max', type=float, default=250.)
+    parser.add_argument('--nscatter', type=int, default=1)
+    parser.add_argument('--r_cryostat', type=float, default=65.)
+    parser.add_argument('--z_cryostat', type=float, default=150.)
+    parser.add_argument('--r_fiducial', type=float, default=57.)
+    parser.add_argument('--z_fiducial', type=float, default=134.)
+    parser.add_argument('--source_mode', type=str, default='isotropic', choices=['isotropic', 'fiducial'])
+    parser.add_argument('--log2n', type=int, nargs='+', default=[12, 14, 16], help='events per replicate = 2^m')
+    parser.add_argument('--replicates', type=int, default=16)
+    parser.add_argument('--nworkers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=12345)
+    parser.add_argument('--output', type=str, default=None, help='json file with the results')
+    args = parser.parse_args(argv)
+
+    em = em_physics()
+    cryostat = cylinder(R=args.r_cryostat, h=args.z_cryostat)
+    fiducial = cylinder(R=args.r_fiducial, h=args.z_fiducial)
+    t = tally(fiducial=fiducial, nscatter=[args.nscatter], edep_max=args.edep_max, emax=args.energy)
+
+    results = []
+    for m in args.log2n:
+        row = {'nevents': 2 ** m, 'replicates': args.replicates}
+        for sampler in ['random', 'sobol']:
+            t0 = time.time()
+            tallies = driver.generate_replicates(2 ** m, args.replicates, tally=t, sampler=sampler, seed=args.seed,
+                                                 energy=args.energy, edep_max=args.edep_max, fiducial=fiducial,
+                                                 vrt='fiducial_scatter', nscatter_max=args.nscatter, physics=em,
+                                                 geometry=cryostat, source_mode=args.source_mode, engine='numpy',
+                                                 nworkers=args.nworkers)
+            rate, err = replicate_rate(tallies, args.nscatter)
+            row[sampler] = {'rate': rate, 'error': err, 'wall_time': time.time() - t0}
+        row['gain'] = (row['random']['error'] / row['sobol']['error']) ** 2 if row['sobol']['error'] > 0 else None
+        results.append(row)
+        # no spread of the Sobol replicates (e.g. no events pass): no gain
+        gain = 'n/a' if row['gain'] is None else '%.3g' % row['gain']
+        print('benchmark_qmc:: N = 2^%-2i  random %.5g +- %.2g  sobol %.5g +- %.2g  gain = %s' %
+              (m, row['random']['rate'], row['random']['error'], row['sobol']['rate'], row['sobol']['error'],
+               gain))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=1)
+        print('benchmark_qmc:: results written to ', args.output)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
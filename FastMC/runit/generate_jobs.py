@@ -1,7 +1,84 @@
 import pandas as pd
 import os,sys
+import argparse
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def write_script(settings):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../python/'))
+
+from catalog import job_catalog, catalog_file
+
+#
+# Two backends run the jobs of a jobs spreadsheet:
+#
+#   qsub  - write a shell script per job and submit it to the batch queue (the original workflow)
+#   local - run the jobs on this machine with a bounded pool of MC_run.py processes. The longest jobs
+#           (estimated from nevents and the mode) start first, so that the pool does not end on one long
+#           job. The output of every job goes to logs/job<id>.log, and the status and exit code of every
+#           job are stored in the catalog.
+#
+# The local backend skips jobs whose output file already exists, unless --force is given; qsub submits
+# every job, as before. Jobs are started with --resume, so an interrupted job continues from its checkpoint.
+#
+
+# directory of MC_run.py
+local_dir = os.path.dirname(os.path.abspath(__file__))
+# relative cost per event of the simulation modes, only used to order the jobs of the local pool
+cost_per_event = {'None': 1.0, 'fiducial_scatter': 1.5}
+# output files written by MC_run.py
+output_extensions = ['.npz', '.csv', '_tally.npz']
+
+
+def job_arguments(settings, catalog=catalog_file):
+    """
+    Command line arguments of MC_run.py for a job
+
+    :param settings: row of the jobs spreadsheet
+    :param catalog: catalog database the job reports to
+    :return: list of arguments
+    """
+    return ["--nevents="+str(int(settings['nevents'])),
+            "--energy="+str(settings['energy']),
+            "--vrt="+str(settings['vrt']),
+            "--edep_max="+str(settings['edep_max']),
+            "--nscatter="+str(int(settings['nscatter'])),
+            "--ran_seed="+str(int(settings['ran_seed'])),
+            "--r_cryostat="+str(settings['r_cryostat']),
+            "--z_cryostat="+str(settings['z_cryostat']),
+            "--r_fiducial="+str(settings['r_fiducial']),
+            "--z_fiducial="+str(settings['z_fiducial']),
+            "--output="+str(settings['output']),
+            "--job_id="+str(int(settings['job_id'])),
+            "--catalog="+str(catalog),
+            "--resume"]
+
+
+def estimated_cost(settings):
+    """
+    Relative cost of a job: number of events times the cost per event of its mode
+
+    :param settings: row of the jobs spreadsheet
+    :return: float
+    """
+    return float(settings['nevents']) * cost_per_event.get(str(settings['vrt']), 1.0)
+
+
+def output_exists(settings, run_dir=local_dir):
+    """
+    Check if a job already wrote its output. A job that left a checkpoint was interrupted and is not done
+
+    :param settings: row of the jobs spreadsheet
+    :param run_dir: directory the job runs in (relative output names are relative to it)
+    :return: True if one of the output files exists
+    """
+    output = os.path.join(run_dir, str(settings['output']))
+    if os.path.exists(output + '_checkpoint.npz'):
+        return False
+    return any(os.path.exists(output + ext) for ext in output_extensions)
+
+
+def write_script(settings, catalog=catalog_file):
     ## OLKES SET THIS CORRECTLY
     environment_setup = ". ~/nb_venv/bin/activate"
 
@@ -40,17 +117,7 @@ def write_script(settings):
 
     #fout.write(environment_setup+" \n")
     fout.write("cd " + run_dir + " \n")
-    fout.write("python MC_run.py --nevents="+str(settings['nevents']))
-    fout.write(" --energy="+str(settings['energy']))
-    fout.write(" --vrt="+str(settings['vrt']))
-    fout.write(" --edep_max="+str(settings['edep_max']))
-    fout.write(" --nscatter="+str(int(settings['nscatter'])))
-    fout.write(" --ran_seed="+str(int(settings['ran_seed'])))
-    fout.write(" --r_cryostat="+str(settings['r_cryostat']))
-    fout.write(" --z_cryostat="+str(settings['z_cryostat']))
-    fout.write(" --r_fiducial="+str(settings['r_fiducial']))
-    fout.write(" --z_fiducial="+str(settings['z_fiducial']))
-    fout.write(" --output="+str(settings['output']))
+    fout.write("python MC_run.py " + " ".join(job_arguments(settings, catalog)))
 
     ##fout.write(" --fiducial_volume="+str(settings['fiducial_volume']))
 
@@ -70,16 +137,102 @@ def write_script(settings):
 
     os.system('qsub -q generic7 -e '+log_dir+' -o '+log_dir+' '+scriptfile)
 
+
+def run_local_job(settings, **kwargs):
+    """
+    Run one job in a subprocess and record its status in the catalog
+
+    :param settings: row of the jobs spreadsheet
+    :param kwargs:
+        run_dir = working directory of the job [Default = directory of this script]
+        log_dir = directory of the log files [Default = run_dir/logs]
+        catalog = catalog database [Default = catalog_file]
+    :return: job_id, exit code, wall time (s)
+    """
+    run_dir = kwargs.pop('run_dir', local_dir)
+    log_dir = kwargs.pop('log_dir', os.path.join(run_dir, 'logs'))
+    catalog = kwargs.pop('catalog', catalog_file)
+
+    job_id = int(settings['job_id'])
+    cmd = [sys.executable, os.path.join(local_dir, 'MC_run.py')] + job_arguments(settings, catalog)
+
+    with job_catalog(catalog) as cat:
+        cat.set_status(job_id, 'running')
+
+    t0 = time.time()
+    with open(os.path.join(log_dir, 'job'+str(job_id)+'.log'), 'w') as log:
+        log.write(' '.join(cmd) + '\n')
+        log.flush()
+        try:
+            exit_code = subprocess.run(cmd, cwd=run_dir, stdout=log, stderr=subprocess.STDOUT).returncode
+        except OSError as e:
+            log.write('generate_jobs::run_local_job ERROR ' + str(e) + '\n')
+            exit_code = -1
+    dt = time.time() - t0
+
+    with job_catalog(catalog) as cat:
+        cat.set_status(job_id, 'done' if exit_code == 0 else 'failed', exit_code=exit_code)
+
+    return job_id, exit_code, dt
+
+
+def run_local(df, **kwargs):
+    """
+    Run jobs on this machine with a bounded pool of processes, longest job first
+
+    :param df: pandas DataFrame with the jobs
+    :param kwargs:
+        nworkers = number of jobs running at the same time [Default = number of cpus]
+        run_dir, log_dir, catalog = see run_local_job
+    :return: dictionary job_id -> exit code
+    """
+    nworkers = kwargs.pop('nworkers', None)
+    if nworkers is None:
+        nworkers = os.cpu_count()
+    run_dir = kwargs.pop('run_dir', local_dir)
+    log_dir = kwargs.pop('log_dir', os.path.join(run_dir, 'logs'))
+    catalog = kwargs.pop('catalog', catalog_file)
+    os.makedirs(log_dir, exist_ok=True)
+
+    rows = [row for _, row in df.iterrows()]
+    rows.sort(key=estimated_cost, reverse=True)
+
+    print('generate_jobs:: run ', len(rows), ' jobs on ', nworkers, ' local workers, logs in ', log_dir)
+    exit_codes = {}
+    # the jobs are subprocesses: the threads only wait for them
+    with ThreadPoolExecutor(max_workers=nworkers) as pool:
+        futures = [pool.submit(run_local_job, row, run_dir=run_dir, log_dir=log_dir, catalog=catalog)
+                   for row in rows]
+        for future in as_completed(futures):
+            job_id, exit_code, dt = future.result()
+            exit_codes[job_id] = exit_code
+            print('generate_jobs:: job ', job_id, ' finished with exit code ', exit_code, ' in %.1f s' % dt,
+                  ' (', len(exit_codes), '/', len(rows), ')')
+
+    failed = [k for k, v in exit_codes.items() if v != 0]
+    if len(failed) > 0:
+        print('generate_jobs::run_local ERROR ', len(failed), ' jobs failed: ', sorted(failed))
+
+    return exit_codes
+
+
 #
 # main function
 #
-def main():
-
-    if sys.argv[1] == '--i':
-        job_file = sys.argv[2]
-    else:
-        job_file = 'jobs.xlsx'
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FastMC job submission')
+    parser.add_argument('--i', dest='job_file', type=str, default='jobs.xlsx', help='jobs spreadsheet')
+    parser.add_argument('--backend', type=str, default='qsub', choices=['qsub', 'local'])
+    parser.add_argument('--nworkers', type=int, default=None, help='local backend: jobs running at the same time '
+                                                                   '(default: number of cpus)')
+    parser.add_argument('--run_dir', type=str, default=local_dir, help='local backend: working directory')
+    parser.add_argument('--log_dir', type=str, default=None, help='local backend: log directory '
+                                                                  '(default: run_dir/logs)')
+    parser.add_argument('--catalog', type=str, default=catalog_file)
+    parser.add_argument('--force', action='store_true', help='local backend: also run jobs whose output exists')
+    args = parser.parse_args(argv)
 
+    job_file = args.job_file
     print('generate_jobs:: reading settings from ',job_file)
     if not os.path.exists(job_file):
         print('generate_jobs:: ERROR job_file =',job_file,' does not exist')
@@ -90,11 +243,39 @@ def main():
     # read xls fiel with job parameters
     #
     df = pd.read_excel(job_file)
+    #
+    # register the jobs in the catalog
+    #
+    with job_catalog(args.catalog) as cat:
+        cat.add_jobs(df)
+        #
+        # local backend: skip the jobs that are done. qsub submits every job of the list, as before
+        #
+        if (args.backend == 'local') and (not args.force):
+            done = df.apply(output_exists, axis=1, run_dir=args.run_dir)
+            finished = set(cat.select(['job_id'], status='done')['job_id'])
+            for job_id in df.loc[done, 'job_id']:
+                print('generate_jobs:: skip job ', int(job_id), ', output exists')
+                # a finished job keeps its status
+                if int(job_id) not in finished:
+                    cat.set_status(job_id, 'skipped')
+            df = df.loc[~done]
+
+    if args.backend == 'local':
+        exit_codes = run_local(df, nworkers=args.nworkers, run_dir=args.run_dir,
+                               log_dir=args.log_dir if args.log_dir is not None else os.path.join(args.run_dir, 'logs'),
+                               catalog=args.catalog)
+        return 1 if any(v != 0 for v in exit_codes.values()) else 0
+
     #
     # write script file and submit to queue
     #
-    for index,row in df.iterrows():
-        write_script(row)
+    with job_catalog(args.catalog) as cat:
+        for index,row in df.iterrows():
+            write_script(row, catalog=args.catalog)
+            cat.set_status(row['job_id'], 'submitted')
+
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
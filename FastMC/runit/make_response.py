@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../python/'))
+
+import numpy as np
+
+from physics import em_physics
+from cylinder import cylinder
+from response import response_matrix, load_response, fiducial_sizes
+from source import line_source
+
+#
+# Generate the detector response matrix on a grid of primary energies, and fold line sources through it.
+#
+#   python make_response.py --nevents 1000000 --output response.npz
+#   python make_response.py --output response.npz --resume            (continue an interrupted generation)
+#   python make_response.py --output response.npz --fold 238U 232Th   (fold only, --drop_outside to leave out
+#                                                                      lines outside the energy grid)
+#
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FastMC detector response matrix')
+    parser.add_argument('--emin', type=float, default=50.)
+    parser.add_argument('--emax', type=float, default=3000.)
+    parser.add_argument('--estep', type=float, default=10.)
+    parser.add_argument('--nevents', type=int, default=1000000, help='primaries per energy (and nscatter)')
+    parser.add_argument('--vrt', type=str, default='fiducial_scatter')
+    parser.add_argument('--edep_max', type=float, default=250.)
+    parser.add_argument('--nbins', type=int, default=250)
+    parser.add_argument('--nscatter', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--fiducial', type=str, nargs='+', default=list(fiducial_sizes), choices=list(fiducial_sizes))
+    parser.add_argument('--r_cryostat', type=float, default=65.)
+    parser.add_argument('--z_cryostat', type=float, default=150.)
+    parser.add_argument('--engine', type=str, default='numba', choices=['numpy', 'numba'])
+    parser.add_argument('--nworkers', type=int, default=1)
+    parser.add_argument('--ran_seed', type=int, default=None)
+    parser.add_argument('--output', type=str, default='response.npz')
+    parser.add_argument('--resume', action='store_true', help='continue the generation of an existing matrix')
+    parser.add_argument('--fold', type=str, nargs='+', default=None,
+                        help='only fold the lines of these chains or nuclides through an existing matrix')
+    parser.add_argument('--drop_outside', action='store_true',
+                        help='fold: leave out the lines outside the energy grid of the matrix')
+    args = parser.parse_args(argv)
+
+    if args.fold is not None:
+        m = load_response(args.output)
+        for name in args.fold:
+            src = line_source(chain=name, nuclide=name)
+            for fid in m.names:
+                for ns in m.nscatter:
+                    rate, err = m.fold_rate(src, fiducial=fid, nscatter=ns,
+                                             drop_outside=args.drop_outside)
+                    print('make_response:: %-8s %-14s nscatter = %i  rate = %.4g +- %.2g per decay' %
+                          (name, fid, ns, rate, err))
+        return 0
+
+    if args.resume and os.path.exists(args.output):
+        m = load_response(args.output)
+        print('make_response:: resume ', args.output, ', ', np.count_nonzero(m.nevent), ' of ', m.nevent.size,
+              ' elements done')
+    else:
+        vrt = None if args.vrt == 'None' else args.vrt
+        m = response_matrix(energies=np.arange(args.emin, args.emax + 0.5 * args.estep, args.estep),
+                            fiducials={k: fiducial_sizes[k] for k in args.fiducial}, nscatter=args.nscatter,
+                            edep_max=args.edep_max, nbins=args.nbins, vrt=vrt)
+
+    m.generate(args.nevents, physics=em_physics(), geometry=cylinder(R=args.r_cryostat, h=args.z_cryostat),
+               engine=args.engine, nworkers=args.nworkers, seed=args.ran_seed, output=args.output)
+    m.save(args.output)
+    print('make_response:: response matrix written to ', args.output, ' in ', m.wall_time.sum(), ' s')
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../python/'))
+
+import pandas as pd
+
+from transport import photon_bank
+from eventio import event_columns
+import MC_run
+
+#
+# Replay single events of a run made with MC_run.py --rng counter.
+#
+# With the counter-based generator (see counter_rng.py) the random numbers of event i only depend on the
+# master seed and i, so the event is regenerated on its own, without running the events before it, and with
+# the same result as in the full run. The run settings are given as for MC_run.py, with the master seed that
+# MC_run.py prints:
+#
+#   python replay_event.py --event 123456 --debug --ran_seed 42 --vrt fiducial_scatter --energy 2615
+#
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FastMC single event replay', add_help=False)
+    parser.add_argument('--event', type=int, nargs='+', required=True, help='event numbers to replay')
+    parser.add_argument('--debug', action='store_true', help='print the photons after every step')
+    args, run_argv = parser.parse_known_args(argv)
+    run_args = MC_run.parse_arguments(run_argv)
+
+    if run_args.ran_seed is None:
+        print('replay_event:: ERROR give the master seed of the run with --ran_seed')
+        return 1
+    if run_args.engine != 'numpy':
+        print('replay_event:: ERROR the counter-based generator needs engine numpy')
+        return 1
+
+    settings = MC_run.transport_settings(run_args)
+    settings.pop('engine')
+    bank = photon_bank(counter_seed=run_args.ran_seed, debug=args.debug, **settings)
+
+    columns = event_columns(primary=settings['source'] is not None)
+    for event in args.event:
+        records = bank.run(1, first_event=event)
+        print('replay_event:: event ', event, ' with ', len(records), ' tracks')
+        print(pd.DataFrame(records, columns=columns).to_string(index=False))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules are flat files in python/, the run scripts in runit/
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '../runit/'))
+sys.path.insert(0, os.path.join(here, '../python/'))
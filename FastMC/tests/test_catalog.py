@@ -0,0 +1,50 @@
+import os
+
+import pandas as pd
+
+from catalog import job_catalog
+
+
+def job_list(energy=1000.):
+    return pd.DataFrame({'job_id': [1, 2, 3], 'energy': [energy, 1500., 2000.], 'type': 'sim',
+                         'vrt': 'fiducial_scatter', 'nevents': [100, 200, 300], 'family_number': [1, 2, 3],
+                         'output': ['a', 'b', 'c']})
+
+
+def test_registering_again_keeps_the_results(tmp_path):
+    with job_catalog(str(tmp_path / 'jobs.sqlite')) as cat:
+        cat.add_jobs(job_list())
+        cat.update_result(1, nevents=100, wall_time=2.5, total_weight=7.0)
+        cat.set_status(2, 'failed', exit_code=1)
+
+        # generate_jobs.py registers its job list on every invocation, possibly with changed settings
+        cat.add_jobs(job_list(energy=1250.))
+
+        df = cat.select().set_index('job_id')
+        assert cat.count() == 3
+        assert df.loc[1, 'energy'] == 1250.
+        assert df.loc[1, 'status'] == 'done'
+        assert (df.loc[1, 'nevents_done'], df.loc[1, 'wall_time'], df.loc[1, 'total_weight']) == (100, 2.5, 7.0)
+        assert (df.loc[2, 'status'], df.loc[2, 'exit_code']) == ('failed', 1)
+        assert df.loc[3, 'status'] == 'created'
+
+
+def test_spreadsheet_import_into_existing_catalog(tmp_path):
+    xlsx = str(tmp_path / 'jobs_master.xlsx')
+    job_list().to_excel(xlsx, index=False)
+
+    with job_catalog(str(tmp_path / 'jobs.sqlite')) as cat:
+        # catalog made first by another tool
+        cat.add_jobs(job_list().iloc[:1])
+        cat.update_result(1, nevents=100)
+        assert cat.import_xlsx(xlsx, if_changed=True) == 3
+        assert cat.import_xlsx(xlsx, if_changed=True) == 0
+
+        # a changed spreadsheet is imported again
+        job_list(energy=500.).to_excel(xlsx, index=False)
+        os.utime(xlsx, (os.path.getatime(xlsx), os.path.getmtime(xlsx) + 10))
+        assert cat.import_xlsx(xlsx, if_changed=True) == 3
+
+        assert cat.count() == 3
+        assert cat.select(['output'], energy=500., family_number=1)['output'].tolist() == ['a']
+        assert cat.select(['status'], job_id=1)['status'].tolist() == ['done']
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from eventio import read_events
+from tally import load_tally
+import driver
+import MC_run
+
+
+class interrupt(Exception):
+    pass
+
+
+def run(output, *extra):
+    MC_run.main(['--nevents', '3000', '--energy', '1500', '--vrt', 'fiducial_scatter', '--edep_max', '250',
+                 '--ran_seed', '11', '--nworkers', '1', '--chunk_size', '500', '--tally', '--output', str(output)]
+                + list(extra))
+
+
+@pytest.mark.parametrize('rng', ['sequential', 'counter'])
+def test_resume_equals_uninterrupted_run(tmp_path, monkeypatch, rng):
+    run(tmp_path / 'full', '--rng', rng, '--checkpoint_interval', '0')
+
+    #
+    # stop the run after three pieces, with a checkpoint after every piece
+    #
+    generate_chunks = driver.generate_chunks
+
+    def stopped(*args, **kwargs):
+        for i, result in enumerate(generate_chunks(*args, **kwargs)):
+            if i == 3:
+                raise interrupt()
+            yield result
+
+    monkeypatch.setattr(driver, 'generate_chunks', stopped)
+    with pytest.raises(interrupt):
+        run(tmp_path / 'part', '--rng', rng, '--checkpoint_interval', '1e-9')
+    assert (tmp_path / 'part_checkpoint.npz').exists()
+    monkeypatch.setattr(driver, 'generate_chunks', generate_chunks)
+
+    run(tmp_path / 'part', '--rng', rng, '--checkpoint_interval', '1e-9', '--resume')
+    assert not (tmp_path / 'part_checkpoint.npz').exists()
+
+    full = read_events(str(tmp_path / 'full.npz'))
+    part = read_events(str(tmp_path / 'part.npz'))
+    assert len(full) == 3000
+    assert full.equals(part)
+
+    t_full = load_tally(str(tmp_path / 'full_tally.npz'))
+    t_part = load_tally(str(tmp_path / 'part_tally.npz'))
+    assert t_part.nevent == t_full.nevent
+    for name in ['sum_w', 'sum_w2', 'n_pass', 'hist_w', 'mean_pass', 'm2_pass']:
+        assert np.allclose(getattr(t_part, name), getattr(t_full, name), rtol=1e-12, atol=0), name
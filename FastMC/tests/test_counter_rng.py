@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from counter_rng import philox, philox_stream
+from physics import em_physics
+from cylinder import cylinder
+from weight_window import weight_window
+from transport import photon_bank
+import driver
+
+# known-answer vectors of Philox4x32-10 from Random123 (kat_vectors): key, counter, output
+philox_kat = [((0x00000000, 0x00000000), (0x00000000, 0x00000000, 0x00000000, 0x00000000),
+               (0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8)),
+              ((0xffffffff, 0xffffffff), (0xffffffff, 0xffffffff, 0xffffffff, 0xffffffff),
+               (0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd)),
+              ((0xa4093822, 0x299f31d0), (0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344),
+               (0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1))]
+
+
+@pytest.fixture(scope='module')
+def settings():
+    return dict(energy=2615., physics=em_physics(), geometry=cylinder(R=65., h=150.),
+                fiducial=cylinder(R=57., h=134.), vrt='fiducial_scatter', nscatter_max=2, edep_max=250.,
+                weight_window=weight_window(lower=[1e-4, 1e-5], ratio=5., max_split=4), counter_seed=42)
+
+
+@pytest.mark.parametrize('key, counter, expected', philox_kat)
+def test_philox_known_answers(key, counter, expected):
+    out = philox(key, *[np.array([c]) for c in counter])
+    assert [int(x[0]) for x in out] == list(expected)
+
+
+def test_stream_is_independent_of_the_selection():
+    stream = philox_stream(7)
+    event = np.arange(10)
+    track = np.zeros(10, dtype=np.int64)
+
+    ndraw = np.zeros(10, dtype=np.int64)
+    full = [stream.select(event, track, ndraw, np.arange(10)).uniform(0, 1, 10) for _ in range(3)]
+    ndraw = np.zeros(10, dtype=np.int64)
+    odd = [stream.select(event, track, ndraw, np.arange(1, 10, 2)).uniform(0, 1, 5) for _ in range(3)]
+
+    for a, b in zip(full, odd):
+        assert np.array_equal(a[1::2], b)
+    assert np.array_equal(ndraw, np.tile([0, 3], 5))
+
+
+def test_counter_run_does_not_depend_on_sharding(settings):
+    config = dict(settings, engine='numpy')
+    a = np.concatenate(list(driver.generate_chunks(2000, nworkers=1, seed=1, chunk_size=2000, **config)))
+    b = np.concatenate(list(driver.generate_chunks(2000, nworkers=1, seed=9, chunk_size=333, **config)))
+
+    assert np.array_equal(a, b, equal_nan=True)
+
+
+def test_single_event_replay(settings):
+    bank = photon_bank(**settings)
+    records = bank.run(500)
+
+    # events with weight-window splits and plain events
+    event, count = np.unique(records[:, 0], return_counts=True)
+    replay = list(event[count > 1][:3].astype(int)) + [0, 499]
+    assert count.max() > 1
+    for i in replay:
+        assert np.array_equal(bank.run(1, first_event=i), records[records[:, 0] == i], equal_nan=True)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+import driver
+from cylinder import cylinder
+from eventio import event_columns
+from particle import particle
+from physics import em_physics
+from tally import tally
+
+#
+# The three transport engines (photon_bank, the numba kernel and the per-event particle class) draw their random
+# numbers differently, so they only agree statistically: the rates are compared within a few standard deviations
+#
+
+
+@pytest.fixture(scope='module')
+def setup():
+    return dict(energy=1000., physics=em_physics(), geometry=cylinder(R=65., h=150.),
+                fiducial=cylinder(R=57., h=134.), vrt='fiducial_scatter', edep_max=250.)
+
+
+def particle_records(nevent, **settings):
+    """
+    Records of nevent photons propagated one by one with the particle class, in the layout of
+    eventio.event_columns()
+    """
+    records = np.full((nevent, len(event_columns())), np.nan)
+    for i in range(nevent):
+        p = particle(type='gamma', **settings)
+        p.generate()
+        p.propagate()
+        records[i, :4] = [i, p.nscatter, p.weight, p.edep]
+        records[i, 4:7] = p.x0start
+        for k, x in enumerate(p.xint[:4]):
+            records[i, 7 + 4 * k:10 + 4 * k] = x[0]
+            records[i, 10 + 4 * k] = x[1]
+
+    return records
+
+
+@pytest.mark.parametrize('nscatter', [1, 2])
+def test_engines_agree(setup, nscatter):
+    settings = dict(setup, nscatter_max=nscatter)
+    tally_settings = dict(fiducial=setup['fiducial'], nscatter=[nscatter], edep_max=250., emax=500., nbins=50)
+
+    rates = {}
+    for engine in ['numpy', 'numba']:
+        t = driver.generate_tally(20000, tally=tally(**tally_settings), seed=1, nworkers=2, engine=engine,
+                                  **settings)
+        rates[engine] = t.rate(nscatter)
+
+    np.random.seed(2)
+    t = tally(**tally_settings)
+    t.fill(particle_records(2000, **settings))
+    rates['particle'] = t.rate(nscatter)
+
+    mean, err = rates['numpy']
+    assert mean > 0
+    for engine in ['numba', 'particle']:
+        m, e = rates[engine]
+        assert abs(m - mean) < 4 * np.hypot(e, err), engine
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from response import response_matrix, load_response
+
+
+@pytest.fixture
+def matrix():
+    m = response_matrix(energies=[100., 200., 400.], fiducials={'Normal': (57., 134.)}, nscatter=[1, 2],
+                        nbins=5)
+    rng = np.random.default_rng(4)
+    m.r[...] = rng.uniform(0, 1, m.r.shape)
+    m.r_var[...] = rng.uniform(0, 1e-3, m.r.shape)
+    m.rate[...] = m.r.sum(axis=-1)
+    m.rate_var[...] = m.r_var.sum(axis=-1)
+    m.nevent[...] = 1000
+
+    return m
+
+
+def lines(energy, intensity=100., nuclide='A', chain='X'):
+    return pd.DataFrame({'nuclide': nuclide, 'chain': chain, 'energy': energy, 'intensity': intensity})
+
+
+def test_fold_interpolates_between_grid_energies(matrix):
+    edges, s, err = matrix.fold(lines([100., 300.], [50., 20.]), nscatter=2)
+    expected = 0.5 * matrix.r[0, 1, 0] + 0.2 * (0.5 * matrix.r[0, 1, 1] + 0.5 * matrix.r[0, 1, 2])
+
+    assert np.allclose(s, expected)
+    assert np.allclose(err ** 2, 0.25 * matrix.r_var[0, 1, 0] + 0.01 * (matrix.r_var[0, 1, 1] +
+                                                                       matrix.r_var[0, 1, 2]))
+    rate, rate_err = matrix.fold_rate(lines([100., 300.], [50., 20.]), nscatter=2)
+    assert np.isclose(rate, expected.sum())
+
+
+def test_fold_with_activities(matrix):
+    mix = pd.concat([lines([150.], nuclide='A', chain='X'), lines([150.], nuclide='B', chain='Y')])
+    rate = matrix.fold_rate(mix, activity={'A': 2.0, 'Y': 3.0})[0]
+
+    assert np.isclose(rate, 5.0 * 0.5 * (matrix.rate[0, 0, 0] + matrix.rate[0, 0, 1]))
+
+
+def test_invalid_folds_raise(matrix):
+    with pytest.raises(ValueError):
+        matrix.fold(lines([50., 300.]))
+    rate = matrix.fold_rate(lines([50., 300.]), drop_outside=True)[0]
+    assert np.isclose(rate, matrix.fold_rate(lines([300.]))[0])
+
+    matrix.nevent[0, 0, 2] = 0
+    with pytest.raises(ValueError):
+        matrix.fold_rate(lines([300.]))
+    # the empty element has no weight for a line on the grid below it
+    matrix.fold_rate(lines([200.]))
+
+    with pytest.raises(ValueError):
+        response_matrix(energies=[100., 100., 200.])
+
+
+def test_save_and_load(matrix, tmp_path):
+    fn = str(tmp_path / 'response.npz')
+    matrix.save(fn)
+    m = load_response(fn)
+
+    for name in ['energies', 'edges', 'r', 'r_var', 'rate', 'rate_var', 'nevent']:
+        assert np.array_equal(getattr(m, name), getattr(matrix, name)), name
+    assert np.allclose(m.fold(lines([250.]))[1], matrix.fold(lines([250.]))[1])
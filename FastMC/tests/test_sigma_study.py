@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from catalog import job_catalog
+from Sigma_study import energy
+import MC_run
+
+
+def test_total_weight_of_csv_and_npz_files(tmp_path, monkeypatch):
+    # no jobs_master.xlsx of the user
+    monkeypatch.setenv('HOME', str(tmp_path))
+    common = ['--nevents', '5000', '--energy', '1000', '--vrt', 'fiducial_scatter', '--edep_max', '250',
+              '--ran_seed', '3', '--nworkers', '1', '--checkpoint_interval', '0']
+    MC_run.main(common + ['--format', 'csv', '--output', str(tmp_path / 'csv')])
+    MC_run.main(common + ['--format', 'npz', '--output', str(tmp_path / 'npz')])
+
+    # the two files of the run as members 1 and 2 of a family
+    fn = str(tmp_path / 'jobs.sqlite')
+    with job_catalog(fn) as cat:
+        cat.add_jobs(pd.DataFrame({'job_id': [1, 2], 'energy': 1000., 'type': 'sim', 'vrt': 'fiducial_scatter',
+                                   'edep_max': 250., 'size_fiducial': 'Normal ', 'nevents': 5000,
+                                   'family_number': [1, 2], 'output': [str(tmp_path / 'csv'), str(tmp_path / 'npz')]}))
+    tweight = energy(energy=1000, edep_max=250, catalog=fn).total_weight(5000, famsize=2)[0]
+
+    assert tweight[0] > 0
+    assert np.isclose(tweight[0], tweight[1], rtol=1e-6)
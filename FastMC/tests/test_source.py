@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from source import alias_table
+
+
+@pytest.mark.parametrize('weights', [[1.], [1., 1., 1., 1.], [0.7, 0.2, 0.1], [5., 0., 1e-3, 2., 0., 30.],
+                                     list(np.random.default_rng(1).exponential(1., 200))])
+def test_alias_table_is_exact(weights):
+    table = alias_table(weights)
+    p = np.asarray(weights) / np.sum(weights)
+    n = len(p)
+
+    # probability of outcome j: (column j kept + all columns aliased to j) / n
+    exact = table.prob.copy()
+    np.add.at(exact, table.alias, 1.0 - table.prob)
+    assert np.allclose(exact / n, p, rtol=0, atol=1e-12)
+    assert np.all(table.prob[p == 0] == 0)
+
+
+def test_alias_table_sampling():
+    weights = [0.5, 0.3, 0.15, 0.05]
+    n = 400000
+    i = alias_table(weights).sample(n, rng=np.random.default_rng(2))
+    freq = np.bincount(i, minlength=4) / n
+
+    assert np.all(np.abs(freq - weights) < 5 * np.sqrt(np.asarray(weights) / n))
+
+
+@pytest.mark.parametrize('weights', [[], [-1., 2.], [0., 0.]])
+def test_alias_table_rejects_invalid_weights(weights):
+    with pytest.raises(ValueError):
+        alias_table(weights)
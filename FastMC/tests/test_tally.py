@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cylinder import cylinder
+from tally import tally
+from eventio import event_columns
+
+
+def make_records(n, seed=0, split=False):
+    """
+    Random records with scatters inside and outside the fiducial volume. With split, some events have
+    several records (weight-window copies)
+    """
+    rng = np.random.default_rng(seed)
+    records = np.full((n, len(event_columns())), np.nan)
+    records[:, 0] = np.sort(rng.integers(0, n // 2, n)) if split else np.arange(n)
+    records[:, 1] = rng.integers(0, 3, n)
+    records[:, 2] = rng.exponential(1e-2, n)
+    records[:, 3] = rng.uniform(0, 500, n)
+    for k in range(2):
+        records[:, 7 + 4 * k:10 + 4 * k] = rng.uniform(-70, 70, (n, 3))
+        records[:, 10 + 4 * k] = rng.uniform(0, 250, n)
+
+    return records
+
+
+@pytest.mark.parametrize('split', [False, True])
+def test_merge_equals_single_fill(split):
+    settings = dict(fiducial=cylinder(R=57., h=134.), nscatter=[1, 2], edep_max=250., emax=500., nbins=50)
+    records = make_records(4000, split=split)
+    # pieces that do not cut through an event
+    cuts = [0] + [int(np.searchsorted(records[:, 0], records[i, 0])) for i in (700, 2900)] + [len(records)]
+
+    single = tally(**settings)
+    single.fill(records)
+    merged = tally(**settings)
+    for a, b in zip(cuts[:-1], cuts[1:]):
+        t = merged.empty_copy()
+        t.fill(records[a:b])
+        merged.merge(t)
+
+    assert merged.nevent == single.nevent
+    for name in ['sum_w', 'sum_w2', 'n_pass', 'sum_w_pass', 'sum_w2_pass', 'hist_w', 'hist_w2', 'mean_pass',
+                 'm2_pass']:
+        assert np.allclose(getattr(merged, name), getattr(single, name), rtol=1e-12, atol=0), name
+    for ns in settings['nscatter']:
+        assert np.allclose(merged.rate(ns), single.rate(ns), rtol=1e-12)
+
+
+def test_moments_match_two_pass_variance():
+    settings = dict(fiducial=cylinder(R=57., h=134.), nscatter=[1], edep_max=250., emax=500., nbins=50)
+    records = make_records(3000, seed=3)
+    t = tally(**settings)
+    for piece in np.array_split(records, 7):
+        t.fill(piece)
+
+    # per-event weight times the pass flag, from the cut flow of a single fill
+    passed = tally(**settings)
+    x = np.zeros(len(records))
+    for i in range(len(records)):
+        passed.reset()
+        passed.fill(records[i:i + 1])
+        x[i] = passed.sum_w_pass[0]
+
+    rate, err = t.rate(1)
+    assert np.isclose(rate, x.mean(), rtol=1e-12)
+    assert np.isclose(err, x.std(ddof=1) / np.sqrt(len(x)), rtol=1e-10)
+
+
+def test_fill_without_primary_energy_leaves_tally_unchanged():
+    t = tally(nscatter=[1], emax=500., nbins=50)
+    t.set_lines(pd.DataFrame({'nuclide': ['208Tl'], 'chain': ['232Th'], 'energy': [2614.5], 'intensity': [99.8]}))
+
+    with pytest.raises(ValueError):
+        t.fill(make_records(100))
+    assert (t.nevent, t.sum_w, t.sum_w2) == (0, 0.0, 0.0)
+    assert not t.n_line.any()
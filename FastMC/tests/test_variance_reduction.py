@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+import driver
+from cylinder import cylinder
+from physics import em_physics
+from tally import tally, replicate_rate
+from weight_window import weight_window
+
+#
+# The variance reduction options change the weights and the number of photons, not the expected rate: every
+# option is compared with plain fiducial_scatter within a few standard deviations
+#
+
+
+@pytest.fixture(scope='module')
+def setup():
+    return dict(energy=1000., physics=em_physics(), geometry=cylinder(R=65., h=150.),
+                fiducial=cylinder(R=57., h=134.), vrt='fiducial_scatter', edep_max=250.)
+
+
+def run_rate(setup, nscatter, **kwargs):
+    """
+    Rate of nscatter events with fiducial_scatter and nscatter_max = nscatter
+
+    :param kwargs: extra transport settings
+    :return: rate, error
+    """
+    t = tally(fiducial=setup['fiducial'], nscatter=[nscatter], edep_max=250., emax=500., nbins=50)
+    t = driver.generate_tally(40000, tally=t, seed=kwargs.pop('seed', 1), nworkers=2, nscatter_max=nscatter,
+                              **setup, **kwargs)
+
+    return t.rate(nscatter)
+
+
+def assert_same_rate(a, b):
+    assert a[0] > 0
+    assert abs(a[0] - b[0]) < 4 * np.hypot(a[1], b[1])
+
+
+@pytest.mark.parametrize('nscatter', [1, 2])
+def test_weight_window_is_unbiased(setup, nscatter):
+    ww = weight_window(lower=[1e-3])
+    assert_same_rate(run_rate(setup, nscatter), run_rate(setup, nscatter, seed=2, weight_window=ww))
+
+
+@pytest.mark.parametrize('nscatter', [1, 2])
+def test_fiducial_source_is_unbiased(setup, nscatter):
+    assert_same_rate(run_rate(setup, nscatter), run_rate(setup, nscatter, seed=2, source_mode='fiducial'))
+
+
+@pytest.mark.parametrize('nscatter', [1, 2])
+def test_sobol_is_unbiased(setup, nscatter):
+    t = tally(fiducial=setup['fiducial'], nscatter=[nscatter], edep_max=250., emax=500., nbins=50)
+    tallies = driver.generate_replicates(4096, nreplicates=8, tally=t, seed=2, sampler='sobol', nworkers=2,
+                                         nscatter_max=nscatter, **setup)
+    assert_same_rate(run_rate(setup, nscatter), replicate_rate(tallies, nscatter))